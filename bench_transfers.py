@@ -0,0 +1,83 @@
+"""Нагрузочная проверка переводов: тысячи параллельных transfer_money на временных БД.
+
+Запуск: python bench_transfers.py --accounts 100 --transfers 5000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import tempfile
+import time
+
+import main
+
+
+async def run(accounts: int, transfers: int, initial: int, max_amount: int, seed: int):
+    random.seed(seed)
+    workdir = tempfile.mkdtemp(prefix="wvr_bench_")
+    main.CONFIG["DATABASES"] = {
+        name: os.path.join(workdir, filename) for name, filename in main.CONFIG["DATABASES"].items()
+    }
+
+    await main.open_databases()
+    try:
+        await main.migrate_databases()
+
+        ids = [f"bench{i}" for i in range(accounts)]
+        async with main.db_connection("civilian") as db:
+            await db.executemany(
+                "INSERT INTO civilians (id, nickname, telegram_uid, role) VALUES (?, ?, ?, 'resident')",
+                [(user_id, user_id, str(100000 + i)) for i, user_id in enumerate(ids)]
+            )
+            await db.commit()
+        async with main.db_connection("bank") as db:
+            await db.executemany(
+                "INSERT INTO accounts (id, balance, salary) VALUES (?, ?, 0)",
+                [(user_id, initial) for user_id in ids]
+            )
+            await db.commit()
+        await main.warm_identity_cache()
+
+        jobs = []
+        for _ in range(transfers):
+            sender, recipient = random.sample(range(accounts), 2)
+            jobs.append(main.transfer_money(str(100000 + sender), ids[recipient], random.randint(1, max_amount)))
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*jobs)
+        elapsed = time.perf_counter() - started
+
+        async with main.db_connection("bank") as db:
+            cursor = await db.execute("SELECT SUM(balance), MIN(balance) FROM accounts")
+            total, minimum = await cursor.fetchone()
+            cursor = await db.execute("SELECT COUNT(*) FROM transactions WHERE type = 'transfer'")
+            logged = (await cursor.fetchone())[0]
+
+        succeeded = sum(results)
+        print(f"переводов: {transfers}, успешных: {succeeded}, отклонено: {transfers - succeeded}")
+        print(f"время: {elapsed:.3f} с, {transfers / elapsed:.0f} переводов/с")
+        print(f"писатель bank.db: {main.BANK_WRITER.stats()}")
+
+        assert total == accounts * initial, f"сумма балансов изменилась: {total} != {accounts * initial}"
+        assert minimum >= 0, f"отрицательный баланс: {minimum}"
+        assert logged == succeeded, f"записей в журнале {logged}, успешных переводов {succeeded}"
+        print("OK: деньги не созданы и не потеряны")
+    finally:
+        await main.close_databases()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--accounts", type=int, default=100)
+    parser.add_argument("--transfers", type=int, default=5000)
+    parser.add_argument("--initial", type=int, default=1000)
+    parser.add_argument("--max-amount", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.getLogger("main").setLevel(logging.CRITICAL)
+    asyncio.run(run(args.accounts, args.transfers, args.initial, args.max_amount, args.seed))
@@ -1,19 +1,33 @@
 import asyncio
+import base64
+import bisect
+import csv
+import io
 import json
 import logging
 import os
+import random
 import sqlite3
+import tempfile
+import threading
+import time
 import uuid
-from datetime import datetime
-from typing import Dict, List, Optional
+from collections import Counter
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Union
 
 import aiosqlite
 import gspread
+from aiolimiter import AsyncLimiter
 import telegram.error
+from cachetools import TTLCache
 from google.oauth2.service_account import Credentials
 from telegram import (
     InlineKeyboardButton,
     InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
     Update,
     ReplyKeyboardRemove,
     ReplyKeyboardMarkup,
@@ -26,6 +40,7 @@ from telegram.ext import (
     CommandHandler,
     ContextTypes,
     ConversationHandler,
+    InlineQueryHandler,
     filters,
 )
 
@@ -43,8 +58,58 @@ CONFIG = {
     "BANK_SHEET_URL": "https://docs.google.com/spreadsheets/d/1sEsl_1GOOrqrq0tRNh1WrmzsoVH-8Lnl2GRGzzV2vo0/edit",
     "ROLES_SHEET_URL": "https://docs.google.com/spreadsheets/d/1mDlLMhev9irM1ZieFd5OPtBu5l3diD9pIqVeQdFTOWU/edit",
     "SYNC_INTERVAL": 1800,
+    "SYNC_RETRIES": 3,
+    "SYNC_RETRY_DELAY": 5,
+    "BANK_EXPORT_INTERVAL": 900,
+    "BANK_EXPORT_BATCH": 500,
+    "RECONCILE_INTERVAL": 3600,
+    "PAYROLL_CHECK_INTERVAL": 3600,
+    "PAYROLL_PERIOD_FORMAT": "%Y-%m",  # период выплаты зарплаты: раз в месяц
+    "PAYROLL_DAY": 0,  # день месяца автоматической выплаты, 0 - только командой /payroll
+    "BANK_ACCOUNTS_WORKSHEET": "Accounts",
+    "BANK_TRANSACTIONS_WORKSHEET": "Transactions",
+    "SHEETS_REQUESTS_PER_MINUTE": 50,
     "ADMIN_NOTIFICATIONS_DIR": "admin_notifications",
     "BLACKLIST_FILE": "blacklist.json",
+    "EXPORT_APPLICATIONS_JSON": False,
+    "DATABASES": {
+        "civilian": "civilian.db",
+        "bank": "bank.db",
+        "tasks": "tasks.db",
+    },
+    "DB_POOL_SIZE": 4,
+    "DB_PRAGMAS": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16000,
+        "mmap_size": 64 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    },
+    "BANK_WRITE_BATCH": 64,
+    "IDENTITY_CACHE_SIZE": 10000,
+    "IDENTITY_CACHE_TTL": 600,
+    "IDEMPOTENCY_CACHE_SIZE": 10000,
+    "IDEMPOTENCY_CACHE_TTL": 3600,
+    "STATEMENT_PREVIEW_ROWS": 10,
+    "STATEMENT_SPOOL_SIZE": 1024 * 1024,
+    "STATEMENT_CSV_BATCH": 500,  # строк CSV за один переход в рабочий поток
+    "STATEMENT_COMMENT_LIMIT": 200,  # символов комментария в превью выписки
+    "NOTIFY_WORKERS": 8,
+    "NOTIFY_GLOBAL_RATE": 25,  # сообщений в секунду на бота, у Telegram лимит ~30
+    "NOTIFY_CHAT_RATE": 1,  # сообщений в секунду в один чат
+    "NOTIFY_MAX_ATTEMPTS": 5,
+    "NOTIFY_RETRY_DELAY": 1,
+    "NOTIFY_DRAIN_TIMEOUT": 10,
+    "BROADCAST_WINDOW": 50,  # сколько сообщений рассылки одновременно стоит в очереди уведомлений
+    "BROADCAST_FLUSH_BATCH": 100,
+    "BATCH_MAX_FILE_SIZE": 256 * 1024,
+    "BATCH_MAX_ROWS": 1000,
+    "TASK_PICK_LIMIT": 16,  # кнопок в списке заданий, которые можно взять
+    "RESIDENT_SEARCH_LIMIT": 8,
+    "RESIDENT_SEARCH_MIN_SCORE": 0.4,  # доля триграмм запроса, найденных в нике
+    "INLINE_CACHE_SIZE": 2048,
+    "INLINE_CACHE_TTL": 30,
 }
 
 REGISTRATION, MC_NICKNAME, DISCORD_NICKNAME, BIRTHDAY, REGISTRATION_CONFIRM = range(5)
@@ -55,6 +120,8 @@ DEPOSIT, DEPOSIT_USER, DEPOSIT_AMOUNT, DEPOSIT_REASON = range(4)
 WITHDRAW, WITHDRAW_USER, WITHDRAW_AMOUNT, WITHDRAW_REASON = range(4)
 EXCHANGE, EXCHANGE_AMOUNT, EXCHANGE_USER = range(3)
 ADMIN_ACTIONS = range(1)
+BROADCAST_AUDIENCE, BROADCAST_TEXT, BROADCAST_CONFIRM = range(3)
+BATCH_FILE, BATCH_CONFIRM = range(2)
 
 # Роли пользователей
 ROLES = {
@@ -92,90 +159,865 @@ def init_google_sheets():
         return None
 
 
+GSPREAD_CLIENT = None
+GSPREAD_CLIENT_LOCK = threading.Lock()
+SYNC_LOCK = asyncio.Lock()
+
+
+def get_gspread_client():
+    """Возвращает авторизованный клиент gspread, создавая его при первом обращении"""
+    global GSPREAD_CLIENT
+    with GSPREAD_CLIENT_LOCK:
+        if GSPREAD_CLIENT is None:
+            GSPREAD_CLIENT = init_google_sheets()
+        if GSPREAD_CLIENT is None:
+            raise RuntimeError("клиент Google Sheets не инициализирован")
+        return GSPREAD_CLIENT
+
+
+def fetch_civilian_records() -> List[Dict]:
+    """Загружает лист Team. Блокирующий вызов, выполняется в отдельном потоке"""
+    gc = get_gspread_client()
+    sh = gc.open_by_url(CONFIG["CIVILIAN_SHEET_URL"])
+    worksheet = sh.worksheet("Team")
+    return worksheet.get_all_records()
+
+
 async def sync_with_google_sheets(context: ContextTypes.DEFAULT_TYPE = None):
-    try:
-        gc = gspread.service_account(filename=CONFIG["GOOGLE_SHEETS_CREDENTIALS"])
-
-        sh = gc.open_by_url(CONFIG["CIVILIAN_SHEET_URL"])
-        worksheet = sh.worksheet("Team")
-        records = worksheet.get_all_records()
-
-        async with aiosqlite.connect("civilian.db") as db:
-            await db.execute("DELETE FROM civilians")
-            for row in records:
-                if row.get("is_resident", "").upper() == "TRUE":
-                    await db.execute(
-                        """INSERT INTO civilians (id, nickname, discord, telegram_uid, role)
-                        VALUES (?, ?, ?, ?, ?)""",
-                        (row["id"], row["nickname"], row.get("discord"),
-                         row.get("telegram"), "resident")
-                    )
-            await db.commit()
+    if SYNC_LOCK.locked():
+        logger.info("Синхронизация уже выполняется, запуск пропущен")
+        return False
 
-        logger.info(f"Синхронизировано {len(records)} записей горожан")
-        return True
-    except Exception as e:
-        logger.error(f"Ошибка синхронизации: {str(e)}")
+    async with SYNC_LOCK:
+        retries = CONFIG["SYNC_RETRIES"]
+        for attempt in range(1, retries + 1):
+            try:
+                records = await asyncio.to_thread(fetch_civilian_records)
+
+                stats = await apply_civilians_snapshot(records)
+                if stats["inserted"] or stats["updated"] or stats["deleted"] or stats["deactivated"]:
+                    await warm_identity_cache()
+                    await rebuild_resident_index()
+
+                logger.info(
+                    f"Синхронизировано {len(records)} записей горожан: "
+                    f"добавлено {stats['inserted']}, обновлено {stats['updated']}, "
+                    f"удалено {stats['deleted']}, переведено в гости {stats['deactivated']}, "
+                    f"без изменений {stats['unchanged']} "
+                    f"за {stats['duration']:.3f} с"
+                )
+                return True
+            except Exception as e:
+                logger.error(f"Ошибка синхронизации (попытка {attempt}/{retries}): {str(e)}")
+                if attempt < retries:
+                    delay = CONFIG["SYNC_RETRY_DELAY"] * 2 ** (attempt - 1)
+                    await asyncio.sleep(delay * random.uniform(0.5, 1.5))
         return False
 
 
-# Инициализация баз данных
-async def init_databases():
-    try:
-        os.makedirs(CONFIG["ADMIN_NOTIFICATIONS_DIR"], exist_ok=True)
+def normalize_sheet_value(value) -> Optional[str]:
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+async def apply_civilians_snapshot(records: List[Dict]) -> Dict:
+    """Приводит таблицу civilians к снимку листа, меняя только отличающиеся строки.
+
+    Лист владеет колонками nickname и discord. Колонка role и уже привязанный
+    telegram_uid принадлежат боту и при синхронизации не перезаписываются.
+    Пропавшие из листа горожане удаляются, только если бот ничего о них не знает:
+    привязанный житель становится гостем, банкиры и администраторы не трогаются.
+    Вернувшийся в лист житель снова становится жителем, только если гостем его
+    сделала синхронизация (deactivated_by_sync), а не администратор."""
+    started = time.monotonic()
+
+    sheet = {}
+    for row in records:
+        if str(row.get("is_resident", "")).upper() != "TRUE":
+            continue
+        civilian_id = normalize_sheet_value(row.get("id"))
+        if not civilian_id:
+            continue
+        sheet[civilian_id] = (
+            normalize_sheet_value(row.get("nickname")) or "",
+            normalize_sheet_value(row.get("discord")),
+            normalize_sheet_value(row.get("telegram")),
+        )
 
-        async with aiosqlite.connect("civilian.db") as db:
-            await db.execute(
-                """CREATE TABLE IF NOT EXISTS civilians (
-                    id TEXT PRIMARY KEY,
-                    nickname TEXT NOT NULL,
-                    discord TEXT,
-                    telegram_uid TEXT,
-                    role TEXT DEFAULT 'civilian'
-                )"""
+    if not sheet:
+        logger.warning("В листе нет ни одного жителя, синхронизация пропущена")
+        return {"inserted": 0, "updated": 0, "deleted": 0, "deactivated": 0, "unchanged": 0,
+                "duration": time.monotonic() - started}
+
+    async with db_connection("civilian") as db:
+        cursor = await db.execute(
+            "SELECT id, nickname, discord, telegram_uid, role, deactivated_by_sync FROM civilians"
+        )
+        local = {row[0]: row[1:] for row in await cursor.fetchall()}
+
+        inserts, updates = [], []
+        for civilian_id, (nickname, discord, telegram_uid) in sheet.items():
+            current = local.get(civilian_id)
+            if current is None:
+                inserts.append((civilian_id, nickname, discord, telegram_uid, "resident"))
+            elif ((current[0], current[1]) != (nickname, discord) or (not current[2] and telegram_uid)
+                  or current[4]):
+                updates.append((nickname, discord, telegram_uid, civilian_id))
+
+        deletes, deactivations = [], []
+        for civilian_id, (_, _, telegram_uid, role, _) in local.items():
+            if civilian_id in sheet or role in ("banker", "admin", "guest"):
+                continue
+            if telegram_uid:
+                deactivations.append((civilian_id,))
+            else:
+                deletes.append((civilian_id,))
+
+        if inserts or updates or deletes or deactivations:
+            await db.execute("BEGIN IMMEDIATE")
+            await db.executemany(
+                """INSERT INTO civilians (id, nickname, discord, telegram_uid, role)
+                VALUES (?, ?, ?, ?, ?)""",
+                inserts
+            )
+            await db.executemany(
+                """UPDATE civilians
+                SET nickname = ?, discord = ?, telegram_uid = COALESCE(NULLIF(telegram_uid, ''), ?),
+                    role = CASE WHEN deactivated_by_sync THEN 'resident' ELSE role END,
+                    deactivated_by_sync = FALSE
+                WHERE id = ?""",
+                updates
+            )
+            await db.executemany("DELETE FROM civilians WHERE id = ?", deletes)
+            await db.executemany(
+                "UPDATE civilians SET role = 'guest', deactivated_by_sync = TRUE WHERE id = ?", deactivations
             )
             await db.commit()
 
-        await sync_with_google_sheets()
+    return {
+        "inserted": len(inserts),
+        "updated": len(updates),
+        "deleted": len(deletes),
+        "deactivated": len(deactivations),
+        "unchanged": len(sheet) - len(inserts) - len(updates),
+        "duration": time.monotonic() - started,
+    }
 
-        async with aiosqlite.connect("bank.db") as db:
-            await db.execute(
-                """CREATE TABLE IF NOT EXISTS accounts (
-                    id TEXT PRIMARY KEY,
-                    balance INTEGER DEFAULT 0,
-                    salary INTEGER DEFAULT 0
-                )"""
+
+# Выгрузка банка в BANK_SHEET_URL
+SHEETS_LIMITER = AsyncLimiter(CONFIG["SHEETS_REQUESTS_PER_MINUTE"], 60)
+EXPORT_LOCK = asyncio.Lock()
+ACCOUNTS_HEADER = ["id", "balance", "salary"]
+TRANSACTIONS_HEADER = ["id", "user_id", "type", "date", "from_user", "to_user", "amount", "comment"]
+
+
+async def sheets_call(func, *args, **kwargs):
+    """Выполняет блокирующий вызов gspread в потоке, не превышая квоту Sheets API"""
+    async with SHEETS_LIMITER:
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+
+async def get_export_mark(name: str) -> int:
+    async with db_connection("bank") as db:
+        cursor = await db.execute("SELECT value FROM export_state WHERE name = ?", (name,))
+        result = await cursor.fetchone()
+        return result[0] if result else 0
+
+
+async def set_export_mark(name: str, value: int):
+    async def operation(db):
+        await db.execute(
+            """INSERT INTO export_state (name, value) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET value = excluded.value""",
+            (name, value)
+        )
+
+    await bank_write(operation)
+
+
+def column_letter(number: int) -> str:
+    letters = ""
+    while number:
+        number, rest = divmod(number - 1, 26)
+        letters = chr(ord("A") + rest) + letters
+    return letters
+
+
+async def get_exported_transaction_id(worksheet) -> int:
+    """ID последней транзакции, уже записанной в лист (0, если лист пуст)"""
+    ids = await sheets_call(worksheet.col_values, 1)
+    for value in reversed(ids[1:]):
+        if str(value).strip().isdigit():
+            return int(value)
+    return 0
+
+
+async def export_bank_ledger(context: ContextTypes.DEFAULT_TYPE = None, client=None) -> Optional[Dict]:
+    """Выгружает балансы счетов и новые транзакции в таблицу банка.
+
+    Балансы перезаписываются одним диапазоном, хвост прежнего списка очищается.
+    Транзакции дописываются пачками после последнего ID в листе: лист, а не
+    export_state, решает, что уже выгружено, поэтому сбой между дозаписью и
+    сохранением отметки не приводит к повторам. client позволяет подставить
+    собственный объект с интерфейсом gspread."""
+    if EXPORT_LOCK.locked():
+        logger.info("Выгрузка банка уже выполняется, запуск пропущен")
+        return None
+
+    async with EXPORT_LOCK:
+        started = time.monotonic()
+        try:
+            if client is None:
+                client = await asyncio.to_thread(get_gspread_client)
+            spreadsheet = await sheets_call(client.open_by_url, CONFIG["BANK_SHEET_URL"])
+            accounts_ws = await sheets_call(spreadsheet.worksheet, CONFIG["BANK_ACCOUNTS_WORKSHEET"])
+            transactions_ws = await sheets_call(spreadsheet.worksheet, CONFIG["BANK_TRANSACTIONS_WORKSHEET"])
+
+            async with db_connection("bank") as db:
+                cursor = await db.execute("SELECT id, balance, salary FROM accounts ORDER BY id")
+                accounts = [list(row) for row in await cursor.fetchall()]
+            await sheets_call(accounts_ws.update, values=[ACCOUNTS_HEADER] + accounts, range_name="A1")
+            await sheets_call(
+                accounts_ws.batch_clear, [f"A{len(accounts) + 2}:{column_letter(len(ACCOUNTS_HEADER))}"]
             )
-            await db.execute(
-                """CREATE TABLE IF NOT EXISTS transactions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id TEXT,
-                    type TEXT,
-                    date TEXT,
-                    from_user TEXT,
-                    to_user TEXT,
-                    amount INTEGER,
-                    comment TEXT
-                )"""
+
+            exported = 0
+            last_id = await get_exported_transaction_id(transactions_ws)
+            mark = await get_export_mark("transactions")
+            if last_id != mark:
+                logger.warning(f"Отметка выгрузки {mark} расходится с листом ({last_id}), используется лист")
+                await set_export_mark("transactions", last_id)
+            if last_id == 0:
+                await sheets_call(transactions_ws.update, values=[TRANSACTIONS_HEADER], range_name="A1")
+
+            while True:
+                async with db_connection("bank") as db:
+                    cursor = await db.execute(
+                        f"""SELECT {", ".join(TRANSACTIONS_HEADER)} FROM transactions
+                        WHERE id > ? ORDER BY id LIMIT ?""",
+                        (last_id, CONFIG["BANK_EXPORT_BATCH"])
+                    )
+                    rows = [list(row) for row in await cursor.fetchall()]
+                if not rows:
+                    break
+
+                await sheets_call(transactions_ws.append_rows, rows, value_input_option="RAW")
+                last_id = rows[-1][0]
+                exported += len(rows)
+                await set_export_mark("transactions", last_id)
+
+                if len(rows) < CONFIG["BANK_EXPORT_BATCH"]:
+                    break
+
+            stats = {
+                "accounts": len(accounts),
+                "transactions": exported,
+                "last_transaction_id": last_id,
+                "duration": time.monotonic() - started,
+            }
+            logger.info(
+                f"Банк выгружен: {stats['accounts']} счетов, {stats['transactions']} новых транзакций "
+                f"за {stats['duration']:.3f} с"
             )
-            await db.commit()
+            return stats
+        except Exception as e:
+            logger.error(f"Ошибка выгрузки банка: {e}")
+            return None
 
-        async with aiosqlite.connect("tasks.db") as db:
-            await db.execute(
-                """CREATE TABLE IF NOT EXISTS tasks (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    task_type TEXT,
-                    count INTEGER,
-                    cost INTEGER NOT NULL,
-                    social_type TEXT NOT NULL,
-                    deadline TEXT,
-                    description TEXT,
-                    assigned_to TEXT,
-                    completed BOOLEAN DEFAULT FALSE
-                )"""
+
+# Пул соединений с базами данных
+class ConnectionPool:
+    """Пул постоянных соединений с одним файлом базы данных.
+
+    attach - {псевдоним: путь} баз, подключаемых к каждому соединению через ATTACH"""
+
+    def __init__(self, path: str, size: int, attach: Dict[str, str] = None):
+        self.path = path
+        self.size = size
+        self.attach = attach or {}
+        self._connections: List[aiosqlite.Connection] = []
+        self._idle: Optional[asyncio.Queue] = None
+        self.checkouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.in_use = 0
+        self.max_in_use = 0
+
+    async def open(self):
+        self._idle = asyncio.Queue()
+        for _ in range(self.size):
+            db = await aiosqlite.connect(self.path)
+            await configure_connection(db)
+            for alias, path in self.attach.items():
+                await db.execute(f"ATTACH DATABASE ? AS {alias}", (path,))
+            self._connections.append(db)
+            self._idle.put_nowait(db)
+
+    async def close(self):
+        for db in self._connections:
+            try:
+                await db.close()
+            except Exception as e:
+                logger.error(f"Ошибка закрытия соединения с {self.path}: {e}")
+        self._connections.clear()
+        self._idle = None
+
+    @asynccontextmanager
+    async def connection(self):
+        started = time.monotonic()
+        db = await self._idle.get()
+        waited = time.monotonic() - started
+
+        self.checkouts += 1
+        self.wait_time += waited
+        self.max_wait_time = max(self.max_wait_time, waited)
+        self.in_use += 1
+        self.max_in_use = max(self.max_in_use, self.in_use)
+        try:
+            yield db
+        finally:
+            try:
+                if db.in_transaction:
+                    await db.rollback()
+            except Exception as e:
+                logger.error(f"Ошибка отката транзакции в {self.path}: {e}")
+            self.in_use -= 1
+            self._idle.put_nowait(db)
+
+    def stats(self) -> Dict:
+        return {
+            "size": self.size,
+            "checkouts": self.checkouts,
+            "in_use": self.in_use,
+            "max_in_use": self.max_in_use,
+            "wait_time": round(self.wait_time, 4),
+            "avg_wait_time": round(self.wait_time / self.checkouts, 6) if self.checkouts else 0.0,
+            "max_wait_time": round(self.max_wait_time, 4),
+        }
+
+
+async def configure_connection(db: aiosqlite.Connection):
+    for pragma, value in CONFIG["DB_PRAGMAS"].items():
+        await db.execute(f"PRAGMA {pragma}={value}")
+
+
+class BankWriter:
+    """Единственный писатель bank.db: выполняет операции группами в общей транзакции"""
+
+    def __init__(self, path: str, batch_size: int):
+        self.path = path
+        self.batch_size = batch_size
+        self._db: Optional[aiosqlite.Connection] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.operations = 0
+        self.failed = 0
+
+    async def start(self):
+        self._db = await aiosqlite.connect(self.path, isolation_level=None)
+        await configure_connection(self._db)
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self._task:
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        await self._db.close()
+        self._task = None
+
+    async def submit(self, operation):
+        """Ставит операцию в очередь и ждет ее результата.
+
+        operation - корутина-функция, принимающая соединение. Она выполняется
+        внутри точки сохранения и не должна сама вызывать commit."""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((operation, future))
+        return await future
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+
+            batch = [item]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._commit_batch(batch)
+
+    async def _commit_batch(self, batch: List[tuple]):
+        outcomes = []
+        try:
+            await self._db.execute("BEGIN IMMEDIATE")
+            for operation, future in batch:
+                await self._db.execute("SAVEPOINT ledger_op")
+                try:
+                    result = await operation(self._db)
+                except Exception as e:
+                    await self._db.execute("ROLLBACK TO SAVEPOINT ledger_op")
+                    await self._db.execute("RELEASE SAVEPOINT ledger_op")
+                    outcomes.append((future, None, e))
+                    continue
+                await self._db.execute("RELEASE SAVEPOINT ledger_op")
+                outcomes.append((future, result, None))
+            await self._db.execute("COMMIT")
+        except Exception as e:
+            logger.error(f"Ошибка записи пакета в {self.path}: {e}")
+            if self._db.in_transaction:
+                await self._db.execute("ROLLBACK")
+            outcomes = [(future, None, e) for _, future in batch]
+
+        self.batches += 1
+        for future, result, error in outcomes:
+            self.operations += 1
+            if future.cancelled():
+                continue
+            if error is not None:
+                self.failed += 1
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> Dict:
+        return {
+            "batches": self.batches,
+            "operations": self.operations,
+            "failed": self.failed,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "avg_batch": round(self.operations / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+DB_POOLS: Dict[str, ConnectionPool] = {}
+BANK_WRITER: Optional[BankWriter] = None
+
+
+# Пул для чтения с join между базами: civilian.db основная, bank.db и tasks.db
+# подключены как схемы bank и tasks. Запись идет через пулы отдельных баз и писателя.
+JOINED_POOL = "joined"
+
+
+def db_connection(name: str):
+    """Выдает соединение из пула базы name ("civilian", "bank", "tasks" или JOINED_POOL)"""
+    return DB_POOLS[name].connection()
+
+
+def get_pool_stats() -> Dict[str, Dict]:
+    return {name: pool.stats() for name, pool in DB_POOLS.items()}
+
+
+async def bank_write(operation):
+    """Выполняет изменяющую операцию над bank.db через общего писателя"""
+    return await BANK_WRITER.submit(operation)
+
+
+# Результат ledger_write для уже примененного ключа: операция проведена раньше,
+# вызывающий код не должен повторять побочные эффекты (уведомления)
+ALREADY_APPLIED = "already_applied"
+# Недавно примененные ключи идемпотентности, чтобы повтор не доходил до БД
+RECENT_IDEMPOTENCY_KEYS = TTLCache(
+    maxsize=CONFIG["IDEMPOTENCY_CACHE_SIZE"], ttl=CONFIG["IDEMPOTENCY_CACHE_TTL"]
+)
+
+
+def idempotency_key(update: Update, operation: str) -> str:
+    """Ключ денежной операции: исходное сообщение не меняется при повторной доставке
+    апдейта и при повторном нажатии кнопки"""
+    message = update.callback_query.message if update.callback_query else update.effective_message
+    if message:
+        return f"{operation}:{message.chat_id}:{message.message_id}"
+    return f"{operation}:{update.update_id}"
+
+
+async def ledger_write(operation, key: Optional[str] = None):
+    """Выполняет денежную операцию через писателя bank.db не более одного раза на ключ.
+
+    Повтор с уже примененным ключом возвращает ALREADY_APPLIED без изменений.
+    Операция должна записать key в transactions.idempotency_key."""
+    if key is None:
+        return await bank_write(operation)
+
+    if key in RECENT_IDEMPOTENCY_KEYS:
+        logger.info(f"Повтор операции {key} пропущен")
+        return ALREADY_APPLIED
+
+    async def guarded(db):
+        cursor = await db.execute(
+            "SELECT 1 FROM transactions WHERE idempotency_key = ? LIMIT 1", (key,)
+        )
+        if await cursor.fetchone():
+            logger.info(f"Повтор операции {key} пропущен")
+            return ALREADY_APPLIED
+        return await operation(db)
+
+    result = await bank_write(guarded)
+    if result:
+        RECENT_IDEMPOTENCY_KEYS[key] = True
+    return result
+
+
+async def open_databases():
+    global BANK_WRITER
+
+    for name, path in CONFIG["DATABASES"].items():
+        if name in DB_POOLS:
+            continue
+        pool = ConnectionPool(path, CONFIG["DB_POOL_SIZE"])
+        await pool.open()
+        DB_POOLS[name] = pool
+
+    if JOINED_POOL not in DB_POOLS:
+        databases = CONFIG["DATABASES"]
+        pool = ConnectionPool(
+            databases["civilian"], CONFIG["DB_POOL_SIZE"],
+            attach={"bank": databases["bank"], "tasks": databases["tasks"]}
+        )
+        await pool.open()
+        DB_POOLS[JOINED_POOL] = pool
+
+    if BANK_WRITER is None:
+        BANK_WRITER = BankWriter(CONFIG["DATABASES"]["bank"], CONFIG["BANK_WRITE_BATCH"])
+        await BANK_WRITER.start()
+
+
+async def close_databases(application: Application = None):
+    global BANK_WRITER
+
+    if BANK_WRITER is not None:
+        logger.info(f"Статистика записи в bank.db: {BANK_WRITER.stats()}")
+        await BANK_WRITER.stop()
+        BANK_WRITER = None
+
+    for name, pool in list(DB_POOLS.items()):
+        logger.info(f"Статистика пула {name}: {pool.stats()}")
+        await pool.close()
+    DB_POOLS.clear()
+
+
+# Миграции схемы. Для каждой базы - упорядоченный список (версия, описание, шаги),
+# шаг - SQL-выражение или корутина-функция, принимающая соединение.
+# Уже выпущенные миграции не меняются, изменения схемы добавляются новой версией.
+def add_column(table: str, column: str, definition: str):
+    async def step(db):
+        cursor = await db.execute(f"PRAGMA table_info({table})")
+        if column not in [row[1] for row in await cursor.fetchall()]:
+            await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return step
+
+
+async def seed_payroll_period(db):
+    """Отмечает текущий период оплаченным, если выплат еще не было.
+
+    Зарплату до появления бота платили вручную, поэтому первый запуск не должен
+    выплатить текущий месяц повторно. Администратор может снять отметку командой /payroll"""
+    cursor = await db.execute("SELECT 1 FROM payroll_runs LIMIT 1")
+    if await cursor.fetchone():
+        return
+    await db.execute(
+        "INSERT INTO payroll_runs (period, paid_at, source) VALUES (?, ?, 'seed')",
+        (datetime.now().strftime(CONFIG["PAYROLL_PERIOD_FORMAT"]), datetime.now().isoformat())
+    )
+
+
+MIGRATIONS = {
+    "civilian": [
+        (1, "базовые таблицы", [
+            """CREATE TABLE IF NOT EXISTS civilians (
+                id TEXT PRIMARY KEY,
+                nickname TEXT NOT NULL,
+                discord TEXT,
+                telegram_uid TEXT,
+                role TEXT DEFAULT 'civilian'
+            )""",
+            """CREATE TABLE IF NOT EXISTS blacklist (
+                id TEXT PRIMARY KEY,
+                nickname TEXT,
+                reason TEXT,
+                block_date TEXT
+            )""",
+            """CREATE TABLE IF NOT EXISTS applications (
+                application_id TEXT PRIMARY KEY,
+                telegram_uid TEXT NOT NULL,
+                mc_nickname TEXT,
+                discord_nickname TEXT,
+                birthday TEXT,
+                timestamp TEXT,
+                status TEXT DEFAULT 'pending'
+            )""",
+            "CREATE INDEX IF NOT EXISTS idx_applications_telegram_uid ON applications (telegram_uid)",
+            "CREATE INDEX IF NOT EXISTS idx_applications_status ON applications (status)",
+        ]),
+        (2, "индексы горожан", [
+            "CREATE INDEX IF NOT EXISTS idx_civilians_telegram_uid ON civilians (telegram_uid)",
+            "CREATE INDEX IF NOT EXISTS idx_civilians_role ON civilians (role)",
+            "CREATE INDEX IF NOT EXISTS idx_civilians_nickname ON civilians (nickname)",
+            "CREATE INDEX IF NOT EXISTS idx_civilians_discord ON civilians (discord)",
+        ]),
+        (3, "рассылки", [
+            """CREATE TABLE IF NOT EXISTS broadcasts (
+                id TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                audience TEXT NOT NULL,
+                created_by TEXT,
+                created_at TEXT,
+                finished_at TEXT,
+                status TEXT DEFAULT 'running'
+            )""",
+            """CREATE TABLE IF NOT EXISTS broadcast_recipients (
+                broadcast_id TEXT NOT NULL,
+                telegram_uid TEXT NOT NULL,
+                status TEXT DEFAULT 'pending',
+                PRIMARY KEY (broadcast_id, telegram_uid)
+            ) WITHOUT ROWID""",
+            "CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts (status)",
+            """CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_status
+            ON broadcast_recipients (broadcast_id, status)""",
+        ]),
+        (4, "черный список по Telegram ID", [
+            # Блокировки из карточки жителя записывались по городскому ID
+            """UPDATE OR REPLACE blacklist SET id = (
+                SELECT c.telegram_uid FROM civilians c WHERE c.id = blacklist.id
             )
-            await db.commit()
+            WHERE id IN (SELECT id FROM civilians WHERE telegram_uid IS NOT NULL AND telegram_uid != '')
+            AND id NOT IN (SELECT telegram_uid FROM civilians WHERE telegram_uid IS NOT NULL)""",
+        ]),
+        (5, "отметка гостей, отключенных синхронизацией", [
+            add_column("civilians", "deactivated_by_sync", "BOOLEAN DEFAULT FALSE"),
+        ]),
+    ],
+    "bank": [
+        (1, "базовые таблицы", [
+            """CREATE TABLE IF NOT EXISTS accounts (
+                id TEXT PRIMARY KEY,
+                balance INTEGER DEFAULT 0,
+                salary INTEGER DEFAULT 0
+            )""",
+            """CREATE TABLE IF NOT EXISTS transactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT,
+                type TEXT,
+                date TEXT,
+                from_user TEXT,
+                to_user TEXT,
+                amount INTEGER,
+                comment TEXT
+            )""",
+            """CREATE TABLE IF NOT EXISTS export_state (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )""",
+        ]),
+        (2, "ключи идемпотентности", [
+            add_column("transactions", "idempotency_key", "TEXT"),
+            """CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_idempotency_key
+            ON transactions (idempotency_key) WHERE idempotency_key IS NOT NULL""",
+        ]),
+        (3, "индексы транзакций", [
+            "CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (date)",
+            "CREATE INDEX IF NOT EXISTS idx_transactions_user_id ON transactions (user_id)",
+            "CREATE INDEX IF NOT EXISTS idx_transactions_from_user ON transactions (from_user)",
+            "CREATE INDEX IF NOT EXISTS idx_transactions_to_user ON transactions (to_user)",
+        ]),
+        (4, "составные индексы для keyset-пагинации", [
+            "CREATE INDEX IF NOT EXISTS idx_transactions_date_id ON transactions (date, id)",
+            "CREATE INDEX IF NOT EXISTS idx_transactions_user_date_id ON transactions (user_id, date, id)",
+            "DROP INDEX IF EXISTS idx_transactions_date",
+            "DROP INDEX IF EXISTS idx_transactions_user_id",
+        ]),
+        (5, "контрольные точки балансов", [
+            """CREATE TABLE IF NOT EXISTS balance_checkpoints (
+                account_id TEXT PRIMARY KEY,
+                tx_id INTEGER NOT NULL,
+                balance INTEGER NOT NULL,
+                created_at TEXT
+            )""",
+        ]),
+        (6, "выплаты зарплаты", [
+            """CREATE TABLE IF NOT EXISTS payroll_runs (
+                period TEXT PRIMARY KEY,
+                paid_at TEXT NOT NULL,
+                accounts INTEGER DEFAULT 0,
+                total INTEGER DEFAULT 0
+            )""",
+        ]),
+        (7, "источник выплаты зарплаты", [
+            add_column("payroll_runs", "source", "TEXT DEFAULT 'auto'"),
+            seed_payroll_period,
+        ]),
+    ],
+    "tasks": [
+        (1, "базовые таблицы", [
+            """CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                task_type TEXT,
+                count INTEGER,
+                cost INTEGER NOT NULL,
+                social_type TEXT NOT NULL,
+                deadline TEXT,
+                description TEXT,
+                assigned_to TEXT,
+                completed BOOLEAN DEFAULT FALSE
+            )""",
+        ]),
+        (2, "индексы заданий", [
+            "CREATE INDEX IF NOT EXISTS idx_tasks_completed ON tasks (completed)",
+            "CREATE INDEX IF NOT EXISTS idx_tasks_completed_social_type ON tasks (completed, social_type)",
+        ]),
+        (3, "индекс исполнителей заданий", [
+            "CREATE INDEX IF NOT EXISTS idx_tasks_assigned_to ON tasks (assigned_to, completed)",
+        ]),
+        (4, "заявки на выполнение заданий", [
+            add_column("tasks", "claimed", "INTEGER DEFAULT 0"),
+            """CREATE TABLE IF NOT EXISTS task_claims (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                task_id INTEGER NOT NULL,
+                user_id TEXT NOT NULL,
+                telegram_uid TEXT,
+                status TEXT NOT NULL DEFAULT 'claimed',
+                proof TEXT,
+                claimed_at TEXT,
+                submitted_at TEXT,
+                reviewed_at TEXT,
+                reviewed_by TEXT
+            )""",
+            """CREATE UNIQUE INDEX IF NOT EXISTS idx_task_claims_active ON task_claims (task_id, user_id)
+            WHERE status IN ('claimed', 'submitted')""",
+            "CREATE INDEX IF NOT EXISTS idx_task_claims_user_status ON task_claims (user_id, status)",
+            "CREATE INDEX IF NOT EXISTS idx_task_claims_status ON task_claims (status)",
+        ]),
+    ],
+}
+
+# Горячие запросы, которые не должны деградировать до полного просмотра таблицы
+HOT_QUERIES = [
+    ("civilian", "SELECT id, nickname, role FROM civilians WHERE telegram_uid = ?", ("0",)),
+    ("civilian", "SELECT telegram_uid FROM civilians WHERE role = 'admin'", ()),
+    ("civilian", "SELECT id FROM civilians WHERE nickname = ? AND discord = ?", ("", "")),
+    ("civilian", "SELECT id FROM civilians WHERE nickname = ? OR discord = ?", ("", "")),
+    ("civilian", "SELECT 1 FROM applications WHERE telegram_uid = ? AND status = ?", ("0", "pending")),
+    ("bank", "SELECT * FROM transactions ORDER BY date DESC, id DESC LIMIT 10", ()),
+    ("bank", """SELECT * FROM transactions WHERE (date, id) < (?, ?)
+        ORDER BY date DESC, id DESC LIMIT 11""", ("", 0)),
+    ("bank", """SELECT * FROM transactions WHERE user_id = ? AND (date, id) < (?, ?)
+        ORDER BY date DESC, id DESC LIMIT 11""", ("", "", 0)),
+    ("bank", "SELECT * FROM transactions WHERE user_id = ?", ("",)),
+    ("bank", "SELECT 1 FROM transactions WHERE idempotency_key = ? LIMIT 1", ("",)),
+    ("bank", """SELECT id FROM transactions WHERE id IN (
+        SELECT id FROM (SELECT id FROM transactions WHERE user_id = :user_id
+                        ORDER BY date DESC, id DESC LIMIT :limit + 1)
+        UNION SELECT id FROM (SELECT id FROM transactions WHERE from_user = :user_id
+                              ORDER BY id DESC LIMIT :limit + 1)
+        UNION SELECT id FROM (SELECT id FROM transactions WHERE to_user = :user_id
+                              ORDER BY id DESC LIMIT :limit + 1)
+    ) ORDER BY id DESC LIMIT :limit + 1""", {"user_id": "", "limit": 10}),
+    ("tasks", """SELECT id FROM tasks
+        WHERE completed = FALSE AND (social_type = 'passive' OR social_type = 'active')""", ()),
+    ("tasks", "SELECT id FROM tasks WHERE completed = ? AND id < ? ORDER BY id DESC LIMIT 6", (False, 0)),
+    (JOINED_POOL, """SELECT a.balance FROM civilians c JOIN bank.accounts a ON a.id = c.id
+        WHERE c.telegram_uid = ?""", ("0",)),
+    (JOINED_POOL, """SELECT COUNT(*) FROM tasks.task_claims
+        WHERE user_id = ? AND status IN ('claimed', 'submitted')""", ("",)),
+    ("tasks", """SELECT id FROM task_claims
+        WHERE task_id = ? AND user_id = ? AND status IN ('claimed', 'submitted')""", (0, "")),
+]
+
+
+async def run_migrations(name: str):
+    """Применяет к базе name все миграции новее записанной в schema_version"""
+    async with db_connection(name) as db:
+        await db.execute(
+            """CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at TEXT
+            )"""
+        )
+        await db.commit()
+
+        cursor = await db.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        current = (await cursor.fetchone())[0]
+
+        for version, description, steps in MIGRATIONS[name]:
+            if version <= current:
+                continue
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                for step in steps:
+                    if callable(step):
+                        await step(db)
+                    else:
+                        await db.execute(step)
+                await db.execute(
+                    "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                    (version, description, datetime.now().isoformat())
+                )
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+            logger.info(f"Применена миграция {name} v{version}: {description}")
+
+
+async def migrate_databases():
+    for name in MIGRATIONS:
+        await run_migrations(name)
+
+
+async def explain_query_plan(name: str, query: str, params: tuple = ()) -> List[str]:
+    async with db_connection(name) as db:
+        # EXPLAIN не читает базу и не замечает изменений схемы из других соединений,
+        # поэтому схема сперва перечитывается обычным запросом
+        for schema in ["main", *DB_POOLS[name].attach]:
+            await db.execute(f"SELECT 1 FROM {schema}.sqlite_master LIMIT 1")
+        cursor = await db.execute(f"EXPLAIN QUERY PLAN {query}", params)
+        return [row[3] for row in await cursor.fetchall()]
+
+
+def full_scan_steps(plan: List[str]) -> List[str]:
+    """Шаги плана, читающие таблицу целиком или сортирующие во временном B-дереве.
+
+    Просмотр результата подзапроса (SCAN (subquery-N)) таблицу не читает и не учитывается"""
+    return [step for step in plan
+            if (step.startswith("SCAN") and "USING" not in step and not step.startswith("SCAN (subquery"))
+            or step.startswith("USE TEMP B-TREE")]
+
+
+async def check_query_plans() -> List[str]:
+    """Возвращает горячие запросы, план которых содержит полный просмотр таблицы"""
+    regressions = []
+    for name, query, params in HOT_QUERIES:
+        plan = await explain_query_plan(name, query, params)
+        if full_scan_steps(plan):
+            regressions.append(query)
+            logger.warning(f"Запрос выполняется полным просмотром таблицы ({name}): {query} -> {plan}")
+    return regressions
+
+
+async def init_databases():
+    try:
+        os.makedirs(CONFIG["ADMIN_NOTIFICATIONS_DIR"], exist_ok=True)
+        await open_databases()
+        await migrate_databases()
+        await check_query_plans()
+        await repair_task_rewards()
+
+        await load_blacklist()
+        await load_pending_applications()
+        await sync_with_google_sheets()
+        await warm_identity_cache()
+        await rebuild_resident_index()
 
         logger.info("Базы данных успешно инициализированы и синхронизированы")
     except Exception as e:
@@ -185,7 +1027,7 @@ async def init_databases():
 
 async def check_last_transaction():
     try:
-        async with aiosqlite.connect("bank.db") as db:
+        async with db_connection("bank") as db:
             cursor = await db.execute(
                 "SELECT * FROM transactions ORDER BY id DESC LIMIT 1"
             )
@@ -195,18 +1037,191 @@ async def check_last_transaction():
         logger.error(f"Ошибка проверки транзакций: {e}")
 
 
-# Функции для работы с пользователями
-async def get_user_role(telegram_uid: str) -> Optional[str]:
-    async with aiosqlite.connect("civilian.db") as db:
+# Кэш личностей: telegram_uid -> {"id", "nickname", "role"} или None для незарегистрированных
+IDENTITY_CACHE = TTLCache(maxsize=CONFIG["IDENTITY_CACHE_SIZE"], ttl=CONFIG["IDENTITY_CACHE_TTL"])
+
+
+async def warm_identity_cache():
+    """Заполняет кэш личностей всеми привязанными к Telegram горожанами"""
+    async with db_connection("civilian") as db:
+        cursor = await db.execute(
+            "SELECT telegram_uid, id, nickname, role FROM civilians "
+            "WHERE telegram_uid IS NOT NULL AND telegram_uid != ''"
+        )
+        rows = await cursor.fetchall()
+
+    IDENTITY_CACHE.clear()
+    for telegram_uid, user_id, nickname, role in rows:
+        IDENTITY_CACHE[str(telegram_uid)] = {"id": user_id, "nickname": nickname, "role": role}
+    logger.info(f"Кэш личностей прогрет: {len(IDENTITY_CACHE)} записей")
+
+
+def invalidate_identity(telegram_uid: str = None, city_id: str = None):
+    """Сбрасывает запись кэша по telegram_uid и/или городскому ID"""
+    global RESIDENT_INDEX
+    RESIDENT_INDEX = None
+    INLINE_SEARCH_CACHE.clear()
+    if telegram_uid is not None:
+        IDENTITY_CACHE.pop(str(telegram_uid), None)
+    if city_id is not None:
+        for key, identity in list(IDENTITY_CACHE.items()):
+            if identity and identity["id"] == city_id:
+                IDENTITY_CACHE.pop(key, None)
+
+
+def trigrams(text: str) -> set:
+    text = f"  {text.lower()} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class ResidentIndex:
+    """Снимок таблицы civilians в памяти для поиска горожан по ID и нику без запросов к БД.
+
+    Не изменяется после построения: при изменении горожан строится новый индекс."""
+
+    def __init__(self, rows):
+        self.by_id: Dict[str, Dict] = {}
+        self.by_nickname: Dict[str, List[Dict]] = {}
+        self.postings: Dict[str, List[Dict]] = {}
+        for user_id, nickname, telegram_uid, role in rows:
+            record = {"id": user_id, "nickname": nickname, "telegram_uid": telegram_uid, "role": role}
+            self.by_id[user_id] = record
+            if nickname:
+                self.by_nickname.setdefault(nickname.lower(), []).append(record)
+                for gram in trigrams(nickname):
+                    self.postings.setdefault(gram, []).append(record)
+        self.sorted_nicknames = sorted(self.by_nickname)
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def resolve(self, query: str) -> List[Dict]:
+        """Точное совпадение по городскому ID, иначе по нику без учета регистра"""
+        query = query.strip()
+        if query in self.by_id:
+            return [self.by_id[query]]
+        return self.by_nickname.get(query.lower(), [])
+
+    def search(self, query: str, limit: int = None) -> List[Dict]:
+        """Ранжированный поиск: точный ID, точный ник, начало ника, затем похожие ники"""
+        query = query.strip()
+        limit = limit or CONFIG["RESIDENT_SEARCH_LIMIT"]
+        if not query:
+            return []
+
+        results, seen = [], set()
+
+        def take(records) -> bool:
+            for record in records:
+                if record["id"] not in seen:
+                    seen.add(record["id"])
+                    results.append(record)
+                    if len(results) >= limit:
+                        return True
+            return False
+
+        lowered = query.lower()
+        if take([self.by_id[query]] if query in self.by_id else []):
+            return results
+        if take(self.by_nickname.get(lowered, [])):
+            return results
+
+        start = bisect.bisect_left(self.sorted_nicknames, lowered)
+        prefixed = []
+        for nickname in self.sorted_nicknames[start:]:
+            if not nickname.startswith(lowered):
+                break
+            prefixed.extend(self.by_nickname[nickname])
+        if take(prefixed):
+            return results
+
+        # У запроса берем только внутренние триграммы, чтобы подстрока ника давала полное совпадение
+        query_grams = trigrams(query) if len(query) < 3 else {
+            lowered[i:i + 3] for i in range(len(lowered) - 2)
+        }
+        shared = Counter()
+        for gram in query_grams:
+            for record in self.postings.get(gram, ()):
+                shared[record["id"]] += 1
+        min_shared = CONFIG["RESIDENT_SEARCH_MIN_SCORE"] * len(query_grams)
+        fuzzy = sorted(
+            (user_id for user_id, count in shared.items() if count >= min_shared),
+            key=lambda user_id: (-shared[user_id], len(self.by_id[user_id]["nickname"]))
+        )
+        take(self.by_id[user_id] for user_id in fuzzy)
+        return results
+
+
+RESIDENT_INDEX: Optional[ResidentIndex] = None
+# Результаты inline-поиска по введенной строке: набор ника повторяет одни и те же префиксы
+INLINE_SEARCH_CACHE = TTLCache(maxsize=CONFIG["INLINE_CACHE_SIZE"], ttl=CONFIG["INLINE_CACHE_TTL"])
+
+
+async def rebuild_resident_index() -> ResidentIndex:
+    global RESIDENT_INDEX
+    async with db_connection("civilian") as db:
+        cursor = await db.execute("SELECT id, nickname, telegram_uid, role FROM civilians")
+        rows = await cursor.fetchall()
+    RESIDENT_INDEX = ResidentIndex(rows)
+    INLINE_SEARCH_CACHE.clear()
+    logger.info(f"Индекс горожан построен: {len(RESIDENT_INDEX)} записей")
+    return RESIDENT_INDEX
+
+
+async def get_resident_index() -> ResidentIndex:
+    if RESIDENT_INDEX is None:
+        return await rebuild_resident_index()
+    return RESIDENT_INDEX
+
+
+async def lookup_resident(query: str) -> tuple:
+    """Общий поиск получателя для переводов и банковских операций.
+
+    Возвращает (житель, кандидаты): житель найден однозначно - по точному ID,
+    единственному точному нику или единственному результату поиска."""
+    index = await get_resident_index()
+    exact = index.resolve(query)
+    if len(exact) == 1:
+        return exact[0], exact
+    matches = exact or index.search(query)
+    if len(matches) == 1:
+        return matches[0], matches
+    return None, matches
+
+
+def resident_choice_keyboard(matches: List[Dict], prefix: str, cancel_data: str) -> InlineKeyboardMarkup:
+    keyboard = [[InlineKeyboardButton(f"{resident['nickname']} (ID: {resident['id']})",
+                                      callback_data=f"{prefix}{resident['id']}")]
+                for resident in matches]
+    keyboard.append([InlineKeyboardButton("Отмена ❌", callback_data=cancel_data)])
+    return InlineKeyboardMarkup(keyboard)
+
+
+async def get_identity(telegram_uid: str) -> Optional[Dict]:
+    try:
+        return IDENTITY_CACHE[telegram_uid]
+    except KeyError:
+        pass
+
+    async with db_connection("civilian") as db:
         cursor = await db.execute(
-            "SELECT role FROM civilians WHERE telegram_uid = ?", (telegram_uid,)
+            "SELECT id, nickname, role FROM civilians WHERE telegram_uid = ?", (telegram_uid,)
         )
         result = await cursor.fetchone()
-        return result[0] if result else None
+
+    identity = {"id": result[0], "nickname": result[1], "role": result[2]} if result else None
+    IDENTITY_CACHE[telegram_uid] = identity
+    return identity
+
+
+# Функции для работы с пользователями
+async def get_user_role(telegram_uid: str) -> Optional[str]:
+    identity = await get_identity(telegram_uid)
+    return identity["role"] if identity else None
 
 
 async def get_all_residents() -> List[Dict]:
-    async with aiosqlite.connect("civilian.db") as db:
+    async with db_connection("civilian") as db:
         cursor = await db.execute(
             "SELECT id, nickname, telegram_uid FROM civilians WHERE role = 'resident'"
         )
@@ -215,7 +1230,7 @@ async def get_all_residents() -> List[Dict]:
 
 
 async def get_admin_ids() -> List[str]:
-    async with aiosqlite.connect("civilian.db") as db:
+    async with db_connection("civilian") as db:
         cursor = await db.execute(
             "SELECT telegram_uid FROM civilians WHERE role = 'admin'"
         )
@@ -225,29 +1240,46 @@ async def get_admin_ids() -> List[str]:
 
 # Функции для работы с банком
 async def get_balance(telegram_uid: str) -> int:
-    async with aiosqlite.connect("civilian.db") as db:
+    async with db_connection(JOINED_POOL) as db:
         cursor = await db.execute(
-            "SELECT id FROM civilians WHERE telegram_uid = ?", (telegram_uid,)
+            """SELECT a.balance FROM civilians c JOIN bank.accounts a ON a.id = c.id
+            WHERE c.telegram_uid = ?""",
+            (telegram_uid,)
         )
         result = await cursor.fetchone()
-        if not result:
-            return 0
+        return result[0] if result else 0
 
-        user_id = result[0]
 
-    async with aiosqlite.connect("bank.db") as db:
+async def get_user_card(user_id: str) -> Optional[Dict]:
+    """Карточка горожанина: данные, баланс и число незавершенных заданий одним запросом"""
+    async with db_connection(JOINED_POOL) as db:
         cursor = await db.execute(
-            "SELECT balance FROM accounts WHERE id = ?", (user_id,)
+            """SELECT c.id, c.nickname, c.role, c.telegram_uid, a.balance,
+                (SELECT COUNT(*) FROM tasks.task_claims t
+                 WHERE t.user_id = c.id AND t.status IN ('claimed', 'submitted'))
+            FROM civilians c LEFT JOIN bank.accounts a ON a.id = c.id
+            WHERE c.id = ?""",
+            (user_id,)
         )
-        result = await cursor.fetchone()
-        return result[0] if result else 0
+        row = await cursor.fetchone()
+    if not row:
+        return None
+    return {
+        "id": row[0],
+        "nickname": row[1],
+        "role": row[2],
+        "telegram_uid": row[3],
+        "balance": row[4],
+        "open_tasks": row[5],
+    }
 
 
-async def deposit_money(user_id: str, amount: int, reason: str = "") -> bool:
+async def deposit_money(user_id: str, amount: int, reason: str = "",
+                        idempotency_key: str = None) -> Union[bool, str]:
     if amount <= 0:
         return False
 
-    async with aiosqlite.connect("bank.db") as db:
+    async def operation(db):
         await db.execute(
             "UPDATE accounts SET balance = balance + ? WHERE id = ?",
             (amount, user_id)
@@ -255,44 +1287,42 @@ async def deposit_money(user_id: str, amount: int, reason: str = "") -> bool:
 
         await db.execute(
             """INSERT INTO transactions 
-            (user_id, type, date, to_user, amount, comment)
-            VALUES (?, ?, ?, ?, ?, ?)""",
-            (user_id, "deposit", datetime.now().isoformat(), user_id, amount, reason)
+            (user_id, type, date, to_user, amount, comment, idempotency_key)
+            VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (user_id, "deposit", datetime.now().isoformat(), user_id, amount, reason, idempotency_key)
         )
+        return True
 
-        await db.commit()
-    return True
+    return await ledger_write(operation, idempotency_key)
 
 
-async def withdraw_money(user_id: str, amount: int, reason: str = "") -> bool:
+async def withdraw_money(user_id: str, amount: int, reason: str = "",
+                         idempotency_key: str = None) -> Union[bool, str]:
     if amount <= 0:
         return False
 
-    async with aiosqlite.connect("bank.db") as db:
+    async def operation(db):
         cursor = await db.execute(
-            "SELECT balance FROM accounts WHERE id = ?", (user_id,)
+            "UPDATE accounts SET balance = balance - ? WHERE id = ? AND balance >= ?",
+            (amount, user_id, amount)
         )
-        balance = await cursor.fetchone()
-        if not balance or balance[0] < amount:
+        if cursor.rowcount == 0:
             return False
 
-        await db.execute(
-            "UPDATE accounts SET balance = balance - ? WHERE id = ?",
-            (amount, user_id)
-        )
-
         await db.execute(
             """INSERT INTO transactions 
-            (user_id, type, date, from_user, amount, comment)
-            VALUES (?, ?, ?, ?, ?, ?)""",
-            (user_id, "withdraw", datetime.now().isoformat(), user_id, amount, reason)
+            (user_id, type, date, from_user, amount, comment, idempotency_key)
+            VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (user_id, "withdraw", datetime.now().isoformat(), user_id, amount, reason, idempotency_key)
         )
+        return True
 
-        await db.commit()
-    return True
+    return await ledger_write(operation, idempotency_key)
 
 
-async def transfer_money(from_uid: str, to_id: str, amount: int, comment: str = "") -> bool:
+async def transfer_money(from_uid: str, to_id: str, amount: int, comment: str = "",
+                         idempotency_key: str = None) -> Union[bool, str]:
+    """Переводит WVR. Возвращает True, False или ALREADY_APPLIED для повтора"""
     logger.info(f"Начало перевода: from_uid={from_uid}, to_id={to_id}, amount={amount}, comment='{comment}'")
 
     if amount <= 0:
@@ -300,55 +1330,259 @@ async def transfer_money(from_uid: str, to_id: str, amount: int, comment: str =
         return False
 
     try:
-        async with aiosqlite.connect("civilian.db") as db:
-            cursor = await db.execute(
-                "SELECT id FROM civilians WHERE telegram_uid = ?",
-                (from_uid,)
-            )
-            from_result = await cursor.fetchone()
-            if not from_result:
-                logger.error("Отправитель не найден в базе")
-                return False
-            from_id = from_result[0]
+        identity = await get_identity(from_uid)
+        if not identity:
+            logger.error("Отправитель не найден в базе")
+            return False
+        from_id = identity["id"]
+
+        if from_id == to_id:
+            logger.error("Нельзя перевести средства самому себе")
+            return False
 
-        async with aiosqlite.connect("bank.db") as db:
+        # Списание и зачисление выполняются в одной точке сохранения транзакции
+        # BEGIN IMMEDIATE писателя bank.db: условный UPDATE не даст уйти в минус,
+        # а исключение при отсутствии счета получателя откатит списание.
+        async def operation(db):
             cursor = await db.execute(
-                "SELECT balance FROM accounts WHERE id = ?",
-                (from_id,)
+                "UPDATE accounts SET balance = balance - ? WHERE id = ? AND balance >= ?",
+                (amount, from_id, amount)
             )
-            balance = (await cursor.fetchone())[0]
-            if balance < amount:
-                logger.error(f"Недостаточно средств: баланс {balance}, требуется {amount}")
+            if cursor.rowcount == 0:
+                logger.error(f"Недостаточно средств или нет счета отправителя {from_id}, требуется {amount}")
                 return False
 
-            await db.execute(
-                "UPDATE accounts SET balance = balance - ? WHERE id = ?",
-                (amount, from_id)
-            )
-            await db.execute(
+            cursor = await db.execute(
                 "UPDATE accounts SET balance = balance + ? WHERE id = ?",
                 (amount, to_id)
             )
+            if cursor.rowcount == 0:
+                raise LookupError(f"Счет получателя {to_id} не найден")
 
             await db.execute(
                 """INSERT INTO transactions 
-                (user_id, type, date, from_user, to_user, amount, comment)
-                VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                (from_id, "transfer", datetime.now().isoformat(), from_id, to_id, amount, comment)
+                (user_id, type, date, from_user, to_user, amount, comment, idempotency_key)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                (from_id, "transfer", datetime.now().isoformat(), from_id, to_id, amount, comment,
+                 idempotency_key)
             )
-            await db.commit()
-
-            logger.info("Перевод успешно выполнен")
             return True
 
+        result = await ledger_write(operation, idempotency_key)
+        if not result:
+            return False
+
+        logger.info("Перевод успешно выполнен")
+        return result
+
     except Exception as e:
         logger.error(f"Ошибка при переводе: {str(e)}", exc_info=True)
         return False
 
 
+async def reconcile_balances(context: ContextTypes.DEFAULT_TYPE = None) -> Optional[Dict]:
+    """Сверяет accounts.balance с журналом транзакций.
+
+    Контрольная точка хранит баланс по журналу на момент tx_id. Для счета с точкой
+    к ней прибавляются только транзакции после нее (to_user - зачисление,
+    from_user - списание), счет без точки один раз сверяется по всей своей
+    истории. Все счета получают новую точку со значением по журналу, поэтому
+    окно просмотра не застревает на счетах с расхождением, а само расхождение
+    остается видно при каждой сверке, пока его не устранят."""
+    started = time.monotonic()
+    try:
+        async with db_connection("bank") as db:
+            # Один читающий снимок: балансы и верхняя граница журнала согласованы
+            await db.execute("BEGIN")
+            cursor = await db.execute("SELECT COALESCE(MAX(id), 0) FROM transactions")
+            high_water = (await cursor.fetchone())[0]
+
+            cursor = await db.execute(
+                """SELECT a.id, a.balance, c.tx_id, c.balance FROM accounts a
+                LEFT JOIN balance_checkpoints c ON c.account_id = a.id"""
+            )
+            accounts = await cursor.fetchall()
+
+            checkpoints = [row[2] for row in accounts if row[2] is not None]
+            low_water = min(checkpoints) if checkpoints else high_water
+
+            cursor = await db.execute(
+                """SELECT d.account, SUM(d.delta) FROM (
+                    SELECT id, to_user AS account, amount AS delta FROM transactions
+                    WHERE id > :low AND id <= :high AND to_user IS NOT NULL
+                    UNION ALL
+                    SELECT id, from_user AS account, -amount AS delta FROM transactions
+                    WHERE id > :low AND id <= :high AND from_user IS NOT NULL
+                ) d
+                JOIN balance_checkpoints c ON c.account_id = d.account AND d.id > c.tx_id
+                GROUP BY d.account""",
+                {"low": low_water, "high": high_water}
+            )
+            deltas = dict(await cursor.fetchall())
+
+            # Счета без точки: история читается по индексам to_user и from_user
+            cursor = await db.execute(
+                """WITH unchecked AS (
+                    SELECT a.id FROM accounts a
+                    LEFT JOIN balance_checkpoints c ON c.account_id = a.id WHERE c.account_id IS NULL
+                )
+                SELECT d.account, SUM(d.delta) FROM (
+                    SELECT to_user AS account, amount AS delta FROM transactions
+                    WHERE id <= :high AND to_user IN (SELECT id FROM unchecked)
+                    UNION ALL
+                    SELECT from_user AS account, -amount AS delta FROM transactions
+                    WHERE id <= :high AND from_user IN (SELECT id FROM unchecked)
+                ) d
+                GROUP BY d.account""",
+                {"high": high_water}
+            )
+            full_totals = dict(await cursor.fetchall())
+
+            cursor = await db.execute(
+                "SELECT COUNT(*) FROM transactions WHERE id > ? AND id <= ?",
+                (low_water, high_water)
+            )
+            rows_scanned = (await cursor.fetchone())[0]
+            await db.commit()
+
+        drift = []
+        new_checkpoints = []
+        verified_full = 0
+        for account_id, balance, checkpoint_tx, checkpoint_balance in accounts:
+            if checkpoint_tx is None:
+                expected = full_totals.get(account_id, 0)
+                verified_full += 1
+            else:
+                expected = checkpoint_balance + deltas.get(account_id, 0)
+            if expected != balance:
+                drift.append({"id": account_id, "expected": expected, "actual": balance,
+                              "drift": balance - expected, "first_check": checkpoint_tx is None})
+            new_checkpoints.append((account_id, high_water, expected, datetime.now().isoformat()))
+
+        async def operation(db):
+            await db.executemany(
+                """INSERT INTO balance_checkpoints (account_id, tx_id, balance, created_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(account_id) DO UPDATE SET
+                    tx_id = excluded.tx_id, balance = excluded.balance, created_at = excluded.created_at""",
+                new_checkpoints
+            )
+
+        await bank_write(operation)
+
+        report = {
+            "accounts": len(accounts),
+            "verified_full": verified_full,
+            "drift": drift,
+            "rows_scanned": rows_scanned,
+            "high_water": high_water,
+            "duration": time.monotonic() - started,
+        }
+        logger.info(
+            f"Сверка балансов: {report['accounts']} счетов ({verified_full} по всей истории), "
+            f"{rows_scanned} новых транзакций, расхождений {len(drift)}, за {report['duration']:.3f} с"
+        )
+        for item in drift:
+            logger.warning(
+                f"Расхождение баланса счета {item['id']}"
+                f"{' (первая сверка)' if item['first_check'] else ''}: ожидалось {item['expected']}, "
+                f"в accounts {item['actual']} ({item['drift']:+})"
+            )
+        return report
+    except Exception as e:
+        logger.error(f"Ошибка сверки балансов: {e}")
+        return None
+
+
+async def run_payroll(context: ContextTypes.DEFAULT_TYPE = None, period: str = None,
+                      source: str = "auto") -> Optional[Dict]:
+    """Начисляет accounts.salary всем счетам за период одной операцией писателя bank.db.
+
+    Период фиксируется в payroll_runs в той же транзакции, поэтому повторный
+    запуск за уже оплаченный период ничего не делает и возвращает None.
+    Выплата администратором (source="admin") снимает отметку миграции о ручной выплате."""
+    period = period or datetime.now().strftime(CONFIG["PAYROLL_PERIOD_FORMAT"])
+    started = time.monotonic()
+
+    async def operation(db):
+        now = datetime.now().isoformat()
+        if source == "admin":
+            await db.execute("DELETE FROM payroll_runs WHERE period = ? AND source = 'seed'", (period,))
+        cursor = await db.execute(
+            """INSERT INTO payroll_runs (period, paid_at, source) VALUES (?, ?, ?)
+            ON CONFLICT(period) DO NOTHING""",
+            (period, now, source)
+        )
+        if cursor.rowcount == 0:
+            return None
+
+        cursor = await db.execute("SELECT id, salary FROM accounts WHERE salary > 0")
+        payouts = await cursor.fetchall()
+        await db.execute("UPDATE accounts SET balance = balance + salary WHERE salary > 0")
+        await db.executemany(
+            """INSERT INTO transactions
+            (user_id, type, date, to_user, amount, comment, idempotency_key)
+            VALUES (?, 'salary', ?, ?, ?, ?, ?)""",
+            [(account_id, now, account_id, salary, f"Зарплата за {period}",
+              f"payroll:{period}:{account_id}") for account_id, salary in payouts]
+        )
+        await db.execute(
+            "UPDATE payroll_runs SET accounts = ?, total = ? WHERE period = ?",
+            (len(payouts), sum(salary for _, salary in payouts), period)
+        )
+        return payouts
+
+    try:
+        payouts = await bank_write(operation)
+    except Exception as e:
+        logger.error(f"Ошибка выплаты зарплаты за {period}: {e}")
+        return None
+    if payouts is None:
+        return None
+
+    report = {
+        "period": period,
+        "accounts": len(payouts),
+        "total": sum(salary for _, salary in payouts),
+        "duration": time.monotonic() - started,
+    }
+    logger.info(
+        f"Зарплата за {period}: {report['accounts']} счетов, {report['total']} WVR "
+        f"за {report['duration']:.3f} с"
+    )
+
+    if payouts:
+        async with db_connection("civilian") as db:
+            cursor = await db.execute(
+                "SELECT id, telegram_uid FROM civilians WHERE telegram_uid IS NOT NULL AND telegram_uid != ''"
+            )
+            telegram_uids = dict(await cursor.fetchall())
+        for account_id, salary in payouts:
+            if account_id in telegram_uids:
+                NOTIFIER.enqueue(telegram_uids[account_id], f"💵 Вам начислена зарплата за {period}: {salary} WVR")
+    return report
+
+
+async def payroll_job(context: ContextTypes.DEFAULT_TYPE):
+    """Автоматическая выплата: не раньше PAYROLL_DAY текущего месяца"""
+    if not CONFIG["PAYROLL_DAY"] or datetime.now().day < CONFIG["PAYROLL_DAY"]:
+        return
+    await run_payroll(context)
+
+
+async def get_payroll_preview(period: str) -> Dict:
+    async with db_connection("bank") as db:
+        cursor = await db.execute("SELECT COUNT(*), COALESCE(SUM(salary), 0) FROM accounts WHERE salary > 0")
+        accounts, total = await cursor.fetchone()
+        cursor = await db.execute("SELECT paid_at, source FROM payroll_runs WHERE period = ?", (period,))
+        run = await cursor.fetchone()
+    return {"period": period, "accounts": accounts, "total": total,
+            "paid_at": run[0] if run else None, "source": run[1] if run else None}
+
+
 async def find_user_by_nicknames(mc_nickname: str, discord_nickname: str) -> tuple:
     """Ищет пользователя по нику в майнкрафте и дискорде"""
-    async with aiosqlite.connect("civilian.db") as db:
+    async with db_connection("civilian") as db:
         cursor = await db.execute(
             "SELECT id, nickname, discord, telegram_uid FROM civilians WHERE nickname = ? AND discord = ?",
             (mc_nickname, discord_nickname)
@@ -364,34 +1598,86 @@ async def find_user_by_nicknames(mc_nickname: str, discord_nickname: str) -> tup
         return full_match, partial_matches
 
 
-async def get_blacklist() -> List[Dict]:
-    """Возвращает черный список, создает файл если его нет"""
+# Черный список хранится в таблице blacklist (civilian.db) и целиком держится в памяти.
+# Ключ записи - Telegram ID: по нему проверяют доступ /start, сообщения и рассылки
+BLACKLIST: Dict[str, Dict] = {}
+
+
+async def import_legacy_blacklist():
+    """Переносит записи из blacklist.json в таблицу и переименовывает файл.
+
+    Вызывается после миграций, поэтому городские ID переводит в Telegram ID сама"""
+    path = CONFIG["BLACKLIST_FILE"]
+    if not os.path.exists(path):
+        return
+
     try:
-        if not os.path.exists(CONFIG["BLACKLIST_FILE"]):
-            with open(CONFIG["BLACKLIST_FILE"], "w") as f:
-                json.dump([], f)
-            return []
+        with open(path, "r") as f:
+            content = f.read().strip()
+        entries = json.loads(content) if content else []
+
+        # Старые записи из карточки жителя хранят городской ID: ключом становится
+        # Telegram ID жителя, как в миграции civilian v4
+        async with db_connection("civilian") as db:
+            await db.executemany(
+                """INSERT OR IGNORE INTO blacklist (id, nickname, reason, block_date)
+                VALUES (COALESCE(
+                    (SELECT telegram_uid FROM civilians WHERE id = :id AND telegram_uid != ''
+                     AND NOT EXISTS (SELECT 1 FROM civilians WHERE telegram_uid = :id)),
+                    :id
+                ), :nickname, :reason, :block_date)""",
+                [{"id": str(entry["id"]), "nickname": entry.get("nickname"),
+                  "reason": entry.get("reason"), "block_date": entry.get("block_date")}
+                 for entry in entries]
+            )
+            await db.commit()
 
-        with open(CONFIG["BLACKLIST_FILE"], "r") as f:
-            return json.load(f)
+        os.replace(path, f"{path}.imported")
+        logger.info(f"Перенесено {len(entries)} записей черного списка из {path}")
     except Exception as e:
-        logger.error(f"Ошибка чтения черного списка: {e}")
-        return []
+        logger.error(f"Ошибка переноса черного списка: {e}")
 
 
-async def add_to_blacklist(user_id: str, nickname: str, reason: str) -> bool:
-    """Добавляет пользователя в черный список"""
-    try:
-        blacklist = await get_blacklist()
-        blacklist.append({
+async def load_blacklist():
+    await import_legacy_blacklist()
+
+    async with db_connection("civilian") as db:
+        cursor = await db.execute("SELECT id, nickname, reason, block_date FROM blacklist")
+        rows = await cursor.fetchall()
+
+    BLACKLIST.clear()
+    for user_id, nickname, reason, block_date in rows:
+        BLACKLIST[user_id] = {
             "id": user_id,
             "nickname": nickname,
             "reason": reason,
-            "block_date": datetime.now().isoformat()
-        })
+            "block_date": block_date
+        }
+
+
+def get_blacklist() -> List[Dict]:
+    """Возвращает черный список"""
+    return list(BLACKLIST.values())
+
+
+async def add_to_blacklist(telegram_uid: str, nickname: str, reason: str = "") -> bool:
+    """Добавляет пользователя в черный список по Telegram ID"""
+    entry = {
+        "id": telegram_uid,
+        "nickname": nickname,
+        "reason": reason,
+        "block_date": datetime.now().isoformat()
+    }
+    try:
+        async with db_connection("civilian") as db:
+            await db.execute(
+                """INSERT OR REPLACE INTO blacklist (id, nickname, reason, block_date)
+                VALUES (:id, :nickname, :reason, :block_date)""",
+                entry
+            )
+            await db.commit()
 
-        with open(CONFIG["BLACKLIST_FILE"], "w") as f:
-            json.dump(blacklist, f, indent=2)
+        BLACKLIST[telegram_uid] = entry
         return True
     except Exception as e:
         logger.error(f"Ошибка добавления в черный список: {e}")
@@ -400,51 +1686,159 @@ async def add_to_blacklist(user_id: str, nickname: str, reason: str) -> bool:
 
 async def remove_from_blacklist(user_id: str) -> bool:
     try:
-        blacklist = await get_blacklist()
-        blacklist = [user for user in blacklist if user["id"] != user_id]
+        async with db_connection("civilian") as db:
+            await db.execute("DELETE FROM blacklist WHERE id = ?", (user_id,))
+            await db.commit()
 
-        with open(CONFIG["BLACKLIST_FILE"], "w") as f:
-            json.dump(blacklist, f)
+        BLACKLIST.pop(user_id, None)
         return True
     except Exception as e:
         logger.error(f"Ошибка удаления из черного списка: {e}")
         return False
 
 
-async def is_blacklisted(user_id: str) -> bool:
-    blacklist = await get_blacklist()
-    return any(user["id"] == user_id for user in blacklist)
+def is_blacklisted(user_id: str) -> bool:
+    return user_id in BLACKLIST
+
+
+TRANSACTION_FIELDS = ("id", "user_id", "type", "date", "from_user", "to_user", "amount", "comment")
+TRANSACTION_TYPES = ("transfer", "deposit", "withdraw", "salary", "task_reward")
+# Аргументы /transactions и соответствующие параметры get_transactions
+TRANSACTION_FILTER_PARAMS = {"user": "user_id", "type": "tx_type", "from": "date_from", "to": "date_to"}
+
+
+async def get_transactions(cursor: tuple = None, backward: bool = False, limit: int = 10,
+                           user_id: str = None, tx_type: str = None,
+                           date_from: str = None, date_to: str = None) -> tuple:
+    """Страница транзакций от новых к старым с keyset-пагинацией по (date, id).
+
+    cursor - (date, id) крайней строки соседней страницы: без backward берутся
+    строки старше нее, с backward - новее. date_to не включается в диапазон.
+    Возвращает (транзакции, есть ли еще строки в направлении листания)."""
+    conditions, params = [], []
+    if user_id is not None:
+        conditions.append("user_id = ?")
+        params.append(user_id)
+    if tx_type is not None:
+        conditions.append("type = ?")
+        params.append(tx_type)
+    if date_from is not None:
+        conditions.append("date >= ?")
+        params.append(date_from)
+    if date_to is not None:
+        conditions.append("date < ?")
+        params.append(date_to)
+    if cursor is not None:
+        conditions.append("(date, id) > (?, ?)" if backward else "(date, id) < (?, ?)")
+        params.extend(cursor)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    order = "ASC" if backward else "DESC"
+    async with db_connection("bank") as db:
+        cursor = await db.execute(
+            f"""SELECT {", ".join(TRANSACTION_FIELDS)} FROM transactions {where}
+            ORDER BY date {order}, id {order}
+            LIMIT ?""",
+            (*params, limit + 1)
+        )
+        results = await cursor.fetchall()
+
+    has_more = len(results) > limit
+    results = results[:limit]
+    if backward:
+        results.reverse()
+    return [dict(zip(TRANSACTION_FIELDS, row)) for row in results], has_more
 
 
-async def get_transactions(page: int = 0, limit: int = 10) -> List[Dict]:
-    async with aiosqlite.connect("bank.db") as db:
+def statement_delta(transaction: Dict, user_id: str) -> int:
+    delta = 0
+    if transaction["to_user"] == user_id:
+        delta += transaction["amount"]
+    if transaction["from_user"] == user_id:
+        delta -= transaction["amount"]
+    return delta
+
+
+async def get_recent_statement(user_id: str, limit: int) -> tuple:
+    """Последние limit операций по счету от старых к новым и текущий баланс счета.
+
+    Каждая ветка UNION читает по индексу не больше limit строк, поэтому превью
+    не зависит от длины истории. Возвращает (операции, есть ли более ранние, баланс)."""
+    async with db_connection("bank") as db:
         cursor = await db.execute(
-            """SELECT * FROM transactions 
-            ORDER BY date DESC
-            LIMIT ? OFFSET ?""",
-            (limit, page * limit)
+            f"""SELECT {", ".join(TRANSACTION_FIELDS)} FROM transactions WHERE id IN (
+                SELECT id FROM (SELECT id FROM transactions WHERE user_id = :user_id
+                                ORDER BY date DESC, id DESC LIMIT :limit + 1)
+                UNION SELECT id FROM (SELECT id FROM transactions WHERE from_user = :user_id
+                                      ORDER BY id DESC LIMIT :limit + 1)
+                UNION SELECT id FROM (SELECT id FROM transactions WHERE to_user = :user_id
+                                      ORDER BY id DESC LIMIT :limit + 1)
+            )
+            ORDER BY id DESC LIMIT :limit + 1""",
+            {"user_id": user_id, "limit": limit}
         )
-        results = await cursor.fetchall()
+        rows = await cursor.fetchall()
+        cursor = await db.execute("SELECT balance FROM accounts WHERE id = ?", (user_id,))
+        account = await cursor.fetchone()
+
+    transactions = [dict(zip(TRANSACTION_FIELDS, row)) for row in rows[:limit]]
+    transactions.reverse()
+    return transactions, len(rows) > limit, account[0] if account else 0
+
+
+async def iter_statement(user_id: str):
+    """Построчно отдает операции по счету от старых к новым вместе с нарастающим балансом.
+
+    Строки читаются курсором пачками, история целиком в память не загружается."""
+    balance = 0
+    async with db_connection("bank") as db:
+        async with db.execute(
+            f"""SELECT {", ".join(TRANSACTION_FIELDS)} FROM transactions
+            WHERE user_id = ? OR from_user = ? OR to_user = ?
+            ORDER BY id""",
+            (user_id, user_id, user_id)
+        ) as cursor:
+            async for row in cursor:
+                transaction = dict(zip(TRANSACTION_FIELDS, row))
+                delta = statement_delta(transaction, user_id)
+                balance += delta
+                yield transaction, delta, balance
+
+
+async def write_statement_csv(user_id: str):
+    """Собирает выписку в CSV во временном файле, который уходит на диск только при росте.
+
+    Запись в файл может блокировать, поэтому строки уходят в рабочий поток пачками"""
+    spool = tempfile.SpooledTemporaryFile(max_size=CONFIG["STATEMENT_SPOOL_SIZE"], mode="w+b")
+    text = io.TextIOWrapper(spool, encoding="utf-8-sig", newline="")
+    writer = csv.writer(text)
+    batch = [["id", "date", "type", "from_user", "to_user", "amount", "change", "balance", "comment"]]
+
+    rows = 0
+    async for transaction, delta, balance in iter_statement(user_id):
+        batch.append([
+            transaction["id"], transaction["date"], transaction["type"], transaction["from_user"],
+            transaction["to_user"], transaction["amount"], delta, balance, transaction["comment"]
+        ])
+        rows += 1
+        if len(batch) >= CONFIG["STATEMENT_CSV_BATCH"]:
+            await asyncio.to_thread(writer.writerows, batch)
+            batch = []
 
-        transactions = []
-        for row in results:
-            transactions.append({
-                "id": row[0],
-                "user_id": row[1],
-                "type": row[2],
-                "date": row[3],
-                "from_user": row[4],
-                "to_user": row[5],
-                "amount": row[6],
-                "comment": row[7]
-            })
-        return transactions
+    def finish():
+        writer.writerows(batch)
+        text.flush()
+        text.detach()
+        spool.seek(0)
+
+    await asyncio.to_thread(finish)
+    return spool, rows
 
 
 async def get_user_info(user_id: str) -> Optional[Dict]:
-    async with aiosqlite.connect("civilian.db") as db:
+    async with db_connection("civilian") as db:
         cursor = await db.execute(
-            "SELECT id, nickname, role FROM civilians WHERE id = ?", (user_id,)
+            "SELECT id, nickname, role, telegram_uid FROM civilians WHERE id = ?", (user_id,)
         )
         result = await cursor.fetchone()
         if not result:
@@ -453,7 +1847,8 @@ async def get_user_info(user_id: str) -> Optional[Dict]:
         return {
             "id": result[0],
             "nickname": result[1],
-            "role": result[2]
+            "role": result[2],
+            "telegram_uid": result[3]
         }
 
 
@@ -461,12 +1856,14 @@ async def change_user_role(user_id: str, new_role: str) -> bool:
     if new_role not in ROLES:
         return False
 
-    async with aiosqlite.connect("civilian.db") as db:
+    async with db_connection("civilian") as db:
         await db.execute(
-            "UPDATE civilians SET role = ? WHERE id = ?",
+            "UPDATE civilians SET role = ?, deactivated_by_sync = FALSE WHERE id = ?",
             (new_role, user_id)
         )
         await db.commit()
+
+    invalidate_identity(city_id=user_id)
     return True
 
 
@@ -479,42 +1876,30 @@ async def withdraw_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def withdraw_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    recipient = update.message.text
-    context.user_data["withdraw_recipient"] = recipient
+    resident, matches = await lookup_resident(update.message.text)
 
-    async with aiosqlite.connect("civilian.db") as db:
-        cursor = await db.execute(
-            "SELECT id FROM civilians WHERE id = ? OR nickname LIKE ?",
-            (recipient, f"%{recipient}%")
+    if not matches:
+        await update.message.reply_text("Житель не найден. Проверьте данные и попробуйте снова.")
+        return ConversationHandler.END
+
+    if resident is None:
+        await update.message.reply_text(
+            "Найдено несколько жителей. Выберите нужного:",
+            reply_markup=resident_choice_keyboard(matches, "withdraw_from_", "bank_operations")
         )
-        result = await cursor.fetchall()
+        return WITHDRAW_USER
 
-        if not result:
-            await update.message.reply_text("Житель не найден. Проверьте данные и попробуйте снова.")
-            return ConversationHandler.END
+    context.user_data["withdraw_user_id"] = resident["id"]
+    await update.message.reply_text("Введите сумму для снятия:")
+    return WITHDRAW_AMOUNT
 
-        if len(result) > 1:
-            keyboard = []
-            for row in result:
-                cursor = await db.execute(
-                    "SELECT nickname FROM civilians WHERE id = ?",
-                    (row[0],))
-                nickname = await cursor.fetchone()
-                keyboard.append([InlineKeyboardButton(
-                    f"{nickname[0]} (ID: {row[0]})",
-                    callback_data=f"withdraw_from_{row[0]}")
-                ])
-
-            keyboard.append([InlineKeyboardButton("Отмена ❌", callback_data="bank_operations")])
-            await update.message.reply_text(
-                "Найдено несколько жителей. Выберите нужного:",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-            return ConversationHandler.END
 
-        context.user_data["withdraw_user_id"] = result[0][0]
-        await update.message.reply_text("Введите сумму для снятия:")
-        return WITHDRAW_AMOUNT
+async def withdraw_select(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    context.user_data["withdraw_user_id"] = query.data[len("withdraw_from_"):]
+    await query.edit_message_text("Введите сумму для снятия:")
+    return WITHDRAW_AMOUNT
 
 
 async def withdraw_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -537,130 +1922,542 @@ async def withdraw_complete(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = context.user_data["withdraw_user_id"]
     amount = context.user_data["withdraw_amount"]
 
-    success = await withdraw_money(user_id, amount, reason)
+    success = await withdraw_money(user_id, amount, reason, idempotency_key(update, "withdraw"))
+
+    if success == ALREADY_APPLIED:
+        await update.message.reply_text("ℹ️ Эта операция уже выполнена")
+    elif success:
+        await update.message.reply_text(
+            f"✅ Успешно снято {amount} WVR\n"
+            f"Причина: {reason}")
+    else:
+        await update.message.reply_text(
+            "❌ Не удалось выполнить операцию. Проверьте баланс и попробуйте снова.")
+
+    return ConversationHandler.END
+
+
+async def exchange_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    context.user_data.clear()
+    await query.edit_message_text("Введите ник в Minecraft или ID горожанина для обналичивания WVR:")
+    return EXCHANGE_USER
+
+
+async def exchange_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    resident, matches = await lookup_resident(update.message.text)
+
+    if not matches:
+        await update.message.reply_text("Житель не найден. Проверьте данные и попробуйте снова.")
+        return ConversationHandler.END
+
+    if resident is None:
+        await update.message.reply_text(
+            "Найдено несколько жителей. Выберите нужного:",
+            reply_markup=resident_choice_keyboard(matches, "exchange_for_", "bank_operations")
+        )
+        return EXCHANGE_USER
+
+    context.user_data["exchange_user_id"] = resident["id"]
+    context.user_data["exchange_telegram_uid"] = resident["telegram_uid"]
+    await update.message.reply_text("Введите сумму для обналичивания:")
+    return EXCHANGE_AMOUNT
+
+
+async def exchange_select(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    user_id = query.data[len("exchange_for_"):]
+    resident = (await get_resident_index()).by_id.get(user_id)
+    context.user_data["exchange_user_id"] = user_id
+    context.user_data["exchange_telegram_uid"] = resident["telegram_uid"] if resident else None
+    await query.edit_message_text("Введите сумму для обналичивания:")
+    return EXCHANGE_AMOUNT
+
+
+async def exchange_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        amount = int(update.message.text)
+        if amount <= 0:
+            raise ValueError
+
+        user_id = context.user_data["exchange_user_id"]
+        telegram_uid = context.user_data["exchange_telegram_uid"]
+
+        success = await withdraw_money(
+            user_id, amount, "Обналичивание в АРы", idempotency_key(update, "exchange")
+        )
+
+        if success == ALREADY_APPLIED:
+            await update.message.reply_text("ℹ️ Эта операция уже выполнена")
+        elif success:
+            if telegram_uid:
+                await notify_user(
+                    context,
+                    telegram_uid,
+                    f"✅ Ваши {amount} WVR были обналичены в {amount} АР\n"
+                    f"Операцию выполнил: @{update.effective_user.username}")
+
+            await update.message.reply_text(
+                f"✅ Успешно обналичено {amount} WVR в {amount} АР\n"
+                + ("Пользователь был уведомлен." if telegram_uid
+                   else "У пользователя нет Telegram, уведомление не отправлено."))
+        else:
+            await update.message.reply_text(
+                "❌ Не удалось выполнить операцию. Проверьте баланс пользователя.")
+
+    except ValueError:
+        await update.message.reply_text("Неверная сумма. Введите целое положительное число:")
+        return EXCHANGE_AMOUNT
+
+    return ConversationHandler.END
+
+
+# Функции для работы с заданиями
+async def get_available_tasks() -> List[Dict]:
+    async with db_connection("tasks") as db:
+        cursor = await db.execute(
+            """SELECT id, name, task_type, cost, social_type, deadline, description, count, claimed
+            FROM tasks WHERE completed = FALSE AND (social_type = 'passive' OR social_type = 'active')"""
+        )
+        tasks = await cursor.fetchall()
+
+        result = []
+        for task in tasks:
+            result.append({
+                "id": task[0],
+                "name": task[1],
+                "type": task[2],
+                "cost": task[3],
+                "social_type": task[4],
+                "deadline": task[5],
+                "description": task[6],
+                "count": task[7],
+                "claimed": task[8] or 0,
+            })
+
+        return result
+
+
+# Постраничный вывод списков. Telegram ограничивает сообщение 4096 символами
+# UTF-16, поэтому длина считается в этих единицах (эмодзи занимают две).
+MESSAGE_LIMIT = 4096
+
+
+def message_length(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+def truncate_entry(text: str, limit: int) -> str:
+    """Обрезает запись до limit единиц по границе строки, а если строка одна - по символу"""
+    if message_length(text) <= limit:
+        return text
+    cut = text[:limit - 1]
+    while message_length(cut) > limit - 1:
+        cut = cut[:-1]
+    if "\n" in cut:
+        cut = cut[:cut.rindex("\n")]
+    return cut + "…"
+
+
+def fit_entries(header: str, entries: List[str], limit: int = MESSAGE_LIMIT) -> int:
+    """Сколько записей с начала списка помещается в одно сообщение (минимум одна)"""
+    size = message_length(header)
+    for count, entry in enumerate(entries):
+        size += message_length(entry) + (1 if count else 0)
+        if size > limit:
+            return max(count, 1)
+    return len(entries)
+
+
+def join_page(header: str, entries: List[str], limit: int = MESSAGE_LIMIT) -> str:
+    budget = limit - message_length(header)
+    return header + "\n".join(truncate_entry(entry, budget) for entry in entries)
+
+
+def split_pages(header: str, entries: List[str], limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Раскладывает записи по сообщениям, не разрывая запись между страницами"""
+    pages = []
+    while entries:
+        count = fit_entries(header, entries, limit)
+        pages.append(join_page(header, entries[:count], limit))
+        entries = entries[count:]
+    return pages
+
+
+# Доска заданий для жителей меняется только при создании, правке и завершении
+# заданий. Эти операции увеличивают TASKS_VERSION, а доска перестраивается при
+# первом обращении после изменения - одним запросом на всех ожидающих.
+TASK_FIELDS = ("name", "task_type", "count", "cost", "social_type", "deadline", "description",
+               "assigned_to", "completed")
+TASKS_VERSION = 0
+TASK_BOARD: Optional[Dict] = None
+TASK_BOARD_LOCK = asyncio.Lock()
+
+
+def bump_tasks_version():
+    global TASKS_VERSION
+    TASKS_VERSION += 1
+
+
+def render_task(task: Dict) -> str:
+    text = (
+        f"🔹 {task['name']}\n"
+        f"Тип: {TASK_TYPES.get(task['type'], task['type'])} | "
+        f"Вид: {SOCIAL_TYPES.get(task['social_type'], task['social_type'])}\n"
+        f"Награда: {task['cost']} WVR\n"
+    )
+    if task.get('description'):
+        text += f"Описание: {task['description']}\n"
+    if task.get('deadline'):
+        text += f"Срок: {task['deadline']}\n"
+    if task.get('count'):
+        text += f"Занято мест: {task['claimed']}/{task['count']}\n"
+    return text
+
+
+def render_task_board(tasks: List[Dict]) -> List[str]:
+    """Разбивает доску на сообщения не длиннее лимита Telegram"""
+    return split_pages("📋 Доступные задания:\n\n", [render_task(task) for task in tasks])
+
+
+async def get_task_board() -> Dict:
+    """Возвращает {"version", "tasks", "pages"} актуальной доски заданий"""
+    global TASK_BOARD
+    board = TASK_BOARD
+    if board is not None and board["version"] == TASKS_VERSION:
+        return board
+
+    async with TASK_BOARD_LOCK:
+        if TASK_BOARD is not None and TASK_BOARD["version"] == TASKS_VERSION:
+            return TASK_BOARD
+        # Версия берется до запроса: изменение во время перестройки вызовет еще одну
+        version = TASKS_VERSION
+        tasks = await get_available_tasks()
+        TASK_BOARD = {"version": version, "tasks": tasks, "pages": render_task_board(tasks)}
+        return TASK_BOARD
+
+
+async def create_task(task: Dict) -> int:
+    """Создает задание из полей TASK_FIELDS и возвращает его ID"""
+    fields = [field for field in TASK_FIELDS if field in task]
+    async with db_connection("tasks") as db:
+        cursor = await db.execute(
+            f"INSERT INTO tasks ({', '.join(fields)}) VALUES ({', '.join('?' for _ in fields)})",
+            [task[field] for field in fields]
+        )
+        await db.commit()
+        task_id = cursor.lastrowid
+    bump_tasks_version()
+    return task_id
+
+
+def task_has_slots(task: Dict) -> bool:
+    return not task.get("count") or task["claimed"] < task["count"]
+
+
+async def update_task(task_id: int, **changes) -> bool:
+    fields = [field for field in TASK_FIELDS if field in changes]
+    if not fields:
+        return False
+    async with db_connection("tasks") as db:
+        cursor = await db.execute(
+            f"UPDATE tasks SET {', '.join(f'{field} = ?' for field in fields)} WHERE id = ?",
+            [changes[field] for field in fields] + [task_id]
+        )
+        await db.commit()
+        updated = cursor.rowcount > 0
+    if updated:
+        bump_tasks_version()
+    return updated
+
+
+# Заявки на выполнение заданий: claimed -> submitted -> approving -> approved, либо
+# cancelled (житель отказался) или rejected (отчет отклонен). approving - награда
+# начисляется. tasks.claimed считает занятые места (все статусы, кроме cancelled
+# и rejected) и ограничен tasks.count.
+ACTIVE_CLAIM_STATUSES = ("claimed", "submitted")
+CLAIM_FIELDS = ("id", "task_id", "user_id", "telegram_uid", "status", "proof", "claimed_at",
+                "submitted_at", "reviewed_at", "reviewed_by")
+# Первый активный исполнитель задания: заменяет tasks.assigned_to, когда назначенный житель освобождает место
+FIRST_ASSIGNEE_SQL = """(SELECT user_id FROM task_claims
+    WHERE task_id = tasks.id AND status IN ('claimed', 'submitted') ORDER BY id LIMIT 1)"""
+
+
+async def get_claim(claim_id: int) -> Optional[Dict]:
+    """Заявка вместе с названием и наградой задания"""
+    async with db_connection("tasks") as db:
+        cursor = await db.execute(
+            f"""SELECT {', '.join('c.' + field for field in CLAIM_FIELDS)}, t.name, t.cost
+            FROM task_claims c JOIN tasks t ON t.id = c.task_id WHERE c.id = ?""",
+            (claim_id,)
+        )
+        row = await cursor.fetchone()
+    return dict(zip(CLAIM_FIELDS + ("task_name", "cost"), row)) if row else None
+
+
+async def get_user_claims(user_id: str) -> List[Dict]:
+    """Активные заявки жителя вместе с названием задания"""
+    async with db_connection("tasks") as db:
+        cursor = await db.execute(
+            f"""SELECT {', '.join('c.' + field for field in CLAIM_FIELDS)}, t.name, t.cost
+            FROM task_claims c JOIN tasks t ON t.id = c.task_id
+            WHERE c.user_id = ? AND c.status IN ('claimed', 'submitted')
+            ORDER BY c.id""",
+            (user_id,)
+        )
+        rows = await cursor.fetchall()
+    return [dict(zip(CLAIM_FIELDS + ("task_name", "cost"), row)) for row in rows]
+
+
+async def get_submitted_claims(limit: int = 10) -> List[Dict]:
+    """Отчеты, ожидающие проверки, от старых к новым"""
+    async with db_connection("tasks") as db:
+        cursor = await db.execute(
+            f"""SELECT {', '.join('c.' + field for field in CLAIM_FIELDS)}, t.name, t.cost
+            FROM task_claims c JOIN tasks t ON t.id = c.task_id
+            WHERE c.status = 'submitted' ORDER BY c.submitted_at LIMIT ?""",
+            (limit,)
+        )
+        rows = await cursor.fetchall()
+    return [dict(zip(CLAIM_FIELDS + ("task_name", "cost"), row)) for row in rows]
+
+
+async def claim_task(task_id: int, user_id: str, telegram_uid: str) -> str:
+    """Берет задание. Возвращает "claimed", "duplicate", "full" или "closed".
+
+    Место занимается условным UPDATE: при одновременных заявках SQLite выполняет
+    их по очереди, и заявка сверх tasks.count не пройдет проверку claimed < count."""
+    async with db_connection("tasks") as db:
+        cursor = await db.execute(
+            "SELECT 1 FROM task_claims WHERE task_id = ? AND user_id = ? AND status IN ('claimed', 'submitted')",
+            (task_id, user_id)
+        )
+        if await cursor.fetchone():
+            return "duplicate"
+
+        cursor = await db.execute(
+            """UPDATE tasks SET claimed = claimed + 1, assigned_to = COALESCE(NULLIF(assigned_to, ''), ?)
+            WHERE id = ? AND completed = FALSE AND (count IS NULL OR count <= 0 OR claimed < count)""",
+            (user_id, task_id)
+        )
+        if cursor.rowcount == 0:
+            await db.rollback()
+            cursor = await db.execute("SELECT completed FROM tasks WHERE id = ?", (task_id,))
+            task = await cursor.fetchone()
+            return "full" if task and not task[0] else "closed"
+
+        try:
+            await db.execute(
+                "INSERT INTO task_claims (task_id, user_id, telegram_uid, claimed_at) VALUES (?, ?, ?, ?)",
+                (task_id, user_id, telegram_uid, datetime.now().isoformat())
+            )
+        except sqlite3.IntegrityError:
+            await db.rollback()
+            return "duplicate"
+        await db.commit()
+
+    bump_tasks_version()
+    return "claimed"
+
+
+async def release_claim(claim_id: int, status: str, from_statuses: tuple, user_id: str = None,
+                        reviewed_by: str = None) -> Optional[Dict]:
+    """Закрывает заявку без награды (cancelled или rejected) и освобождает место"""
+    claim = await get_claim(claim_id)
+    if not claim or claim["status"] not in from_statuses or (user_id and claim["user_id"] != user_id):
+        return None
+
+    async with db_connection("tasks") as db:
+        cursor = await db.execute(
+            f"""UPDATE task_claims SET status = ?, reviewed_at = ?, reviewed_by = ?
+            WHERE id = ? AND status IN ({', '.join('?' for _ in from_statuses)})""",
+            (status, datetime.now().isoformat(), reviewed_by, claim_id, *from_statuses)
+        )
+        if cursor.rowcount == 0:
+            await db.rollback()
+            return None
+        await db.execute(
+            f"""UPDATE tasks SET claimed = MAX(claimed - 1, 0),
+                assigned_to = CASE WHEN assigned_to = ? THEN {FIRST_ASSIGNEE_SQL} ELSE assigned_to END
+            WHERE id = ?""",
+            (claim["user_id"], claim["task_id"])
+        )
+        await db.commit()
+
+    bump_tasks_version()
+    return claim
+
+
+async def unclaim_task(claim_id: int, user_id: str) -> Optional[Dict]:
+    return await release_claim(claim_id, "cancelled", ("claimed",), user_id=user_id)
+
+
+async def reject_claim(claim_id: int, reviewed_by: str) -> Optional[Dict]:
+    return await release_claim(claim_id, "rejected", ("submitted",), reviewed_by=reviewed_by)
+
+
+async def submit_proof(claim_id: int, user_id: str, proof: str) -> bool:
+    """Прикладывает отчет к заявке. Повторная отправка до проверки заменяет отчет"""
+    async with db_connection("tasks") as db:
+        cursor = await db.execute(
+            """UPDATE task_claims SET status = 'submitted', proof = ?, submitted_at = ?
+            WHERE id = ? AND user_id = ? AND status IN ('claimed', 'submitted')""",
+            (proof, datetime.now().isoformat(), claim_id, user_id)
+        )
+        await db.commit()
+        return cursor.rowcount > 0
+
+
+async def credit_task_reward(db, claim: Dict) -> bool:
+    """Зачисляет награду по заявке на соединении писателя bank.db"""
+    cursor = await db.execute(
+        "UPDATE accounts SET balance = balance + ? WHERE id = ?", (claim["cost"], claim["user_id"])
+    )
+    if cursor.rowcount == 0:
+        raise LookupError(f"Счет исполнителя {claim['user_id']} не найден")
+    await db.execute(
+        """INSERT INTO transactions
+        (user_id, type, date, to_user, amount, comment, idempotency_key)
+        VALUES (?, 'task_reward', ?, ?, ?, ?, ?)""",
+        (claim["user_id"], datetime.now().isoformat(), claim["user_id"], claim["cost"],
+         f"Награда за задание «{claim['task_name']}»", f"task:{claim['id']}")
+    )
+    return True
+
+
+async def finish_claim_approval(claim: Dict) -> Dict:
+    """Начисляет награду по заявке, затем отдельной транзакцией tasks.db подтверждает ее.
+
+    Запись task:<id> в журнале считается уже начисленной наградой: повтор после
+    сбоя между фиксациями только переводит заявку в approved. Задание с
+    ограниченным count считается выполненным, когда подтверждены все места."""
+    await ledger_write(lambda db: credit_task_reward(db, claim), f"task:{claim['id']}")
 
-    if success:
-        await update.message.reply_text(
-            f"✅ Успешно снято {amount} WVR\n"
-            f"Причина: {reason}")
-    else:
-        await update.message.reply_text(
-            "❌ Не удалось выполнить операцию. Проверьте баланс и попробуйте снова.")
+    async with db_connection("tasks") as db:
+        await db.execute(
+            """UPDATE task_claims SET status = 'approved', reviewed_at = COALESCE(reviewed_at, ?)
+            WHERE id = ? AND status IN ('approving', 'submitted')""",
+            (datetime.now().isoformat(), claim["id"])
+        )
+        await db.execute(
+            """UPDATE tasks SET completed = CASE WHEN count > 0 AND (SELECT COUNT(*) FROM task_claims
+                    WHERE task_id = tasks.id AND status = 'approved') >= count THEN TRUE ELSE completed END
+            WHERE id = ?""",
+            (claim["task_id"],)
+        )
+        await db.commit()
 
-    return ConversationHandler.END
+    bump_tasks_version()
+    return {"user_id": claim["user_id"], "cost": claim["cost"], "task_name": claim["task_name"]}
 
 
-async def exchange_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    context.user_data.clear()
-    await query.edit_message_text("Введите ник в Minecraft или ID горожанина для обналичивания WVR:")
-    return EXCHANGE_USER
+async def revert_claim_approval(claim_id: int):
+    """Возвращает заявку на проверку, если награду начислить не удалось"""
+    async with db_connection("tasks") as db:
+        await db.execute(
+            """UPDATE task_claims SET status = 'submitted', reviewed_at = NULL, reviewed_by = NULL
+            WHERE id = ? AND status = 'approving'""",
+            (claim_id,)
+        )
+        await db.commit()
 
 
-async def exchange_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    recipient = update.message.text
+async def approve_claim(claim_id: int, reviewed_by: str) -> Optional[Dict]:
+    """Подтверждает отчет и начисляет награду.
 
-    async with aiosqlite.connect("civilian.db") as db:
+    Заявка сначала переходит в approving: ее уже нельзя отклонить или
+    подтвердить повторно, а прерванное начисление завершит repair_task_rewards."""
+    async with db_connection("tasks") as db:
         cursor = await db.execute(
-            "SELECT id, telegram_uid FROM civilians WHERE id = ? OR nickname LIKE ?",
-            (recipient, f"%{recipient}%")
+            """UPDATE task_claims SET status = 'approving', reviewed_at = ?, reviewed_by = ?
+            WHERE id = ? AND status = 'submitted'""",
+            (datetime.now().isoformat(), reviewed_by, claim_id)
         )
-        result = await cursor.fetchall()
+        await db.commit()
+        if cursor.rowcount == 0:
+            return None
 
-        if not result:
-            await update.message.reply_text("Житель не найден. Проверьте данные и попробуйте снова.")
-            return ConversationHandler.END
+    claim = await get_claim(claim_id)
+    try:
+        return await finish_claim_approval(claim)
+    except LookupError:
+        await revert_claim_approval(claim_id)
+        raise
 
-        if len(result) > 1:
-            keyboard = []
-            for row in result:
-                cursor = await db.execute(
-                    "SELECT nickname FROM civilians WHERE id = ?",
-                    (row[0],)
-                )
-                nickname = await cursor.fetchone()
-                keyboard.append([InlineKeyboardButton(
-                    f"{nickname[0]} (ID: {row[0]})",
-                    callback_data=f"exchange_for_{row[0]}")
-                ])
-
-                keyboard.append([InlineKeyboardButton("Отмена ❌", callback_data="bank_operations")])
-                await update.message.reply_text(
-                    "Найдено несколько жителей. Выберите нужного:",
-                    reply_markup=InlineKeyboardMarkup(keyboard)
-                )
-            return ConversationHandler.END
 
-        context.user_data["exchange_user_id"] = result[0][0]
-        context.user_data["exchange_telegram_uid"] = result[0][1]
-        await update.message.reply_text("Введите сумму для обналичивания:")
-        return EXCHANGE_AMOUNT
+async def repair_task_rewards():
+    """Сверяет заявки с журналом банка после сбоя между фиксациями bank.db и tasks.db.
 
+    Подтвержденной заявке без записи task:<id> начисляется награда, а заявка
+    с записью в журнале, но не подтвержденная (approving или submitted),
+    переводится в approved без повторного начисления."""
+    async with db_connection(JOINED_POOL) as db:
+        cursor = await db.execute(
+            """SELECT c.id FROM tasks.task_claims c
+            LEFT JOIN bank.transactions t ON t.idempotency_key = 'task:' || c.id
+            WHERE c.status = 'approving'
+                OR (c.status = 'approved' AND t.id IS NULL)
+                OR (c.status = 'submitted' AND t.id IS NOT NULL)"""
+        )
+        claim_ids = [row[0] for row in await cursor.fetchall()]
 
-async def exchange_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        amount = int(update.message.text)
-        if amount <= 0:
-            raise ValueError
+    for claim_id in claim_ids:
+        claim = await get_claim(claim_id)
+        try:
+            await finish_claim_approval(claim)
+            logger.warning(f"Заявка {claim_id} ({claim['status']}) сверена с журналом банка")
+        except LookupError as e:
+            await revert_claim_approval(claim_id)
+            logger.error(f"Заявка {claim_id} возвращена на проверку: {e}")
+        except Exception as e:
+            logger.error(f"Не удалось сверить заявку {claim_id} с журналом банка: {e}")
 
-        user_id = context.user_data["exchange_user_id"]
-        telegram_uid = context.user_data["exchange_telegram_uid"]
 
-        success = await withdraw_money(user_id, amount, "Обналичивание в АРы")
+# Клавиатуры и тексты меню не зависят от пользователя, поэтому строятся один раз.
+# Объекты telegram неизменяемы и безопасно переиспользуются между апдейтами.
+REPLY_MARKUP = ReplyKeyboardMarkup(
+    [[KeyboardButton("/start")]], resize_keyboard=True, one_time_keyboard=False
+)
+REPLY_MARKUP_WITH_CANCEL = ReplyKeyboardMarkup(
+    [[KeyboardButton("/start"), KeyboardButton("/cancel")]], resize_keyboard=True, one_time_keyboard=False
+)
+REGISTRATION_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🖊️ Зарегистрироваться", callback_data="start_registration")]
+])
 
-        if success:
-            try:
-                await context.bot.send_message(
-                    telegram_uid,
-                    f"✅ Ваши {amount} WVR были обналичены в {amount} АР\n"
-                    f"Операцию выполнил: @{update.effective_user.username}")
-            except Exception as e:
-                logger.error(f"Не удалось уведомить пользователя: {e}")
 
-            await update.message.reply_text(
-                f"✅ Успешно обналичено {amount} WVR в {amount} АР\n"
-                "Пользователь был уведомлен.")
-        else:
-            await update.message.reply_text(
-                "❌ Не удалось выполнить операцию. Проверьте баланс пользователя.")
+def build_main_menu(role: str) -> InlineKeyboardMarkup:
+    keyboard = [[InlineKeyboardButton("Мой баланс 💰", callback_data="balance")]]
+    if role == "guest":
+        return InlineKeyboardMarkup(keyboard)
 
-    except ValueError:
-        await update.message.reply_text("Неверная сумма. Введите целое положительное число:")
-        return EXCHANGE_AMOUNT
+    keyboard.append([InlineKeyboardButton("Доступные задания 📋", callback_data="tasks")])
+    keyboard.append([InlineKeyboardButton("Мои задания 🗂", callback_data="my_tasks")])
+    keyboard.append([InlineKeyboardButton("Перевести WVR 🔄", callback_data="transfer")])
+    if role in ["banker", "admin"]:
+        keyboard.append([InlineKeyboardButton("Банковские операции 🏦", callback_data="bank_operations")])
+    if role == "admin":
+        keyboard.append([InlineKeyboardButton("Администрирование 👑", callback_data="admin_actions")])
+    return InlineKeyboardMarkup(keyboard)
 
-    return ConversationHandler.END
 
+MAIN_MENUS = {role: build_main_menu(role) for role in ROLES}
+MAIN_MENU_STATUS = {role: f"Твой статус: {name}" for role, name in ROLES.items()}
 
-# Функции для работы с заданиями
-async def get_available_tasks() -> List[Dict]:
-    async with aiosqlite.connect("tasks.db") as db:
-        cursor = await db.execute(
-            """SELECT id, name, task_type, cost, social_type, deadline, description 
-            FROM tasks WHERE completed = FALSE AND (social_type = 'passive' OR social_type = 'active')"""
-        )
-        tasks = await cursor.fetchall()
 
-        result = []
-        for task in tasks:
-            result.append({
-                "id": task[0],
-                "name": task[1],
-                "type": task[2],
-                "cost": task[3],
-                "social_type": task[4],
-                "deadline": task[5],
-                "description": task[6],
-            })
+def get_main_menu(role: str) -> tuple:
+    """(строка статуса, клавиатура) главного меню роли.
 
-        return result
+    Роли вне ROLES (None или значение по умолчанию в civilians) получают меню гостя"""
+    if role not in ROLES:
+        role = "guest"
+    return MAIN_MENU_STATUS[role], MAIN_MENUS[role]
 
 
 def get_reply_markup(include_cancel=False):
-    keyboard = [[KeyboardButton("/start")]]
-    if include_cancel:
-        keyboard[0].append(KeyboardButton("/cancel"))
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=False)
+    return REPLY_MARKUP_WITH_CANCEL if include_cancel else REPLY_MARKUP
 
 
 # Обработчики команд
@@ -668,86 +2465,162 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user = update.effective_user
     telegram_uid = str(user.id)
 
-    if await is_blacklisted(telegram_uid):
+    if is_blacklisted(telegram_uid):
         return
 
     role = await get_user_role(telegram_uid)
 
     if role is None:
-        if await check_pending_application(telegram_uid):
+        if check_pending_application(telegram_uid):
             await update.message.reply_text(
                 "🛑 Ваша заявка на рассмотрении. Пожалуйста, дождитесь решения администратора.",
                 reply_markup=get_reply_markup()
             )
             return
 
-        keyboard = [
-            [InlineKeyboardButton("🖊️ Зарегистрироваться", callback_data="start_registration")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
         await update.message.reply_text(
             "Вы не зарегистрированы в системе. Хотите подать заявку на регистрацию?",
-            reply_markup=reply_markup
+            reply_markup=REGISTRATION_MARKUP
         )
         return
 
-    if role == "guest":
-        keyboard = [
-            [InlineKeyboardButton("Мой баланс 💰", callback_data="balance")],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+    status, reply_markup = get_main_menu(role)
+    prompt = "Доступные действия:" if reply_markup is MAIN_MENUS["guest"] else "Выбери действие:"
+    await update.message.reply_text(
+        f"Привет, {user.first_name}! 👋\n{status}\n{prompt}",
+        reply_markup=reply_markup
+    )
 
-        await update.message.reply_text(
-            f"Привет, {user.first_name}! 👋\n"
-            f"Твой статус: {ROLES.get(role, 'Гость')}\n"
-            "Доступные действия:",
-            reply_markup=reply_markup
-        )
+
+# Заявки на регистрацию хранятся в таблице applications (civilian.db).
+# Telegram ID с нерассмотренными заявками держатся в памяти.
+APPLICATION_FIELDS = ("application_id", "telegram_uid", "mc_nickname", "discord_nickname",
+                      "birthday", "timestamp", "status")
+CLOSED_APPLICATION_STATUSES = ("approved", "blocked", "rejected")
+PENDING_APPLICATIONS = set()
+
+
+def application_export_path(application_data: dict) -> str:
+    return os.path.join(
+        CONFIG["ADMIN_NOTIFICATIONS_DIR"],
+        f"app_{application_data['telegram_uid']}_{application_data['application_id']}.json"
+    )
+
+
+async def import_legacy_applications():
+    """Переносит JSON-заявки из ADMIN_NOTIFICATIONS_DIR в таблицу applications"""
+    directory = CONFIG["ADMIN_NOTIFICATIONS_DIR"]
+    if not os.path.isdir(directory):
         return
 
-    keyboard = [
-        [InlineKeyboardButton("Мой баланс 💰", callback_data="balance")],
-        [InlineKeyboardButton("Доступные задания 📋", callback_data="tasks")],
-        [InlineKeyboardButton("Перевести WVR 🔄", callback_data="transfer")],
-    ]
+    imported = []
+    rows = []
+    for filename in os.listdir(directory):
+        if not (filename.startswith("app_") and filename.endswith(".json")):
+            continue
+        filepath = os.path.join(directory, filename)
+        try:
+            with open(filepath, "r") as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.error(f"Ошибка чтения файла {filename}: {e}")
+            continue
 
-    if role in ["banker", "admin"]:
-        keyboard.append([InlineKeyboardButton("Банковские операции 🏦", callback_data="bank_operations")])
+        data.setdefault("application_id", str(uuid.uuid4()))
+        data.setdefault("status", "pending")
+        rows.append(tuple(data.get(field) for field in APPLICATION_FIELDS))
+        imported.append(filepath)
 
-    if role == "admin":
-        keyboard.append([InlineKeyboardButton("Администрирование 👑", callback_data="admin_actions")])
+    if not rows:
+        return
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    async with db_connection("civilian") as db:
+        await db.executemany(
+            f"""INSERT OR IGNORE INTO applications ({", ".join(APPLICATION_FIELDS)})
+            VALUES ({", ".join("?" for _ in APPLICATION_FIELDS)})""",
+            rows
+        )
+        await db.commit()
 
-    await update.message.reply_text(
-        f"Привет, {user.first_name}! 👋\n"
-        f"Твой статус: {ROLES.get(role, 'Гость')}\n"
-        "Выбери действие:",
-        reply_markup=reply_markup
-    )
+    for filepath in imported:
+        os.replace(filepath, f"{filepath}.imported")
+    logger.info(f"Перенесено {len(rows)} заявок из {directory}")
 
 
-async def check_pending_application(telegram_uid: str) -> bool:
-    """Проверяет, есть ли у пользователя активные заявки"""
+async def load_pending_applications():
     try:
-        if not os.path.exists(CONFIG["ADMIN_NOTIFICATIONS_DIR"]):
-            return False
-
-        for filename in os.listdir(CONFIG["ADMIN_NOTIFICATIONS_DIR"]):
-            if filename.startswith(f"app_{telegram_uid}_"):
-                filepath = os.path.join(CONFIG["ADMIN_NOTIFICATIONS_DIR"], filename)
-                try:
-                    with open(filepath, "r") as f:
-                        data = json.load(f)
-                        if data.get("status") != "rejected":
-                            return True
-                except Exception as e:
-                    logger.error(f"Ошибка чтения файла {filename}: {e}")
-        return False
+        await import_legacy_applications()
     except Exception as e:
-        logger.error(f"Ошибка проверки заявок: {e}")
-        return False
+        logger.error(f"Ошибка переноса заявок: {e}")
+
+    async with db_connection("civilian") as db:
+        cursor = await db.execute(
+            f"""SELECT DISTINCT telegram_uid FROM applications
+            WHERE status NOT IN ({", ".join("?" for _ in CLOSED_APPLICATION_STATUSES)})""",
+            CLOSED_APPLICATION_STATUSES
+        )
+        rows = await cursor.fetchall()
+
+    PENDING_APPLICATIONS.clear()
+    PENDING_APPLICATIONS.update(row[0] for row in rows)
+
+
+async def save_application(application_data: dict):
+    """Сохраняет новую заявку и, если включено, ее JSON-копию"""
+    async with db_connection("civilian") as db:
+        await db.execute(
+            f"""INSERT INTO applications ({", ".join(APPLICATION_FIELDS)})
+            VALUES ({", ".join(":" + field for field in APPLICATION_FIELDS)})""",
+            application_data
+        )
+        await db.commit()
+
+    if application_data["status"] not in CLOSED_APPLICATION_STATUSES:
+        PENDING_APPLICATIONS.add(application_data["telegram_uid"])
+
+    if CONFIG["EXPORT_APPLICATIONS_JSON"]:
+        with open(application_export_path(application_data), "w") as f:
+            json.dump(application_data, f)
+
+
+async def get_application(application_id: str) -> Optional[Dict]:
+    async with db_connection("civilian") as db:
+        cursor = await db.execute(
+            f"SELECT {', '.join(APPLICATION_FIELDS)} FROM applications WHERE application_id = ?",
+            (application_id,)
+        )
+        result = await cursor.fetchone()
+    return dict(zip(APPLICATION_FIELDS, result)) if result else None
+
+
+async def close_application(application_data: dict, status: str):
+    """Закрывает заявку с итоговым статусом и обновляет индекс ожидающих"""
+    telegram_uid = application_data["telegram_uid"]
+    async with db_connection("civilian") as db:
+        await db.execute(
+            "UPDATE applications SET status = ? WHERE application_id = ?",
+            (status, application_data["application_id"])
+        )
+        await db.commit()
+
+        cursor = await db.execute(
+            f"""SELECT 1 FROM applications WHERE telegram_uid = ?
+            AND status NOT IN ({", ".join("?" for _ in CLOSED_APPLICATION_STATUSES)}) LIMIT 1""",
+            (telegram_uid, *CLOSED_APPLICATION_STATUSES)
+        )
+        still_pending = await cursor.fetchone()
+
+    if not still_pending:
+        PENDING_APPLICATIONS.discard(telegram_uid)
+
+    export_path = application_export_path(application_data)
+    if os.path.exists(export_path):
+        os.remove(export_path)
+
+
+def check_pending_application(telegram_uid: str) -> bool:
+    """Проверяет, есть ли у пользователя активные заявки"""
+    return telegram_uid in PENDING_APPLICATIONS
 
 
 async def check_user_access(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
@@ -756,10 +2629,10 @@ async def check_user_access(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     user_id = str(update.effective_user.id)
 
-    if await is_blacklisted(user_id):
+    if is_blacklisted(user_id):
         return False
 
-    if await check_pending_application(user_id):
+    if check_pending_application(user_id):
         await update.message.reply_text(
             "Ваша заявка на рассмотрении. Пожалуйста, дождитесь решения администратора.",
             reply_markup=get_reply_markup()
@@ -780,7 +2653,7 @@ async def start_registration(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await query.answer()
     telegram_uid = str(query.from_user.id)
 
-    if await check_pending_application(telegram_uid):
+    if check_pending_application(telegram_uid):
         await query.edit_message_text(
             "❌ У вас уже есть заявка на рассмотрении. Пожалуйста, дождитесь решения администратора."
         )
@@ -838,9 +2711,7 @@ async def register_birthday(update: Update, context: ContextTypes.DEFAULT_TYPE)
             "status": "pending"
         }
 
-        filename = f"{CONFIG['ADMIN_NOTIFICATIONS_DIR']}/app_{application_data['telegram_uid']}_{application_id}.json"
-        with open(filename, "w") as f:
-            json.dump(application_data, f)
+        await save_application(application_data)
 
         if full_match:
             await notify_admins(context, update.effective_user, application_data, "полное совпадение")
@@ -863,7 +2734,9 @@ async def register_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
+    application_id = str(uuid.uuid4())
     application_data = {
+        "application_id": application_id,
         "telegram_uid": str(update.effective_user.id),
         "mc_nickname": context.user_data["mc_nickname"],
         "discord_nickname": context.user_data["discord_nickname"],
@@ -872,30 +2745,20 @@ async def register_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "status": "no_match_confirmed"
     }
 
-    os.makedirs(CONFIG["ADMIN_NOTIFICATIONS_DIR"], exist_ok=True)
-    filename = f"{CONFIG['ADMIN_NOTIFICATIONS_DIR']}/app_{update.effective_user.id}.json"
+    await save_application(application_data)
 
-    with open(filename, "w") as f:
-        json.dump(application_data, f)
-
-    admins = await get_admin_ids()
-    for admin_id in admins:
-        try:
-            keyboard = [
-                [InlineKeyboardButton("✅ Одобрить", callback_data=f"register_approve_{update.effective_user.id}")],
-                [InlineKeyboardButton("❌ Заблокировать", callback_data=f"register_block_{update.effective_user.id}")]
-            ]
-
-            await context.bot.send_message(
-                admin_id,
-                f"📨 Новая заявка от @{update.effective_user.username} (без совпадений в БД)\n"
-                f"MC: {context.user_data['mc_nickname']}\n"
-                f"Discord: {context.user_data['discord_nickname']}\n"
-                f"Дата рождения: {context.user_data['birthday']}",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-        except Exception as e:
-            logger.error(f"Не удалось уведомить админа {admin_id}: {e}")
+    keyboard = [
+        [InlineKeyboardButton("✅ Одобрить", callback_data=f"approve_{application_id}")],
+        [InlineKeyboardButton("❌ Заблокировать", callback_data=f"block_{application_id}")]
+    ]
+    NOTIFIER.enqueue_many(
+        await get_admin_ids(),
+        f"📨 Новая заявка от @{update.effective_user.username} (без совпадений в БД)\n"
+        f"MC: {context.user_data['mc_nickname']}\n"
+        f"Discord: {context.user_data['discord_nickname']}\n"
+        f"Дата рождения: {context.user_data['birthday']}",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
 
     await query.edit_message_text(
         "✅ Ваша заявка отправлена на рассмотрение администратору. "
@@ -920,22 +2783,14 @@ async def handle_application_decision(update: Update, context: ContextTypes.DEFA
     await query.answer()
 
     action, application_id = query.data.split("_", 1)
-    application_file = None
-
-    for filename in os.listdir(CONFIG["ADMIN_NOTIFICATIONS_DIR"]):
-        if f"_{application_id}.json" in filename:
-            application_file = os.path.join(CONFIG["ADMIN_NOTIFICATIONS_DIR"], filename)
-            break
+    application_data = await get_application(application_id)
 
-    if not application_file:
+    if not application_data or application_data["status"] in CLOSED_APPLICATION_STATUSES:
         await query.edit_message_text("❌ Заявка не найдена")
         return
 
-    with open(application_file, "r") as f:
-        application_data = json.load(f)
-
     if action == "approve":
-        async with aiosqlite.connect("civilian.db") as db:
+        async with db_connection("civilian") as db:
             cursor = await db.execute(
                 "SELECT id FROM civilians WHERE nickname = ? AND discord = ?",
                 (application_data["mc_nickname"], application_data["discord_nickname"])
@@ -958,9 +2813,11 @@ async def handle_application_decision(update: Update, context: ContextTypes.DEFA
             )
             await db.commit()
 
+        invalidate_identity(telegram_uid=application_data["telegram_uid"], city_id=city_id)
+
         await create_bank_account(city_id)
 
-        os.remove(application_file)
+        await close_application(application_data, "approved")
         await query.edit_message_text(
             f"✅ Заявка одобрена\n"
             f"Городской ID: `{city_id}`\n"
@@ -982,7 +2839,7 @@ async def handle_application_decision(update: Update, context: ContextTypes.DEFA
         )
 
         if success:
-            os.remove(application_file)
+            await close_application(application_data, "blocked")
             await query.edit_message_text("✅ Пользователь добавлен в черный список")
 
             await notify_user(
@@ -995,24 +2852,164 @@ async def handle_application_decision(update: Update, context: ContextTypes.DEFA
             await query.edit_message_text("❌ Ошибка добавления в черный список")
 
 
-async def notify_user(context: ContextTypes.DEFAULT_TYPE, user_id: str, message: str):
-    """Отправляет уведомление пользователю"""
-    try:
-        await context.bot.send_message(user_id, message)
-    except Exception as e:
-        logger.error(f"Не удалось уведомить пользователя {user_id}: {e}")
+class NotificationDispatcher:
+    """Очередь исходящих уведомлений: ограниченное число воркеров, лимиты Telegram
+    на бота и на чат, повторы при RetryAfter и сетевых ошибках"""
+
+    def __init__(self, workers: int, global_rate: float, chat_rate: float,
+                 max_attempts: int, retry_delay: float):
+        self.workers = workers
+        self.chat_rate = chat_rate
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.bot = None
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        self._limiter = AsyncLimiter(global_rate, 1)
+        self._chat_limiters = TTLCache(maxsize=10000, ttl=60)
+        self._paused_until = 0.0
+        self.queued = 0
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+        self.retried = 0
+
+    async def start(self, bot):
+        """Запускает воркеров. bot - любой объект с async send_message(chat_id, text, **kwargs)"""
+        self.bot = bot
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 0):
+        """Дожидается отправки очереди не дольше timeout секунд и останавливает воркеров"""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не отправлено уведомлений при остановке: {self._queue.qsize()}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def enqueue(self, chat_id, text: str, on_result=None, **kwargs):
+        """Ставит сообщение в очередь и сразу возвращает управление.
+
+        on_result - необязательная корутина-функция (chat_id, status), status -
+        "sent", "blocked" или "failed". kwargs передаются в send_message."""
+        self._queue.put_nowait((chat_id, text, kwargs, on_result))
+        self.queued += 1
+
+    def enqueue_many(self, chat_ids, text: str, on_result=None, **kwargs) -> int:
+        """Рассылает одно сообщение в несколько чатов"""
+        count = 0
+        for chat_id in chat_ids:
+            self.enqueue(chat_id, text, on_result, **kwargs)
+            count += 1
+        return count
+
+    def _chat_limiter(self, chat_id) -> AsyncLimiter:
+        limiter = self._chat_limiters.get(chat_id)
+        if limiter is None:
+            limiter = AsyncLimiter(self.chat_rate, 1)
+            self._chat_limiters[chat_id] = limiter
+        return limiter
+
+    async def _worker(self):
+        while True:
+            chat_id, text, kwargs, on_result = await self._queue.get()
+            try:
+                # on_result вызывается ровно один раз на сообщение: рассылка по нему
+                # освобождает место в окне и без вызова ждала бы вечно
+                try:
+                    status = await self._deliver(chat_id, text, kwargs)
+                except Exception as e:
+                    logger.error(f"Ошибка отправки уведомления {chat_id}: {e}")
+                    self.failed += 1
+                    status = "failed"
+                if on_result is not None:
+                    await on_result(chat_id, status)
+            except Exception as e:
+                logger.error(f"Ошибка обработки уведомления для {chat_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, chat_id, text: str, kwargs: Dict) -> str:
+        for attempt in range(1, self.max_attempts + 1):
+            # После RetryAfter молчат все воркеры: ограничение выдается на бота целиком
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            await self._chat_limiter(chat_id).acquire()
+            await self._limiter.acquire()
+
+            try:
+                await self.bot.send_message(chat_id, text, **kwargs)
+                self.sent += 1
+                return "sent"
+            except telegram.error.RetryAfter as e:
+                retry_after = e.retry_after
+                if not isinstance(retry_after, (int, float)):
+                    retry_after = retry_after.total_seconds()
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                logger.warning(f"Telegram ограничил отправку на {retry_after} с")
+            except telegram.error.Forbidden:
+                self.blocked += 1
+                return "blocked"
+            except telegram.error.BadRequest as e:
+                logger.error(f"Не удалось отправить сообщение {chat_id}: {e}")
+                break
+            except telegram.error.NetworkError as e:
+                logger.warning(f"Сетевая ошибка при отправке {chat_id} (попытка {attempt}): {e}")
+                if attempt < self.max_attempts:
+                    delay = self.retry_delay * 2 ** (attempt - 1)
+                    await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+            except telegram.error.TelegramError as e:
+                # ChatMigrated, InvalidToken и прочие ошибки, которые повтор не исправит
+                logger.error(f"Ошибка Telegram при отправке {chat_id}: {e}")
+                break
+            if attempt < self.max_attempts:
+                self.retried += 1
+
+        self.failed += 1
+        return "failed"
+
+    def stats(self) -> Dict:
+        return {
+            "queued": self.queued,
+            "sent": self.sent,
+            "failed": self.failed,
+            "blocked": self.blocked,
+            "retried": self.retried,
+            "pending": self._queue.qsize(),
+        }
+
+
+NOTIFIER = NotificationDispatcher(
+    CONFIG["NOTIFY_WORKERS"],
+    CONFIG["NOTIFY_GLOBAL_RATE"],
+    CONFIG["NOTIFY_CHAT_RATE"],
+    CONFIG["NOTIFY_MAX_ATTEMPTS"],
+    CONFIG["NOTIFY_RETRY_DELAY"],
+)
+
+
+async def notify_user(context: ContextTypes.DEFAULT_TYPE, user_id: str, message: str, **kwargs):
+    """Ставит уведомление пользователю в очередь отправки"""
+    NOTIFIER.enqueue(user_id, message, **kwargs)
 
 
 async def create_bank_account(city_id: str) -> bool:
     """Создает банковский счет для пользователя по городскому ID"""
     try:
-        async with aiosqlite.connect("bank.db") as db:
+        async def operation(db):
             await db.execute(
                 "INSERT INTO accounts (id, balance, salary) VALUES (?, 0, 0)",
                 (city_id,)
             )
-            await db.commit()
             return True
+
+        return await bank_write(operation)
     except Exception as e:
         logger.error(f"Ошибка создания банковского счета: {e}")
         return False
@@ -1040,16 +3037,9 @@ async def notify_admins(context: ContextTypes.DEFAULT_TYPE, user: User, applicat
          InlineKeyboardButton("❌ Заблокировать", callback_data=f"block_{application_data['application_id']}")]
     ]
 
-    for admin_id in admins:
-        try:
-            await context.bot.send_message(
-                admin_id,
-                message,
-                parse_mode="Markdown",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-        except Exception as e:
-            logger.error(f"Не удалось уведомить админа {admin_id}: {e}")
+    NOTIFIER.enqueue_many(
+        admins, message, parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(keyboard)
+    )
 
 
 # Банковские операции
@@ -1061,13 +3051,225 @@ async def bank_operations_menu(update: Update, context: ContextTypes.DEFAULT_TYP
         [InlineKeyboardButton("Начислить WVR 💰", callback_data="deposit")],
         [InlineKeyboardButton("Снять WVR 🏧", callback_data="withdraw")],
         [InlineKeyboardButton("Обналичить WVR 💎", callback_data="exchange")],
+        [InlineKeyboardButton("Пакетная операция из CSV 📑", callback_data="batch_ops")],
         [InlineKeyboardButton("Назад ↩️", callback_data="main_menu")],
     ]
 
-    await query.edit_message_text(
-        "🏦 Банковские операции\nВыберите действие:",
-        reply_markup=InlineKeyboardMarkup(keyboard)
-    )
+    await query.edit_message_text(
+        "🏦 Банковские операции\nВыберите действие:",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+
+# Пакетные начисления и списания. Строка CSV: ID или ник, сумма, причина.
+# Положительная сумма - начисление, отрицательная - списание.
+def parse_batch_csv(data: bytes, index: ResidentIndex, balances: Dict[str, int]) -> tuple:
+    """Проверяет файл за один проход, возвращает (строки, ошибки).
+
+    Списания проверяются по балансу с учетом предыдущих строк того же файла."""
+    rows, errors = [], []
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return rows, ["Файл должен быть в кодировке UTF-8"]
+
+    # Excel с русской локалью сохраняет CSV через ";", поэтому разделитель берем по первой строке
+    first_line = text.split("\n", 1)[0]
+    delimiter = max(";,\t", key=first_line.count)
+    running = dict(balances)
+
+    for line_no, record in enumerate(csv.reader(io.StringIO(text), delimiter=delimiter), start=1):
+        if not record or not any(field.strip() for field in record):
+            continue
+        if len(record) < 2:
+            errors.append(f"Строка {line_no}: нужны как минимум ID или ник и сумма")
+            continue
+
+        recipient, amount = record[0].strip(), record[1].strip()
+        reason = record[2].strip() if len(record) > 2 else ""
+        try:
+            amount = int(amount)
+        except ValueError:
+            if line_no == 1:
+                continue  # заголовок
+            errors.append(f"Строка {line_no}: сумма должна быть целым числом")
+            continue
+        if amount == 0:
+            errors.append(f"Строка {line_no}: нулевая сумма")
+            continue
+
+        matches = index.resolve(recipient)
+        if not matches:
+            errors.append(f"Строка {line_no}: житель {recipient} не найден")
+            continue
+        if len(matches) > 1:
+            errors.append(f"Строка {line_no}: ник {recipient} неоднозначен, укажите ID")
+            continue
+
+        resident = matches[0]
+        if resident["id"] not in running:
+            errors.append(f"Строка {line_no}: у жителя {resident['id']} нет счета")
+            continue
+        if running[resident["id"]] + amount < 0:
+            errors.append(
+                f"Строка {line_no}: недостаточно средств у {resident['id']} "
+                f"(баланс {running[resident['id']]}, списание {-amount})"
+            )
+            continue
+
+        running[resident["id"]] += amount
+        rows.append({
+            "line": line_no,
+            "id": resident["id"],
+            "nickname": resident["nickname"],
+            "telegram_uid": resident["telegram_uid"],
+            "amount": amount,
+            "reason": reason or "Пакетная операция",
+        })
+
+    if len(rows) + len(errors) > CONFIG["BATCH_MAX_ROWS"]:
+        errors.insert(0, f"Слишком много строк, максимум {CONFIG['BATCH_MAX_ROWS']}")
+    return rows, errors
+
+
+async def apply_batch_operations(rows: List[Dict], key: str) -> Union[bool, str]:
+    """Проводит все строки одной операцией писателя bank.db: либо все, либо ничего.
+
+    Строка n получает ключ идемпотентности key:n, повтор распознается по первой."""
+    keys = [f"{key}:{n}" for n in range(len(rows))]
+
+    async def operation(db):
+        now = datetime.now().isoformat()
+        cursor = await db.executemany(
+            "UPDATE accounts SET balance = balance + ? WHERE id = ? AND balance + ? >= 0",
+            [(row["amount"], row["id"], row["amount"]) for row in rows]
+        )
+        if cursor.rowcount != len(rows):
+            raise ValueError("баланс изменился после проверки, списание невозможно")
+
+        await db.executemany(
+            """INSERT INTO transactions
+            (user_id, type, date, from_user, to_user, amount, comment, idempotency_key)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+            [(row["id"], "deposit" if row["amount"] > 0 else "withdraw", now,
+              None if row["amount"] > 0 else row["id"], row["id"] if row["amount"] > 0 else None,
+              abs(row["amount"]), row["reason"], row_key)
+             for row, row_key in zip(rows, keys)]
+        )
+        return True
+
+    return await ledger_write(operation, keys[0])
+
+
+async def batch_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    if await get_user_role(str(update.effective_user.id)) not in ("banker", "admin"):
+        await query.edit_message_text("⛔ Пакетные операции доступны только банкирам")
+        return ConversationHandler.END
+
+    context.user_data.pop("batch_rows", None)
+    await query.edit_message_text(
+        "📑 Пакетная операция\n"
+        "Отправьте CSV-файл, по строке на операцию: ID или ник, сумма, причина.\n"
+        "Положительная сумма - начисление, отрицательная - списание.\n"
+        "Например: 1234;500;Приз за ивент\n\n"
+        "/cancel - отмена"
+    )
+    return BATCH_FILE
+
+
+async def batch_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    document = update.message.document
+    if document.file_size and document.file_size > CONFIG["BATCH_MAX_FILE_SIZE"]:
+        await update.message.reply_text("Файл слишком большой. Отправьте файл поменьше.")
+        return BATCH_FILE
+
+    file = await document.get_file()
+    data = bytes(await file.download_as_bytearray())
+
+    async with db_connection("bank") as db:
+        cursor = await db.execute("SELECT id, balance FROM accounts")
+        balances = dict(await cursor.fetchall())
+    rows, errors = parse_batch_csv(data, await get_resident_index(), balances)
+
+    deposits = [row["amount"] for row in rows if row["amount"] > 0]
+    withdrawals = [-row["amount"] for row in rows if row["amount"] < 0]
+    summary = (
+        f"📑 Проверка файла {document.file_name or ''}\n"
+        f"Начислений: {len(deposits)} на {sum(deposits)} WVR\n"
+        f"Списаний: {len(withdrawals)} на {sum(withdrawals)} WVR\n"
+    )
+
+    if errors:
+        shown = "\n".join(errors[:10])
+        more = f"\n...и еще {len(errors) - 10}" if len(errors) > 10 else ""
+        await update.message.reply_text(
+            f"{summary}\n❌ Ошибок: {len(errors)}\n{shown}{more}\n\n"
+            "Ничего не проведено. Исправьте файл и отправьте снова или /cancel."
+        )
+        return BATCH_FILE
+
+    if not rows:
+        await update.message.reply_text("В файле нет операций. Отправьте другой файл или /cancel.")
+        return BATCH_FILE
+
+    context.user_data["batch_rows"] = rows
+    keyboard = [
+        [InlineKeyboardButton("Провести ✅", callback_data="batch_apply")],
+        [InlineKeyboardButton("Отмена ❌", callback_data="batch_cancel")],
+    ]
+    await update.message.reply_text(
+        f"{summary}\nОшибок нет. Провести все операции?",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+    return BATCH_CONFIRM
+
+
+async def batch_apply(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    rows = context.user_data.pop("batch_rows", None)
+    if not rows:
+        await query.edit_message_text("Нет проверенного файла для проведения")
+        return ConversationHandler.END
+
+    try:
+        result = await apply_batch_operations(rows, idempotency_key(update, "batch"))
+    except Exception as e:
+        logger.error(f"Ошибка пакетной операции: {e}")
+        await query.edit_message_text(f"❌ Пакет не проведен: {e}\nНи одна операция не выполнена.")
+        return ConversationHandler.END
+
+    if result == ALREADY_APPLIED:
+        await query.edit_message_text("ℹ️ Этот пакет уже проведен")
+        return ConversationHandler.END
+
+    for row in rows:
+        if row["telegram_uid"]:
+            if row["amount"] > 0:
+                text = f"📥 Вам начислено {row['amount']} WVR\nПричина: {row['reason']}"
+            else:
+                text = f"📤 С вашего счета списано {-row['amount']} WVR\nПричина: {row['reason']}"
+            NOTIFIER.enqueue(row["telegram_uid"], text)
+
+    await query.edit_message_text(f"✅ Проведено операций: {len(rows)}")
+    return ConversationHandler.END
+
+
+async def batch_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    context.user_data.pop("batch_rows", None)
+    await query.edit_message_text("Пакетная операция отменена")
+    return ConversationHandler.END
+
+
+async def bank_operations_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопка отмены внутри банковской операции: возврат в меню и выход из диалога"""
+    await bank_operations_menu(update, context)
+    return ConversationHandler.END
 
 
 async def deposit_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1079,42 +3281,34 @@ async def deposit_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def deposit_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    recipient = update.message.text
-    context.user_data["deposit_recipient"] = recipient
+    resident, matches = await lookup_resident(update.message.text)
 
-    async with aiosqlite.connect("civilian.db") as db:
-        cursor = await db.execute(
-            "SELECT id FROM civilians WHERE id = ? OR nickname LIKE ?",
-            (recipient, f"%{recipient}%")
+    if not matches:
+        await update.message.reply_text("Житель не найден. Проверьте данные и попробуйте снова.")
+        return ConversationHandler.END
+
+    if resident is None:
+        await update.message.reply_text(
+            "Найдено несколько жителей. Выберите нужного:",
+            reply_markup=resident_choice_keyboard(matches, "deposit_to_", "bank_operations")
         )
-        result = await cursor.fetchall()
+        return DEPOSIT_USER
 
-        if not result:
-            await update.message.reply_text("Житель не найден. Проверьте данные и попробуйте снова.")
-            return ConversationHandler.END
+    context.user_data["deposit_user_id"] = resident["id"]
+    context.user_data["deposit_telegram_uid"] = resident["telegram_uid"]
+    await update.message.reply_text("Введите сумму для начисления:")
+    return DEPOSIT_AMOUNT
 
-        if len(result) > 1:
-            keyboard = []
-            for row in result:
-                cursor = await db.execute(
-                    "SELECT nickname FROM civilians WHERE id = ?",
-                    (row[0],))
-                nickname = await cursor.fetchone()
-                keyboard.append([InlineKeyboardButton(
-                    f"{nickname[0]} (ID: {row[0]})",
-                    callback_data=f"deposit_to_{row[0]}")
-                ])
-
-            keyboard.append([InlineKeyboardButton("Отмена ❌", callback_data="bank_operations")])
-            await update.message.reply_text(
-                "Найдено несколько жителей. Выберите нужного:",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-            return ConversationHandler.END
 
-        context.user_data["deposit_user_id"] = result[0][0]
-        await update.message.reply_text("Введите сумму для начисления:")
-        return DEPOSIT_AMOUNT
+async def deposit_select(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    user_id = query.data[len("deposit_to_"):]
+    resident = (await get_resident_index()).by_id.get(user_id)
+    context.user_data["deposit_user_id"] = user_id
+    context.user_data["deposit_telegram_uid"] = resident["telegram_uid"] if resident else None
+    await query.edit_message_text("Введите сумму для начисления:")
+    return DEPOSIT_AMOUNT
 
 
 async def deposit_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1136,27 +3330,20 @@ async def deposit_complete(update: Update, context: ContextTypes.DEFAULT_TYPE):
     reason = update.message.text
     user_id = context.user_data["deposit_user_id"]
     amount = context.user_data["deposit_amount"]
+    telegram_uid = context.user_data.get("deposit_telegram_uid")
 
-    async with aiosqlite.connect("civilian.db") as db:
-        cursor = await db.execute(
-            "SELECT telegram_uid FROM civilians WHERE id = ?",
-            (user_id,)
-        )
-        result = await cursor.fetchone()
-        telegram_uid = result[0] if result else None
-
-    success = await deposit_money(user_id, amount, reason)
+    success = await deposit_money(user_id, amount, reason, idempotency_key(update, "deposit"))
 
-    if success:
+    if success == ALREADY_APPLIED:
+        await update.message.reply_text("ℹ️ Эта операция уже выполнена")
+    elif success:
         if telegram_uid:
-            try:
-                await context.bot.send_message(
-                    telegram_uid,
-                    f"📥 Вам начислено {amount} WVR\n"
-                    f"Причина: {reason}"
-                )
-            except Exception as e:
-                logger.error(f"Не удалось уведомить пользователя: {e}")
+            await notify_user(
+                context,
+                telegram_uid,
+                f"📥 Вам начислено {amount} WVR\n"
+                f"Причина: {reason}"
+            )
 
         await update.message.reply_text(
             f"✅ Успешно начислено {amount} WVR\n"
@@ -1177,52 +3364,150 @@ async def transfer_start(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
-        text="Введите ник получателя или его ID:",
+        text="Введите ник получателя или его ID:\n"
+             f"Подсказка: наберите @{context.bot.username} и начало ника, чтобы выбрать из списка",
         reply_markup=get_reply_markup(include_cancel=True)
     )
     return TRANSFER_RECIPIENT
 
 
-async def transfer_recipient(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    recipient = update.message.text
-    context.user_data['transfer_recipient'] = recipient
+TRANSFER_KEYS = ("transfer_recipient_id", "transfer_recipient_nick", "transfer_recipient_uid",
+                 "transfer_amount", "transfer_comment")
+TRANSFER_LINK_PREFIX = "transfer_"
 
-    async with aiosqlite.connect("civilian.db") as db:
-        cursor = await db.execute(
-            "SELECT id, nickname, telegram_uid FROM civilians WHERE nickname LIKE ? OR id = ?",
-            (f"%{recipient}%", recipient)
-        )
-        results = await cursor.fetchall()
 
-        if not results:
-            await update.message.reply_text(
-                "❌ Житель не найден. Проверьте данные и попробуйте снова.",
-                reply_markup=get_reply_markup(include_cancel=True)
-            )
+def transfer_link_payload(resident_id: str) -> str:
+    """Параметр ссылки t.me/<бот>?start=...: допустимы только [A-Za-z0-9_-], поэтому ID кодируется"""
+    return TRANSFER_LINK_PREFIX + base64.urlsafe_b64encode(resident_id.encode()).decode().rstrip("=")
+
+
+def parse_transfer_link_payload(payload: str) -> Optional[str]:
+    encoded = payload[len(TRANSFER_LINK_PREFIX):]
+    try:
+        return base64.b64decode(encoded + "=" * (-len(encoded) % 4), altchars=b"-_", validate=True).decode()
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+async def transfer_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """/transfer [ID] - перевод; с ID сразу спрашивает сумму"""
+    if not context.args:
+        if await get_user_role(str(update.effective_user.id)) in (None, "guest"):
+            await update.message.reply_text("⛔ Переводы доступны только жителям")
             return ConversationHandler.END
+        return await transfer_start(update, context)
+    return await transfer_to_resident(update, context, context.args[0])
 
-        if len(results) > 1:
-            keyboard = []
-            for user_id, nickname, _ in results:
-                keyboard.append([InlineKeyboardButton(
-                    f"{nickname} (ID: {user_id})",
-                    callback_data=f"transfer_select_{user_id}"
-                )])
 
-            keyboard.append([InlineKeyboardButton("❌ Отменить", callback_data="cancel")])
+async def transfer_link_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """/start transfer_<ID> - переход по кнопке из inline-поиска в личный чат с ботом"""
+    return await transfer_to_resident(update, context, parse_transfer_link_payload(context.args[0]))
 
-            await update.message.reply_text(
-                "Найдено несколько жителей. Выберите нужного:",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-            return TRANSFER_SELECT_USER
 
-        context.user_data['transfer_recipient_id'] = results[0][0]
+async def transfer_to_resident(update: Update, context: ContextTypes.DEFAULT_TYPE, resident_id: str) -> int:
+    if await get_user_role(str(update.effective_user.id)) in (None, "guest"):
+        await update.message.reply_text("⛔ Переводы доступны только жителям")
+        return ConversationHandler.END
+
+    resident = (await get_resident_index()).by_id.get(resident_id) if resident_id else None
+    if resident is None:
+        await update.message.reply_text("❌ Житель не найден. Проверьте ID и попробуйте снова.")
+        return ConversationHandler.END
+
+    # Прочие незавершенные операции (например, пакетная загрузка) не трогаем
+    for key in TRANSFER_KEYS:
+        context.user_data.pop(key, None)
+    remember_transfer_recipient(context, resident)
+    await update.message.reply_text(
+        f"Получатель: {resident['nickname']}\nВведите сумму для перевода:",
+        reply_markup=get_reply_markup(include_cancel=True)
+    )
+    return TRANSFER_AMOUNT
+
+
+def remember_transfer_recipient(context: ContextTypes.DEFAULT_TYPE, resident: Dict):
+    context.user_data['transfer_recipient_id'] = resident["id"]
+    context.user_data['transfer_recipient_nick'] = resident["nickname"]
+    context.user_data['transfer_recipient_uid'] = resident["telegram_uid"]
+
+
+async def transfer_recipient(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    resident, matches = await lookup_resident(update.message.text)
+
+    if not matches:
         await update.message.reply_text(
-            "Введите сумму для перевода:",
+            "❌ Житель не найден. Проверьте данные и попробуйте снова.",
             reply_markup=get_reply_markup(include_cancel=True)
         )
-        return TRANSFER_AMOUNT
+        return ConversationHandler.END
+
+    if resident is None:
+        await update.message.reply_text(
+            "Найдено несколько жителей. Выберите нужного:",
+            reply_markup=resident_choice_keyboard(matches, "transfer_select_", "cancel_transfer")
+        )
+        return TRANSFER_SELECT_USER
+
+    remember_transfer_recipient(context, resident)
+    await update.message.reply_text(
+        "Введите сумму для перевода:",
+        reply_markup=get_reply_markup(include_cancel=True)
+    )
+    return TRANSFER_AMOUNT
+
+
+async def transfer_select_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    resident = (await get_resident_index()).by_id.get(query.data[len("transfer_select_"):])
+    if resident is None:
+        await query.edit_message_text("❌ Житель не найден. Начните перевод заново.")
+        return ConversationHandler.END
+
+    remember_transfer_recipient(context, resident)
+    await query.edit_message_text(f"Получатель: {resident['nickname']}\nВведите сумму для перевода:")
+    return TRANSFER_AMOUNT
+
+
+async def resident_inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Inline-поиск получателя: @бот ник.
+
+    Inline-запрос можно набрать в любом чате, а команды из групп бот не получает,
+    поэтому результат публикует карточку с кнопкой-ссылкой на перевод в личном чате"""
+    inline_query = update.inline_query
+    telegram_uid = str(inline_query.from_user.id)
+    identity = await get_identity(telegram_uid)
+    if is_blacklisted(telegram_uid) or not identity or identity["role"] == "guest":
+        await inline_query.answer([], cache_time=CONFIG["INLINE_CACHE_TTL"], is_personal=True)
+        return
+
+    # Регистр не меняется: ID сравниваются точно, ники search сам приводит к нижнему регистру
+    text = inline_query.query.strip()
+    if not text:
+        await inline_query.answer([], cache_time=CONFIG["INLINE_CACHE_TTL"], is_personal=True)
+        return
+
+    matches = INLINE_SEARCH_CACHE.get(text)
+    if matches is None:
+        matches = (await get_resident_index()).search(text)
+        INLINE_SEARCH_CACHE[text] = matches
+
+    results = [
+        InlineQueryResultArticle(
+            id=resident["id"],
+            title=resident["nickname"],
+            description=f"ID: {resident['id']} · перевести WVR",
+            input_message_content=InputTextMessageContent(
+                f"💸 Перевод WVR жителю {resident['nickname']} (ID: {resident['id']})"
+            ),
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
+                "Перевести 💸",
+                url=f"https://t.me/{context.bot.username}?start={transfer_link_payload(resident['id'])}"
+            )]]),
+        )
+        for resident in matches if resident["id"] != identity["id"]
+    ]
+    await inline_query.answer(results, cache_time=CONFIG["INLINE_CACHE_TTL"], is_personal=True)
 
 
 async def transfer_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -1241,16 +3526,6 @@ async def transfer_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             )
             return ConversationHandler.END
 
-        recipient = context.user_data['transfer_recipient']
-        async with aiosqlite.connect("civilian.db") as db:
-            cursor = await db.execute(
-                "SELECT id, nickname FROM civilians WHERE nickname LIKE ? OR id = ?",
-                (f"%{recipient}%", recipient)
-            )
-            result = await cursor.fetchone()
-            context.user_data['transfer_recipient_id'] = result[0]
-            context.user_data['transfer_recipient_nick'] = result[1]
-
         keyboard = [
             [InlineKeyboardButton("✅ Подтвердить", callback_data="confirm_transfer")],
             [InlineKeyboardButton("✏️ Добавить комментарий", callback_data="add_comment")],
@@ -1259,7 +3534,7 @@ async def transfer_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
         await update.message.reply_text(
             f"Подтвердите перевод:\n"
-            f"• Получатель: {result[1]}\n"
+            f"• Получатель: {context.user_data['transfer_recipient_nick']}\n"
             f"• Сумма: {amount} WVR\n"
             f"• Комментарий: {'нет' if 'transfer_comment' not in context.user_data else context.user_data['transfer_comment']}",
             reply_markup=InlineKeyboardMarkup(keyboard)
@@ -1283,34 +3558,27 @@ async def confirm_transfer_handler(update: Update, context: ContextTypes.DEFAULT
     comment = context.user_data.get('transfer_comment', '')
     from_uid = str(update.effective_user.id)
 
-    success = await transfer_money(from_uid, recipient_id, amount, comment)
-
-    if success:
-        async with aiosqlite.connect("civilian.db") as db:
-            cursor = await db.execute(
-                "SELECT nickname, telegram_uid FROM civilians WHERE id = ?",
-                (recipient_id,)
-            )
-            recipient_nick, to_uid = await cursor.fetchone()
+    success = await transfer_money(
+        from_uid, recipient_id, amount, comment, idempotency_key(update, "transfer")
+    )
 
-            cursor = await db.execute(
-                "SELECT nickname FROM civilians WHERE telegram_uid = ?",
-                (from_uid,)
-            )
-            from_nick = (await cursor.fetchone())[0]
+    if success == ALREADY_APPLIED:
+        await query.edit_message_text("ℹ️ Этот перевод уже выполнен")
+    elif success:
+        recipient_nick = context.user_data['transfer_recipient_nick']
+        to_uid = context.user_data.get('transfer_recipient_uid')
+        from_nick = (await get_identity(from_uid))["nickname"]
 
         msg = f"✅ Успешно переведено {amount} WVR пользователю {recipient_nick}"
         if comment:
             msg += f"\nКомментарий: {comment}"
         await query.edit_message_text(msg)
 
-        try:
-            recipient_msg = f"📥 Вам переведено {amount} WVR от {from_nick}"
-            if comment:
-                recipient_msg += f"\nКомментарий: {comment}"
-            await context.bot.send_message(to_uid, recipient_msg)
-        except Exception as e:
-            logger.error(f"Ошибка уведомления получателя: {e}")
+        recipient_msg = f"📥 Вам переведено {amount} WVR от {from_nick}"
+        if comment:
+            recipient_msg += f"\nКомментарий: {comment}"
+        if to_uid:
+            await notify_user(context, to_uid, recipient_msg)
     else:
         await query.edit_message_text("❌ Ошибка при выполнении перевода")
 
@@ -1360,6 +3628,7 @@ async def admin_actions(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton("Управление заданиями 📝", callback_data="manage_tasks")],
         [InlineKeyboardButton("Просмотр транзакций 💰", callback_data="view_transactions")],
         [InlineKeyboardButton("Чёрный список 🚫", callback_data="manage_blacklist")],
+        [InlineKeyboardButton("Рассылка 📢", callback_data="broadcast")],
         [InlineKeyboardButton("Назад ↩️", callback_data="main_menu")],
     ]
 
@@ -1371,6 +3640,232 @@ async def admin_actions(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+# Рассылки. Получатели фиксируются в broadcast_recipients при создании, статус
+# каждого сохраняется пачками, поэтому после перезапуска рассылка продолжается
+# с неотправленных.
+BROADCAST_AUDIENCES = {
+    "resident": "Жителям 🏠",
+    "banker": "Банкирам 💰",
+    "admin": "Администраторам 👑",
+    "all": "Всем зарегистрированным 👥",
+}
+BROADCAST_TASKS: Dict[str, asyncio.Task] = {}
+
+
+async def create_broadcast(text: str, audience: str, created_by: str) -> tuple:
+    """Создает рассылку и список получателей, возвращает (id, число получателей)"""
+    query = "SELECT DISTINCT telegram_uid FROM civilians WHERE telegram_uid IS NOT NULL AND telegram_uid != ''"
+    params = ()
+    if audience != "all":
+        query += " AND role = ?"
+        params = (audience,)
+
+    broadcast_id = str(uuid.uuid4())
+    async with db_connection("civilian") as db:
+        cursor = await db.execute(query, params)
+        recipients = [(broadcast_id, row[0]) for row in await cursor.fetchall()
+                      if not is_blacklisted(row[0])]
+        await db.execute(
+            "INSERT INTO broadcasts (id, text, audience, created_by, created_at) VALUES (?, ?, ?, ?, ?)",
+            (broadcast_id, text, audience, created_by, datetime.now().isoformat())
+        )
+        await db.executemany(
+            "INSERT INTO broadcast_recipients (broadcast_id, telegram_uid) VALUES (?, ?)",
+            recipients
+        )
+        await db.commit()
+    return broadcast_id, len(recipients)
+
+
+async def get_broadcast_stats(broadcast_id: str) -> Dict[str, int]:
+    async with db_connection("civilian") as db:
+        cursor = await db.execute(
+            "SELECT status, COUNT(*) FROM broadcast_recipients WHERE broadcast_id = ? GROUP BY status",
+            (broadcast_id,)
+        )
+        counts = dict(await cursor.fetchall())
+    return {status: counts.get(status, 0) for status in ("pending", "sent", "failed", "blocked")}
+
+
+async def save_broadcast_results(broadcast_id: str, results: List[tuple]):
+    if not results:
+        return
+    batch = [(status, broadcast_id, str(chat_id)) for chat_id, status in results]
+    results.clear()
+    async with db_connection("civilian") as db:
+        await db.executemany(
+            "UPDATE broadcast_recipients SET status = ? WHERE broadcast_id = ? AND telegram_uid = ?",
+            batch
+        )
+        await db.commit()
+
+
+async def run_broadcast(broadcast_id: str):
+    """Отправляет рассылку неотправленным получателям через общий диспетчер.
+
+    В очереди уведомлений одновременно не больше BROADCAST_WINDOW сообщений
+    рассылки, чтобы личные уведомления не ждали ее окончания."""
+    async with db_connection("civilian") as db:
+        cursor = await db.execute(
+            "SELECT text, created_by FROM broadcasts WHERE id = ?", (broadcast_id,)
+        )
+        text, created_by = await cursor.fetchone()
+        cursor = await db.execute(
+            "SELECT telegram_uid FROM broadcast_recipients WHERE broadcast_id = ? AND status = 'pending'",
+            (broadcast_id,)
+        )
+        recipients = [row[0] for row in await cursor.fetchall()]
+
+    logger.info(f"Рассылка {broadcast_id}: осталось получателей {len(recipients)}")
+    window = asyncio.Semaphore(CONFIG["BROADCAST_WINDOW"])
+    idle = asyncio.Event()
+    idle.set()
+    in_flight = 0
+    results = []
+
+    async def on_result(chat_id, status):
+        nonlocal in_flight
+        results.append((chat_id, status))
+        in_flight -= 1
+        if not in_flight:
+            idle.set()
+        window.release()
+
+    try:
+        for telegram_uid in recipients:
+            await window.acquire()
+            in_flight += 1
+            idle.clear()
+            NOTIFIER.enqueue(telegram_uid, text, on_result)
+            if len(results) >= CONFIG["BROADCAST_FLUSH_BATCH"]:
+                await save_broadcast_results(broadcast_id, results)
+        await idle.wait()
+    except asyncio.CancelledError:
+        # Остановка бота: ждем уже поставленные сообщения, остальные останутся pending
+        try:
+            await asyncio.wait_for(idle.wait(), CONFIG["NOTIFY_DRAIN_TIMEOUT"])
+        except asyncio.TimeoutError:
+            pass
+        await save_broadcast_results(broadcast_id, results)
+        raise
+
+    await save_broadcast_results(broadcast_id, results)
+    async with db_connection("civilian") as db:
+        await db.execute(
+            "UPDATE broadcasts SET status = 'done', finished_at = ? WHERE id = ?",
+            (datetime.now().isoformat(), broadcast_id)
+        )
+        await db.commit()
+
+    stats = await get_broadcast_stats(broadcast_id)
+    logger.info(f"Рассылка {broadcast_id} завершена: {stats}")
+    if created_by:
+        NOTIFIER.enqueue(
+            created_by,
+            f"📢 Рассылка завершена\n"
+            f"Доставлено: {stats['sent']}\n"
+            f"Заблокировали бота: {stats['blocked']}\n"
+            f"Ошибок: {stats['failed']}"
+        )
+
+
+def start_broadcast(broadcast_id: str):
+    task = asyncio.create_task(run_broadcast(broadcast_id))
+    BROADCAST_TASKS[broadcast_id] = task
+    task.add_done_callback(lambda t: BROADCAST_TASKS.pop(broadcast_id, None))
+
+
+async def resume_broadcasts():
+    """Продолжает рассылки, прерванные остановкой бота"""
+    async with db_connection("civilian") as db:
+        cursor = await db.execute("SELECT id FROM broadcasts WHERE status = 'running'")
+        broadcast_ids = [row[0] for row in await cursor.fetchall()]
+    for broadcast_id in broadcast_ids:
+        logger.info(f"Возобновление рассылки {broadcast_id}")
+        start_broadcast(broadcast_id)
+
+
+async def stop_broadcasts():
+    tasks = list(BROADCAST_TASKS.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def broadcast_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    if await get_user_role(str(update.effective_user.id)) != "admin":
+        await query.edit_message_text("⛔ Рассылка доступна только администраторам")
+        return ConversationHandler.END
+
+    keyboard = [[InlineKeyboardButton(name, callback_data=f"broadcast_to_{audience}")]
+                for audience, name in BROADCAST_AUDIENCES.items()]
+    keyboard.append([InlineKeyboardButton("Отмена ❌", callback_data="broadcast_cancel")])
+
+    await query.edit_message_text(
+        "📢 Рассылка\nКому отправить сообщение?",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+    return BROADCAST_AUDIENCE
+
+
+async def broadcast_audience(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    audience = query.data[len("broadcast_to_"):]
+    context.user_data["broadcast_audience"] = audience
+
+    await query.edit_message_text(
+        f"Получатели: {BROADCAST_AUDIENCES[audience]}\nВведите текст рассылки:"
+    )
+    return BROADCAST_TEXT
+
+
+async def broadcast_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = update.message.text
+    context.user_data["broadcast_text"] = text
+    audience = context.user_data["broadcast_audience"]
+
+    keyboard = [
+        [InlineKeyboardButton("Отправить ✅", callback_data="broadcast_send")],
+        [InlineKeyboardButton("Отмена ❌", callback_data="broadcast_cancel")],
+    ]
+    await update.message.reply_text(
+        f"📢 Рассылка: {BROADCAST_AUDIENCES[audience]}\n\n{text}",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+    return BROADCAST_CONFIRM
+
+
+async def broadcast_send(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    broadcast_id, total = await create_broadcast(
+        context.user_data.pop("broadcast_text"),
+        context.user_data.pop("broadcast_audience"),
+        str(update.effective_user.id)
+    )
+    start_broadcast(broadcast_id)
+
+    await query.edit_message_text(
+        f"📢 Рассылка запущена, получателей: {total}\n"
+        "По завершении придет отчет."
+    )
+    return ConversationHandler.END
+
+
+async def broadcast_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    context.user_data.pop("broadcast_text", None)
+    context.user_data.pop("broadcast_audience", None)
+    await query.edit_message_text("Рассылка отменена")
+    return ConversationHandler.END
+
+
 async def manage_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -1417,18 +3912,14 @@ async def user_detail(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     user_id = query.data.split("_")[-1]
 
-    async with aiosqlite.connect("civilian.db") as db:
-        cursor = await db.execute(
-            "SELECT id, nickname, role FROM civilians WHERE id = ?",
-            (user_id,)
-        )
-        user = await cursor.fetchone()
-
-        cursor = await db.execute(
-            "SELECT balance FROM accounts WHERE id = ?",
-            (user_id,)
+    user = await get_user_card(user_id)
+    if user is None:
+        await query.edit_message_text(
+            "❌ Пользователь не найден",
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Назад ↩️", callback_data="manage_users")]])
         )
-        balance = await cursor.fetchone()
+        return
+    balance = f"{user['balance']} WVR" if user["balance"] is not None else "нет счета"
 
     keyboard = [
         [InlineKeyboardButton("Назначить роль", callback_data=f"user_role_{user_id}")],
@@ -1440,10 +3931,11 @@ async def user_detail(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await query.edit_message_text(
         f"👤 Информация о пользователе\n"
-        f"ID: {user[0]}\n"
-        f"Ник: {user[1]}\n"
-        f"Роль: {ROLES.get(user[2], user[2])}\n"
-        f"Баланс: {balance[0] if balance else 0} WVR",
+        f"ID: {user['id']}\n"
+        f"Ник: {user['nickname']}\n"
+        f"Роль: {ROLES.get(user['role'], user['role'])}\n"
+        f"Баланс: {balance}\n"
+        f"Незавершенных заданий: {user['open_tasks']}",
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
 
@@ -1503,7 +3995,15 @@ async def block_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
             ]))
         return
 
-    success = await add_to_blacklist(user_id, user["nickname"])
+    if not user["telegram_uid"]:
+        await query.edit_message_text(
+            f"❌ У пользователя {user['nickname']} нет привязанного Telegram, блокировать некого",
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("Назад ↩️", callback_data=f"user_detail_{user_id}")]
+            ]))
+        return
+
+    success = await add_to_blacklist(user["telegram_uid"], user["nickname"])
     if success:
         await query.edit_message_text(
             f"✅ Пользователь {user['nickname']} добавлен в черный список",
@@ -1526,6 +4026,7 @@ async def manage_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton("Создать задание", callback_data="create_task")],
         [InlineKeyboardButton("Просмотреть активные задания", callback_data="view_active_tasks")],
         [InlineKeyboardButton("Просмотреть выполненные задания", callback_data="view_completed_tasks")],
+        [InlineKeyboardButton("Отчеты на проверке", callback_data="review_claims")],
         [InlineKeyboardButton("Назад ↩️", callback_data="admin_actions")],
     ]
 
@@ -1538,61 +4039,241 @@ async def manage_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def create_task_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    context.user_data.clear()
 
+    if await get_user_role(str(update.effective_user.id)) != "admin":
+        await query.edit_message_text("⛔ Создание заданий доступно только администраторам")
+        return ConversationHandler.END
+
+    context.user_data["new_task"] = {}
     await query.edit_message_text(
-        "Введите название задания:"
+        "Введите название задания:\n/cancel - отмена"
     )
     return TASK_NAME
 
 
-async def view_transactions(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def create_task_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data["new_task"]["name"] = update.message.text.strip()
+    keyboard = [[InlineKeyboardButton(name, callback_data=f"new_task_type_{key}")]
+                for key, name in TASK_TYPES.items()]
+    await update.message.reply_text("Выберите тип задания:", reply_markup=InlineKeyboardMarkup(keyboard))
+    return TASK_TYPE
+
+
+async def create_task_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    page = context.user_data.get("trans_page", 0)
-    transactions = await get_transactions(page)
+    context.user_data["new_task"]["task_type"] = query.data[len("new_task_type_"):]
+    await query.edit_message_text("Сколько жителей могут взять задание? 0 - без ограничения")
+    return TASK_COUNT
 
-    if not transactions and page > 0:
-        page = 0
-        transactions = await get_transactions(page)
 
-    context.user_data["trans_page"] = page
+async def create_task_count(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        count = int(update.message.text)
+        if count < 0:
+            raise ValueError
+    except ValueError:
+        await update.message.reply_text("Введите целое число не меньше 0")
+        return TASK_COUNT
+
+    context.user_data["new_task"]["count"] = count
+    await update.message.reply_text("Введите награду в WVR:")
+    return TASK_COST
+
+
+async def create_task_cost(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        cost = int(update.message.text)
+        if cost <= 0:
+            raise ValueError
+    except ValueError:
+        await update.message.reply_text("Введите положительное целое число")
+        return TASK_COST
+
+    context.user_data["new_task"]["cost"] = cost
+    keyboard = [[InlineKeyboardButton(name, callback_data=f"new_task_social_{key}")]
+                for key, name in SOCIAL_TYPES.items()]
+    await update.message.reply_text("Выберите вид задания:", reply_markup=InlineKeyboardMarkup(keyboard))
+    return TASK_SOCIAL_TYPE
+
+
+async def create_task_social_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    context.user_data["new_task"]["social_type"] = query.data[len("new_task_social_"):]
+    await query.edit_message_text("Введите срок выполнения или - , если срока нет:")
+    return TASK_DEADLINE
+
+
+async def create_task_deadline(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    deadline = update.message.text.strip()
+    context.user_data["new_task"]["deadline"] = None if deadline == "-" else deadline
+    await update.message.reply_text("Введите описание задания или - , если описание не нужно:")
+    return TASK_DESCRIPTION
+
+
+async def create_task_description(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    description = update.message.text.strip()
+    task = context.user_data.pop("new_task")
+    task["description"] = None if description == "-" else description
+
+    task_id = await create_task(task)
+    await update.message.reply_text(
+        f"✅ Задание «{task['name']}» создано (ID: {task_id})",
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("К заданиям", callback_data="manage_tasks")]
+        ])
+    )
+    return ConversationHandler.END
+
+
+def render_transaction(trans: Dict) -> str:
+    return (f"📅 {trans['date']}\n"
+            f"Тип: {trans['type']}\n"
+            f"Сумма: {trans['amount']} WVR\n"
+            f"Комментарий: {trans['comment']}\n")
+
+
+def transactions_callback(backward: bool, page: int, transaction: Dict) -> str:
+    return f"trans|{'p' if backward else 'n'}|{page}|{transaction['date']}|{transaction['id']}"
+
+
+def describe_transaction_filters(filters_: Dict) -> str:
+    names = {"user_id": "житель", "tx_type": "тип", "date_from": "с", "date_to": "до"}
+    return ", ".join(f"{names[key]} {value}" for key, value in filters_.items())
+
+
+async def parse_transaction_filters(args: List[str]) -> Dict:
+    """Разбирает аргументы /transactions в параметры get_transactions.
+
+    user=<ник или ID> - владелец записи, type=<тип>, from=<ГГГГ-ММ-ДД> и
+    to=<ГГГГ-ММ-ДД> включительно. Ошибку ввода сообщает ValueError."""
+    filters_ = {}
+    for arg in args:
+        name, _, value = arg.partition("=")
+        if name not in TRANSACTION_FILTER_PARAMS or not value:
+            raise ValueError(f"Неизвестный фильтр: {arg}")
+
+        if name == "user":
+            resident, _ = await lookup_resident(value)
+            if not resident:
+                raise ValueError(f"Житель {value} не найден")
+            value = resident["id"]
+        elif name == "type":
+            if value not in TRANSACTION_TYPES:
+                raise ValueError(f"Неизвестный тип: {value}")
+        else:
+            try:
+                day = datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                raise ValueError(f"Неверная дата: {value}")
+            # date_to не входит в диапазон, поэтому для to берется следующий день
+            if name == "to":
+                day += timedelta(days=1)
+            value = day.strftime("%Y-%m-%d")
+        filters_[TRANSACTION_FILTER_PARAMS[name]] = value
+    return filters_
+
+
+async def render_transactions_page(filters_: Dict, page: int = 0, cursor: tuple = None,
+                                   backward: bool = False) -> tuple:
+    """Текст и клавиатура страницы истории транзакций"""
+    transactions, has_more = await get_transactions(cursor, backward, **filters_)
+
+    if not transactions and cursor is not None:
+        page, backward = 0, False
+        transactions, has_more = await get_transactions(**filters_)
+
+    header = "💰 История транзакций\n"
+    if filters_:
+        header += f"Фильтр: {describe_transaction_filters(filters_)}\n"
+    else:
+        header += "Фильтры: /transactions user=… type=… from=ГГГГ-ММ-ДД to=ГГГГ-ММ-ДД\n"
+    header += "\n"
+    entries = [render_transaction(trans) for trans in transactions]
+    # Не поместившиеся строки откладываются на соседнюю страницу: при листании
+    # назад ближайшие к курсору строки стоят в конце списка, поэтому отбрасывается начало
+    shown = fit_entries(header, entries[::-1] if backward else entries)
+    clipped = shown < len(entries)
+    if backward:
+        transactions, entries = transactions[-shown:], entries[-shown:]
+    else:
+        transactions, entries = transactions[:shown], entries[:shown]
 
-    message = "💰 История транзакций\n\n"
-    for trans in transactions:
-        message += (f"📅 {trans['date']}\n"
-                    f"Тип: {trans['type']}\n"
-                    f"Сумма: {trans['amount']} WVR\n"
-                    f"Комментарий: {trans['comment']}\n\n")
+    has_prev = (has_more or clipped) if backward else page > 0
+    has_next = True if backward else (has_more or clipped)
+    message = join_page(header, entries)
 
     keyboard = []
     nav_buttons = []
 
-    if page > 0:
-        nav_buttons.append(InlineKeyboardButton("⬅️", callback_data="trans_prev_page"))
+    if has_prev and transactions:
+        nav_buttons.append(InlineKeyboardButton(
+            "⬅️", callback_data=transactions_callback(True, max(page - 1, 0), transactions[0])
+        ))
+
+    nav_buttons.append(InlineKeyboardButton(f"{page + 1}", callback_data="trans_page_num"))
+
+    if has_next and transactions:
+        nav_buttons.append(InlineKeyboardButton(
+            "➡️", callback_data=transactions_callback(False, page + 1, transactions[-1])
+        ))
+
+    if nav_buttons:
+        keyboard.append(nav_buttons)
+
+    keyboard.append([InlineKeyboardButton("Назад ↩️", callback_data="admin_actions")])
+    return message, InlineKeyboardMarkup(keyboard)
+
+
+async def view_transactions(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    # Курсор листания зашит в callback_data: trans|<n|p>|<страница>|<date>|<id>.
+    # Фильтры задает /transactions, кнопка админ-панели открывает историю без них
+    page, cursor, backward = 0, None, False
+    if query.data.startswith("trans|"):
+        _, direction, page, date, tx_id = query.data.split("|")
+        page, cursor, backward = int(page), (date, int(tx_id)), direction == "p"
+    else:
+        context.user_data.pop("trans_filters", None)
 
-    nav_buttons.append(InlineKeyboardButton(f"{page + 1}", callback_data="trans_page_num"))
+    message, reply_markup = await render_transactions_page(
+        context.user_data.get("trans_filters", {}), page, cursor, backward
+    )
+    await query.edit_message_text(message, reply_markup=reply_markup)
 
-    if len(transactions) == 10:
-        nav_buttons.append(InlineKeyboardButton("➡️", callback_data="trans_next_page"))
 
-    if nav_buttons:
-        keyboard.append(nav_buttons)
+async def transactions_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/transactions [user=<ник или ID>] [type=<тип>] [from=<ГГГГ-ММ-ДД>] [to=<ГГГГ-ММ-ДД>] -
+    история транзакций с фильтрами для администратора"""
+    identity = await get_identity(str(update.effective_user.id))
+    if not identity or identity["role"] != "admin":
+        await update.message.reply_text("⛔ Просмотр транзакций доступен только администраторам")
+        return
 
-    keyboard.append([InlineKeyboardButton("Назад ↩️", callback_data="admin_actions")])
+    try:
+        filters_ = await parse_transaction_filters(context.args or [])
+    except ValueError as e:
+        await update.message.reply_text(
+            f"❌ {e}\nФормат: /transactions user=<ник или ID> type=<{'|'.join(TRANSACTION_TYPES)}> "
+            "from=ГГГГ-ММ-ДД to=ГГГГ-ММ-ДД"
+        )
+        return
 
-    await query.edit_message_text(
-        message,
-        reply_markup=InlineKeyboardMarkup(keyboard)
-    )
+    context.user_data["trans_filters"] = filters_
+    message, reply_markup = await render_transactions_page(filters_)
+    await update.message.reply_text(message, reply_markup=reply_markup)
 
 
 async def manage_blacklist(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    blacklist = await get_blacklist()
+    blacklist = get_blacklist()
 
     keyboard = []
     for user in blacklist:
@@ -1614,7 +4295,14 @@ async def blacklist_detail(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     user_id = query.data.split("_")[-1]
 
-    user = await get_user_info(user_id)
+    user = BLACKLIST.get(user_id)
+    if not user:
+        await query.edit_message_text(
+            "❌ Пользователь не найден в черном списке",
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("Назад ↩️", callback_data="manage_blacklist")]
+            ]))
+        return
 
     keyboard = [
         [InlineKeyboardButton("Разблокировать", callback_data=f"unblock_{user_id}")],
@@ -1625,6 +4313,7 @@ async def blacklist_detail(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"🚫 Информация о заблокированном пользователе\n"
         f"ID: {user['id']}\n"
         f"Ник: {user['nickname']}\n"
+        f"Причина: {user['reason'] or 'не указана'}\n"
         f"Дата блокировки: {user['block_date']}",
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
@@ -1656,36 +4345,183 @@ async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     role = await get_user_role(str(query.from_user.id))
 
+    status, reply_markup = get_main_menu(role)
+    await query.edit_message_text(f"Главное меню\n{status}", reply_markup=reply_markup)
+
+
+async def show_balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    balance = await get_balance(str(query.from_user.id))
+
     keyboard = [
-        [InlineKeyboardButton("Мой баланс 💰", callback_data="balance")],
-        [InlineKeyboardButton("Доступные задания 📋", callback_data="tasks")],
-        [InlineKeyboardButton("Перевести WVR 🔄", callback_data="transfer")],
+        [InlineKeyboardButton("Выписка 📄", callback_data="statement")],
+        [InlineKeyboardButton("Назад ↩️", callback_data="main_menu")],
     ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
 
-    if role in ["banker", "admin"]:
-        keyboard.append([InlineKeyboardButton("Банковские операции 🏦", callback_data="bank_operations")])
+    await query.edit_message_text(
+        f"💰 Твой текущий баланс: {balance} WVR",
+        reply_markup=reply_markup
+    )
+
+
+async def render_statement(user: Dict) -> str:
+    """Превью выписки: последние операции с балансом после каждой.
+
+    Баланс до окна берется из счета за вычетом изменений в окне, история целиком не читается"""
+    transactions, has_more, balance = await get_recent_statement(
+        user["id"], CONFIG["STATEMENT_PREVIEW_ROWS"]
+    )
+
+    header = f"📄 Выписка по счету {user['nickname']} (ID: {user['id']})\n\n"
+    if not transactions:
+        return header + "Операций по счету пока нет."
+
+    running = balance - sum(statement_delta(transaction, user["id"]) for transaction in transactions)
+    entries = []
+    for transaction in transactions:
+        delta = statement_delta(transaction, user["id"])
+        running += delta
+        entry = (f"📅 {transaction['date'][:16]} | {transaction['type']}\n"
+                 f"{delta:+} WVR → {running} WVR\n")
+        if transaction["comment"]:
+            comment = transaction["comment"]
+            if len(comment) > CONFIG["STATEMENT_COMMENT_LIMIT"]:
+                comment = comment[:CONFIG["STATEMENT_COMMENT_LIMIT"] - 1] + "…"
+            entry += f"Комментарий: {comment}\n"
+        entries.append(entry)
+
+    footer = f"\nБаланс счета: {balance} WVR"
+    shown = fit_entries(header + footer + "Последние операции:\n\n", entries[::-1])
+    if has_more or shown < len(entries):
+        header += f"Последние {shown} операций:\n\n"
+    return join_page(header, entries[-shown:]) + footer
+
+
+def statement_keyboard(user_id: str, back: str = "balance") -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("Скачать CSV 📥", callback_data=f"statement_csv_{user_id}")],
+        [InlineKeyboardButton("Назад ↩️", callback_data=back)],
+    ])
 
-    if role == "admin":
-        keyboard.append([InlineKeyboardButton("Администрирование 👑", callback_data="admin_actions")])
+
+async def show_statement(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    identity = await get_identity(str(query.from_user.id))
+    if not identity:
+        await query.edit_message_text("❌ Вы не зарегистрированы в системе.")
+        return
 
     await query.edit_message_text(
-        f"Главное меню\nТвой статус: {ROLES.get(role, 'Гость')}",
-        reply_markup=InlineKeyboardMarkup(keyboard)
+        await render_statement(identity),
+        reply_markup=statement_keyboard(identity["id"])
     )
 
 
-async def show_balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def statement_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/statement - своя выписка, /statement <ID или ник> - выписка жителя для банкира"""
+    identity = await get_identity(str(update.effective_user.id))
+    if not identity:
+        await update.message.reply_text("❌ Вы не зарегистрированы в системе.")
+        return
+
+    user = identity
+    if context.args:
+        if identity["role"] not in ["banker", "admin"]:
+            await update.message.reply_text("У вас недостаточно прав для этого действия")
+            return
+
+        target = " ".join(context.args)
+        user = await get_user_info(target)
+        if not user:
+            async with db_connection("civilian") as db:
+                cursor = await db.execute(
+                    "SELECT id, nickname, role FROM civilians WHERE nickname = ?", (target,)
+                )
+                result = await cursor.fetchone()
+            user = {"id": result[0], "nickname": result[1], "role": result[2]} if result else None
+        if not user:
+            await update.message.reply_text("Житель не найден. Проверьте данные и попробуйте снова.")
+            return
+
+    await update.message.reply_text(
+        await render_statement(user),
+        reply_markup=statement_keyboard(user["id"], back="main_menu")
+    )
+
+
+async def export_statement(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    user_id = query.data[len("statement_csv_"):]
+
+    identity = await get_identity(str(query.from_user.id))
+    if not identity or (identity["id"] != user_id and identity["role"] not in ["banker", "admin"]):
+        await query.answer("У вас недостаточно прав для этого действия", show_alert=True)
+        return
+    await query.answer("Готовлю выписку…")
+
+    spool, rows = await write_statement_csv(user_id)
+    with spool:
+        await context.bot.send_document(
+            chat_id=query.message.chat_id,
+            document=spool,
+            filename=f"statement_{user_id}_{datetime.now():%Y%m%d}.csv",
+            caption=f"📄 Выписка по счету {user_id}: {rows} операций"
+        )
+
+
+async def payroll_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/payroll [период] - выплата зарплаты администратором после подтверждения"""
+    identity = await get_identity(str(update.effective_user.id))
+    if not identity or identity["role"] != "admin":
+        await update.message.reply_text("⛔ Выплата зарплаты доступна только администраторам")
+        return
+
+    period = context.args[0] if context.args else datetime.now().strftime(CONFIG["PAYROLL_PERIOD_FORMAT"])
+    try:
+        datetime.strptime(period, CONFIG["PAYROLL_PERIOD_FORMAT"])
+    except ValueError:
+        await update.message.reply_text(f"❌ Неверный период: {period}")
+        return
+
+    preview = await get_payroll_preview(period)
+    if preview["paid_at"] and preview["source"] != "seed":
+        await update.message.reply_text(f"ℹ️ Зарплата за {period} уже выплачена ({preview['paid_at'][:16]})")
+        return
+
+    text = f"💵 Зарплата за {period}\nСчетов: {preview['accounts']}\nСумма: {preview['total']} WVR"
+    if preview["source"] == "seed":
+        text += ("\n\n⚠️ Период отмечен как оплаченный вручную до запуска бота. "
+                 "Подтверждение выплатит зарплату еще раз.")
+    await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup([
+        [InlineKeyboardButton("Выплатить ✅", callback_data=f"payroll_pay_{period}")],
+        [InlineKeyboardButton("Отмена ❌", callback_data="payroll_cancel")],
+    ]))
+
+
+async def payroll_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    balance = await get_balance(str(query.from_user.id))
+    if query.data == "payroll_cancel":
+        await query.edit_message_text("Выплата отменена")
+        return
 
-    keyboard = [[InlineKeyboardButton("Назад ↩️", callback_data="main_menu")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    if await get_user_role(str(query.from_user.id)) != "admin":
+        await query.edit_message_text("⛔ Выплата зарплаты доступна только администраторам")
+        return
 
+    period = query.data[len("payroll_pay_"):]
+    report = await run_payroll(context, period, source="admin")
+    if report is None:
+        await query.edit_message_text(f"ℹ️ Зарплата за {period} уже выплачена или произошла ошибка")
+        return
     await query.edit_message_text(
-        f"💰 Твой текущий баланс: {balance} WVR",
-        reply_markup=reply_markup
+        f"✅ Зарплата за {period} выплачена: {report['accounts']} счетов, {report['total']} WVR"
     )
 
 
@@ -1693,97 +4529,353 @@ async def show_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    tasks = await get_available_tasks()
+    board = await get_task_board()
+    pages = board["pages"]
 
-    if not tasks:
+    if not pages:
         await query.edit_message_text(
             "📋 Сейчас нет доступных заданий.\nПопробуй проверить позже!",
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Назад ↩️", callback_data="main_menu")]])
         )
         return
 
-    message = "📋 Доступные задания:\n\n"
-    for task in tasks:
-        message += (
-            f"🔹 {task['name']}\n"
-            f"Тип: {TASK_TYPES.get(task['type'], task['type'])} | "
-            f"Вид: {SOCIAL_TYPES.get(task['social_type'], task['social_type'])}\n"
-            f"Награда: {task['cost']} WVR\n"
-        )
-        if task.get('description'):
-            message += f"Описание: {task['description']}\n"
-        if task.get('deadline'):
-            message += f"Срок: {task['deadline']}\n"
-        message += "\n"
+    page = int(query.data.split("_")[-1]) if query.data.startswith("tasks_page_") else 0
+    page = min(max(page, 0), len(pages) - 1)
+
+    keyboard = []
+    if len(pages) > 1:
+        nav_buttons = []
+        if page > 0:
+            nav_buttons.append(InlineKeyboardButton("⬅️", callback_data=f"tasks_page_{page - 1}"))
+        nav_buttons.append(InlineKeyboardButton(f"{page + 1}/{len(pages)}", callback_data="tasks_page_num"))
+        if page < len(pages) - 1:
+            nav_buttons.append(InlineKeyboardButton("➡️", callback_data=f"tasks_page_{page + 1}"))
+        keyboard.append(nav_buttons)
+    keyboard.append([InlineKeyboardButton("Взять задание 📝", callback_data="take_task")])
+    keyboard.append([InlineKeyboardButton("Назад ↩️", callback_data="main_menu")])
 
+    await query.edit_message_text(pages[page], reply_markup=InlineKeyboardMarkup(keyboard))
+
+
+CLAIM_RESULTS = {
+    "claimed": "✅ Задание закреплено за тобой. Когда выполнишь, отправь отчет в разделе «Мои задания».",
+    "duplicate": "ℹ️ Ты уже взял это задание.",
+    "full": "❌ Все места в этом задании уже заняты.",
+    "closed": "❌ Задание уже закрыто.",
+}
+
+
+async def take_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    tasks = [task for task in await get_available_tasks() if task_has_slots(task)]
+    if not tasks:
+        await query.edit_message_text(
+            "📋 Свободных заданий сейчас нет.",
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Назад ↩️", callback_data="tasks")]])
+        )
+        return
+
+    keyboard = [
+        [InlineKeyboardButton(f"{task['name']} — {task['cost']} WVR", callback_data=f"claim_{task['id']}")]
+        for task in tasks[:CONFIG["TASK_PICK_LIMIT"]]
+    ]
+    keyboard.append([InlineKeyboardButton("Назад ↩️", callback_data="tasks")])
+    await query.edit_message_text("📝 Выбери задание:", reply_markup=InlineKeyboardMarkup(keyboard))
+
+
+async def claim_task_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    telegram_uid = str(query.from_user.id)
+    identity = await get_identity(telegram_uid)
+    if not identity:
+        await query.edit_message_text("❌ Вы не зарегистрированы")
+        return
+
+    result = await claim_task(int(query.data.split("_")[1]), identity["id"], telegram_uid)
     await query.edit_message_text(
-        message,
+        CLAIM_RESULTS[result],
         reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("Взять задание 📝", callback_data="take_task")],
-            [InlineKeyboardButton("Назад ↩️", callback_data="main_menu")]
+            [InlineKeyboardButton("Мои задания 🗂", callback_data="my_tasks")],
+            [InlineKeyboardButton("Назад ↩️", callback_data="tasks")],
         ])
     )
 
 
-async def view_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE, completed: bool = False):
+async def my_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    page = context.user_data.get("task_page", 0)
+    identity = await get_identity(str(query.from_user.id))
+    claims = await get_user_claims(identity["id"]) if identity else []
 
-    async with aiosqlite.connect("tasks.db") as db:
-        cursor = await db.execute(
-            """SELECT id, name, task_type, cost, social_type, deadline, description, assigned_to 
-            FROM tasks WHERE completed = ? ORDER BY id DESC LIMIT 5 OFFSET ?""",
-            (completed, page * 5)
+    keyboard = []
+    entries = []
+    for claim in claims:
+        status = "на проверке" if claim["status"] == "submitted" else "в работе"
+        entries.append(f"🔹 {claim['task_name']} — {claim['cost']} WVR ({status})\n")
+        if claim["status"] == "claimed":
+            keyboard.append([
+                InlineKeyboardButton(f"Отчет: {claim['task_name']}", callback_data=f"proof_{claim['id']}"),
+                InlineKeyboardButton("Отказаться", callback_data=f"unclaim_{claim['id']}"),
+            ])
+    keyboard.append([InlineKeyboardButton("Назад ↩️", callback_data="main_menu")])
+
+    header = "🗂 Мои задания:\n\n"
+    shown = fit_entries(header, entries)
+    message = join_page(header, entries[:shown]) if entries else header + "Ты пока не взял ни одного задания."
+    await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard))
+
+
+async def unclaim_task_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    identity = await get_identity(str(query.from_user.id))
+    claim = identity and await unclaim_task(int(query.data.split("_")[1]), identity["id"])
+    await query.edit_message_text(
+        "✅ Ты отказался от задания" if claim else "❌ Заявка не найдена или уже на проверке",
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Мои задания 🗂", callback_data="my_tasks")]])
+    )
+
+
+async def proof_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    context.user_data["claim_id"] = int(query.data.split("_")[1])
+    await query.edit_message_text(
+        "📎 Пришли отчет о выполнении: текст или фотографию.\nДля отмены: /cancel"
+    )
+    return TASK_PROOF
+
+
+async def proof_receive(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    message = update.message
+    telegram_uid = str(update.effective_user.id)
+    identity = await get_identity(telegram_uid)
+    claim_id = context.user_data.pop("claim_id", None)
+
+    if message.photo:
+        proof = f"photo:{message.photo[-1].file_id}"
+        text = message.caption or ""
+    else:
+        proof = text = message.text
+
+    if not identity or not claim_id or not await submit_proof(claim_id, identity["id"], proof):
+        await message.reply_text("❌ Заявка не найдена", reply_markup=get_reply_markup())
+        return ConversationHandler.END
+
+    claim = await get_claim(claim_id)
+    keyboard = [[
+        InlineKeyboardButton("Принять ✅", callback_data=f"claim_ok_{claim_id}"),
+        InlineKeyboardButton("Отклонить ❌", callback_data=f"claim_reject_{claim_id}"),
+    ]]
+    if message.photo:
+        keyboard.insert(0, [InlineKeyboardButton("Показать фото 🖼", callback_data=f"claim_proof_{claim_id}")])
+    NOTIFIER.enqueue_many(
+        await get_admin_ids(),
+        f"📥 Отчет по заданию «{claim['task_name']}» от {identity['nickname']} (ID: {identity['id']})\n"
+        f"Награда: {claim['cost']} WVR\n\n{text}",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+    await message.reply_text("✅ Отчет отправлен на проверку", reply_markup=get_reply_markup())
+    return ConversationHandler.END
+
+
+async def review_claims(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    claims = await get_submitted_claims()
+    keyboard = []
+    entries = []
+    for claim in claims:
+        proof = claim["proof"] or ""
+        entries.append(
+            f"🔹 #{claim['id']} {claim['task_name']} — {claim['user_id']}, {claim['cost']} WVR\n"
+            f"{'Фотоотчет' if proof.startswith('photo:') else proof}\n"
         )
-        tasks = await cursor.fetchall()
+        row = [
+            InlineKeyboardButton(f"#{claim['id']} ✅", callback_data=f"claim_ok_{claim['id']}"),
+            InlineKeyboardButton(f"#{claim['id']} ❌", callback_data=f"claim_reject_{claim['id']}"),
+        ]
+        if proof.startswith("photo:"):
+            row.append(InlineKeyboardButton(f"#{claim['id']} 🖼", callback_data=f"claim_proof_{claim['id']}"))
+        keyboard.append(row)
+    keyboard.append([InlineKeyboardButton("Назад ↩️", callback_data="manage_tasks")])
+
+    header = "📥 Отчеты на проверке:\n\n"
+    shown = fit_entries(header, entries)
+    message = join_page(header, entries[:shown]) if entries else header + "Новых отчетов нет"
+    await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard[:shown] + keyboard[-1:]))
+
 
+async def show_claim_proof(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    claim = await get_claim(int(query.data.split("_")[-1]))
+    if not claim or not (claim["proof"] or "").startswith("photo:"):
+        await query.answer("Фотоотчет не найден", show_alert=True)
+        return
+    await context.bot.send_photo(
+        chat_id=query.message.chat_id,
+        photo=claim["proof"].split(":", 1)[1],
+        caption=f"Отчет по заявке #{claim['id']} от {claim['user_id']}"
+    )
+
+
+async def review_claim(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    identity = await get_identity(str(query.from_user.id))
+    if not identity or identity["role"] != "admin":
+        await query.edit_message_text("⛔ Проверка отчетов доступна только администраторам")
+        return
+
+    _, action, claim_id = query.data.split("_")
+    claim_id = int(claim_id)
+    reviewer = identity["id"]
+
+    if action == "ok":
+        try:
+            reward = await approve_claim(claim_id, reviewer)
+        except LookupError as e:
+            logger.error(f"Заявка {claim_id} не подтверждена: {e}")
+            await query.edit_message_text(f"❌ {e}")
+            return
+        if not reward:
+            await query.edit_message_text("ℹ️ Заявка уже проверена")
+            return
+        claim = await get_claim(claim_id)
+        await query.edit_message_text(
+            f"✅ Отчет принят, {reward['user_id']} получил {reward['cost']} WVR"
+        )
+        if claim["telegram_uid"]:
+            await notify_user(
+                context, claim["telegram_uid"],
+                f"🎉 Отчет по заданию «{reward['task_name']}» принят! Начислено {reward['cost']} WVR."
+            )
+    else:
+        claim = await reject_claim(claim_id, reviewer)
+        if not claim:
+            await query.edit_message_text("ℹ️ Заявка уже проверена")
+            return
+        await query.edit_message_text(f"❌ Отчет по заявке #{claim_id} отклонен")
+        if claim["telegram_uid"]:
+            await notify_user(
+                context, claim["telegram_uid"],
+                f"❌ Отчет по заданию «{claim['task_name']}» отклонен. "
+                "Задание можно взять снова."
+            )
+
+
+async def get_tasks_page(completed: bool, cursor: int = None, backward: bool = False,
+                         limit: int = 5) -> tuple:
+    """Страница заданий от новых к старым с keyset-пагинацией по id.
+
+    Возвращает (задания, есть ли еще строки в направлении листания)."""
+    condition, params = "completed = ?", [completed]
+    if cursor is not None:
+        condition += " AND id > ?" if backward else " AND id < ?"
+        params.append(cursor)
+    order = "ASC" if backward else "DESC"
+
+    async with db_connection("tasks") as db:
         cursor = await db.execute(
-            "SELECT COUNT(*) FROM tasks WHERE completed = ?",
-            (completed,)
+            f"""SELECT id, name, task_type, cost, social_type, deadline, description, assigned_to
+            FROM tasks WHERE {condition} ORDER BY id {order} LIMIT ?""",
+            (*params, limit + 1)
         )
-        total_tasks = (await cursor.fetchone())[0]
+        rows = await cursor.fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backward:
+        rows.reverse()
+    fields = ("id", "name", "type", "cost", "social_type", "deadline", "description", "assigned_to")
+    return [dict(zip(fields, row)) for row in rows], has_more
+
+
+def render_admin_task(task: Dict) -> str:
+    text = (
+        f"🔹 {task['name']} (ID: {task['id']})\n"
+        f"Тип: {TASK_TYPES.get(task['type'], task['type'])}\n"
+        f"Награда: {task['cost']} WVR\n"
+        f"Вид: {SOCIAL_TYPES.get(task['social_type'], task['social_type'])}\n"
+        f"Срок: {task['deadline'] if task['deadline'] else 'Не указан'}\n"
+        f"Назначено: {task['assigned_to'] or 'Не назначено'}\n"
+    )
+    if task['description']:
+        text += f"Описание: {task['description']}\n"
+    return text
+
+
+def tasks_callback(completed: bool, backward: bool, page: int, task: Dict) -> str:
+    return f"vtask|{int(completed)}|{'p' if backward else 'n'}|{page}|{task['id']}"
+
+
+async def view_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE, completed: bool = False):
+    query = update.callback_query
+    await query.answer()
+
+    # Курсор листания зашит в callback_data: vtask|<выполненные>|<n|p>|<страница>|<id>
+    page, cursor, backward = 0, None, False
+    if query.data.startswith("vtask|"):
+        _, completed, direction, page, task_id = query.data.split("|")
+        completed, page, cursor, backward = completed == "1", int(page), int(task_id), direction == "p"
+
+    tasks, has_more = await get_tasks_page(completed, cursor, backward)
+    if not tasks and cursor is not None:
+        page, backward = 0, False
+        tasks, has_more = await get_tasks_page(completed)
+
+    header = f"📋 {'Выполненные' if completed else 'Активные'} задания:\n\n"
+    entries = [render_admin_task(task) for task in tasks]
+    shown = fit_entries(header, entries[::-1] if backward else entries)
+    clipped = shown < len(entries)
+    if backward:
+        tasks, entries = tasks[-shown:], entries[-shown:]
+    else:
+        tasks, entries = tasks[:shown], entries[:shown]
+
+    has_prev = (has_more or clipped) if backward else page > 0
+    has_next = True if backward else (has_more or clipped)
+    message = join_page(header, entries) if entries else header + "Заданий нет"
 
-    message = f"📋 {'Выполненные' if completed else 'Активные'} задания:\n\n"
-    for task in tasks:
-        assigned_to = "Не назначено" if not task[7] else task[7]
-        message += (
-            f"🔹 {task[1]} (ID: {task[0]})\n"
-            f"Тип: {TASK_TYPES.get(task[2], task[2])}\n"
-            f"Награда: {task[3]} WVR\n"
-            f"Вид: {SOCIAL_TYPES.get(task[4], task[4])}\n"
-            f"Срок: {task[5] if task[5] else 'Не указан'}\n"
-            f"Назначено: {assigned_to}\n"
-        )
-        if task[6]:
-            message += f"Описание: {task[6]}\n"
-        message += "\n"
-
-    total_pages = (total_tasks + 4) // 5
     keyboard = []
 
-    if not completed:
-        keyboard.append([
-            InlineKeyboardButton("Пометить выполненным", callback_data="complete_task"),
-            InlineKeyboardButton("Редактировать", callback_data="edit_task")
-        ])
+    if not completed and tasks:
+        for task in tasks:
+            keyboard.append([InlineKeyboardButton(
+                f"Пометить выполненным: {task['name']}", callback_data=f"complete_task_{task['id']}"
+            )])
+        keyboard.append([InlineKeyboardButton("Редактировать", callback_data="edit_task")])
 
     nav_buttons = []
-    if page > 0:
-        nav_buttons.append(InlineKeyboardButton("⬅️", callback_data="task_prev_page"))
+    if has_prev and tasks:
+        nav_buttons.append(InlineKeyboardButton(
+            "⬅️", callback_data=tasks_callback(completed, True, max(page - 1, 0), tasks[0])
+        ))
 
-    nav_buttons.append(InlineKeyboardButton(f"{page + 1}/{total_pages}", callback_data="task_page_num"))
+    nav_buttons.append(InlineKeyboardButton(f"{page + 1}", callback_data="task_page_num"))
 
-    if (page + 1) * 5 < total_tasks:
-        nav_buttons.append(InlineKeyboardButton("➡️", callback_data="task_next_page"))
+    if has_next and tasks:
+        nav_buttons.append(InlineKeyboardButton(
+            "➡️", callback_data=tasks_callback(completed, False, page + 1, tasks[-1])
+        ))
 
-    if nav_buttons:
-        keyboard.append(nav_buttons)
+    keyboard.append(nav_buttons)
 
     keyboard.append([
         InlineKeyboardButton("Назад ↩️", callback_data="manage_tasks"),
-        InlineKeyboardButton("Главное меню 🏠", callback_data="start")
+        InlineKeyboardButton("Главное меню 🏠", callback_data="main_menu")
     ])
 
     await query.edit_message_text(
@@ -1791,22 +4883,13 @@ async def view_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE, complet
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
 
-    context.user_data["task_filter_completed"] = completed
-
 
 async def complete_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    task_id = context.user_data.get("current_task_id")
-    if task_id:
-        async with aiosqlite.connect("tasks.db") as db:
-            await db.execute(
-                "UPDATE tasks SET completed = TRUE WHERE id = ?",
-                (task_id,)
-            )
-            await db.commit()
-
+    task_id = int(query.data.split("_")[-1])
+    if await update_task(task_id, completed=True):
         await query.edit_message_text(
             "✅ Задание помечено как выполненное",
             reply_markup=InlineKeyboardMarkup([
@@ -1849,7 +4932,7 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 async def check_blacklist(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
-    if await is_blacklisted(user_id):
+    if is_blacklisted(user_id):
         await update.message.reply_text("Вайтовер помнит своих. А ты в списках?")
         return True
     return False
@@ -1871,13 +4954,59 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         )
 
 
+async def post_init(application: Application):
+    await NOTIFIER.start(application.bot)
+    await resume_broadcasts()
+
+
+async def post_shutdown(application: Application):
+    await stop_broadcasts()
+    await NOTIFIER.stop(CONFIG["NOTIFY_DRAIN_TIMEOUT"])
+    logger.info(f"Статистика уведомлений: {NOTIFIER.stats()}")
+    await close_databases(application)
+
+
 def main() -> None:
-    application = Application.builder().token("ТУТ ДОЛЖЕН БЫТЬ ТОКЕН").build()
+    application = (
+        Application.builder()
+        .token("ТУТ ДОЛЖЕН БЫТЬ ТОКЕН")
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     asyncio.get_event_loop().run_until_complete(init_databases())
     asyncio.get_event_loop().run_until_complete(check_last_transaction())
 
-    asyncio.get_event_loop().create_task(sync_with_google_sheets())
+    application.job_queue.run_repeating(
+        sync_with_google_sheets,
+        interval=CONFIG["SYNC_INTERVAL"],
+        first=CONFIG["SYNC_INTERVAL"],
+        name="sync_with_google_sheets",
+        job_kwargs={"max_instances": 1, "coalesce": True},
+    )
+    application.job_queue.run_repeating(
+        reconcile_balances,
+        interval=CONFIG["RECONCILE_INTERVAL"],
+        first=120,
+        name="reconcile_balances",
+        job_kwargs={"max_instances": 1, "coalesce": True},
+    )
+    if CONFIG["PAYROLL_DAY"]:
+        application.job_queue.run_repeating(
+            payroll_job,
+            interval=CONFIG["PAYROLL_CHECK_INTERVAL"],
+            first=180,
+            name="run_payroll",
+            job_kwargs={"max_instances": 1, "coalesce": True},
+        )
+    application.job_queue.run_repeating(
+        export_bank_ledger,
+        interval=CONFIG["BANK_EXPORT_INTERVAL"],
+        first=60,
+        name="export_bank_ledger",
+        job_kwargs={"max_instances": 1, "coalesce": True},
+    )
 
     application.add_handler(MH(filters.ALL, check_blacklist), group=-1)
 
@@ -1899,9 +5028,17 @@ def main() -> None:
     application.add_handler(reg_conv)
 
     transfer_conv = ConversationHandler(
-        entry_points=[CQH(transfer_start, pattern="^transfer$")],
+        entry_points=[
+            CQH(transfer_start, pattern="^transfer$"),
+            CommandHandler("transfer", transfer_command),
+            CommandHandler("start", transfer_link_start, filters.Regex(f"^/start {TRANSFER_LINK_PREFIX}"))
+        ],
         states={
             TRANSFER_RECIPIENT: [MH(filters.TEXT & ~filters.COMMAND, transfer_recipient)],
+            TRANSFER_SELECT_USER: [
+                CQH(transfer_select_user, pattern="^transfer_select_"),
+                CQH(cancel_transfer_handler, pattern="^cancel_transfer$")
+            ],
             TRANSFER_AMOUNT: [MH(filters.TEXT & ~filters.COMMAND, transfer_amount)],
             TRANSFER_CONFIRM: [
                 CQH(confirm_transfer_handler, pattern="^confirm_transfer$"),
@@ -1922,47 +5059,123 @@ def main() -> None:
     deposit_conv = ConversationHandler(
         entry_points=[CQH(deposit_start, pattern="^deposit$")],
         states={
-            DEPOSIT_USER: [MH(filters.TEXT & ~filters.COMMAND, deposit_user)],
+            DEPOSIT_USER: [
+                MH(filters.TEXT & ~filters.COMMAND, deposit_user),
+                CQH(deposit_select, pattern="^deposit_to_")
+            ],
             DEPOSIT_AMOUNT: [MH(filters.TEXT & ~filters.COMMAND, deposit_amount)],
             DEPOSIT_REASON: [MH(filters.TEXT & ~filters.COMMAND, deposit_complete)],
         },
-        fallbacks=[CommandHandler("cancel", lambda u, c: ConversationHandler.END)],
+        fallbacks=[
+            CommandHandler("cancel", lambda u, c: ConversationHandler.END),
+            CQH(bank_operations_cancel, pattern="^bank_operations$")
+        ],
     )
     application.add_handler(deposit_conv)
 
     withdraw_conv = ConversationHandler(
         entry_points=[CQH(withdraw_start, pattern="^withdraw$")],
         states={
-            WITHDRAW_USER: [MH(filters.TEXT & ~filters.COMMAND, withdraw_user)],
+            WITHDRAW_USER: [
+                MH(filters.TEXT & ~filters.COMMAND, withdraw_user),
+                CQH(withdraw_select, pattern="^withdraw_from_")
+            ],
             WITHDRAW_AMOUNT: [MH(filters.TEXT & ~filters.COMMAND, withdraw_amount)],
             WITHDRAW_REASON: [MH(filters.TEXT & ~filters.COMMAND, withdraw_complete)],
         },
-        fallbacks=[CommandHandler("cancel", lambda u, c: ConversationHandler.END)],
+        fallbacks=[
+            CommandHandler("cancel", lambda u, c: ConversationHandler.END),
+            CQH(bank_operations_cancel, pattern="^bank_operations$")
+        ],
     )
     application.add_handler(withdraw_conv)
 
     exchange_conv = ConversationHandler(
         entry_points=[CQH(exchange_start, pattern="^exchange$")],
         states={
-            EXCHANGE_USER: [MH(filters.TEXT & ~filters.COMMAND, exchange_user)],
+            EXCHANGE_USER: [
+                MH(filters.TEXT & ~filters.COMMAND, exchange_user),
+                CQH(exchange_select, pattern="^exchange_for_")
+            ],
             EXCHANGE_AMOUNT: [MH(filters.TEXT & ~filters.COMMAND, exchange_amount)],
         },
-        fallbacks=[CommandHandler("cancel", lambda u, c: ConversationHandler.END)],
+        fallbacks=[
+            CommandHandler("cancel", lambda u, c: ConversationHandler.END),
+            CQH(bank_operations_cancel, pattern="^bank_operations$")
+        ],
     )
     application.add_handler(exchange_conv)
 
-    application.add_handler(CQH(
-        lambda u, c: view_tasks(u, c, c.user_data.get("task_filter_completed", False)),
-        pattern="^task_prev_page$")
+    batch_conv = ConversationHandler(
+        entry_points=[CQH(batch_start, pattern="^batch_ops$")],
+        states={
+            BATCH_FILE: [MH(filters.Document.ALL, batch_file)],
+            BATCH_CONFIRM: [CQH(batch_apply, pattern="^batch_apply$")],
+        },
+        fallbacks=[
+            CQH(batch_cancel, pattern="^batch_cancel$"),
+            CommandHandler("cancel", cancel)
+        ],
     )
-    application.add_handler(CQH(
-        lambda u, c: view_tasks(u, c, c.user_data.get("task_filter_completed", False)),
-        pattern="^task_next_page$")
+    application.add_handler(batch_conv)
+
+    broadcast_conv = ConversationHandler(
+        entry_points=[CQH(broadcast_start, pattern="^broadcast$")],
+        states={
+            BROADCAST_AUDIENCE: [CQH(broadcast_audience, pattern="^broadcast_to_")],
+            BROADCAST_TEXT: [MH(filters.TEXT & ~filters.COMMAND, broadcast_text)],
+            BROADCAST_CONFIRM: [CQH(broadcast_send, pattern="^broadcast_send$")],
+        },
+        fallbacks=[
+            CQH(broadcast_cancel, pattern="^broadcast_cancel$"),
+            CommandHandler("cancel", cancel)
+        ],
+    )
+    application.add_handler(broadcast_conv)
+
+    application.add_handler(CQH(view_tasks, pattern=r"^vtask\|"))
+
+    task_creation_conv = ConversationHandler(
+        entry_points=[CQH(create_task_start, pattern="^create_task$")],
+        states={
+            TASK_NAME: [MH(filters.TEXT & ~filters.COMMAND, create_task_name)],
+            TASK_TYPE: [CQH(create_task_type, pattern="^new_task_type_")],
+            TASK_COUNT: [MH(filters.TEXT & ~filters.COMMAND, create_task_count)],
+            TASK_COST: [MH(filters.TEXT & ~filters.COMMAND, create_task_cost)],
+            TASK_SOCIAL_TYPE: [CQH(create_task_social_type, pattern="^new_task_social_")],
+            TASK_DEADLINE: [MH(filters.TEXT & ~filters.COMMAND, create_task_deadline)],
+            TASK_DESCRIPTION: [MH(filters.TEXT & ~filters.COMMAND, create_task_description)],
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+    )
+    application.add_handler(task_creation_conv)
+
+    proof_conv = ConversationHandler(
+        entry_points=[CQH(proof_start, pattern=r"^proof_\d+$")],
+        states={
+            TASK_PROOF: [MH((filters.TEXT & ~filters.COMMAND) | filters.PHOTO, proof_receive)],
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
     )
+    application.add_handler(proof_conv)
+    application.add_handler(CQH(take_task, pattern="^take_task$"))
+    application.add_handler(CQH(claim_task_handler, pattern=r"^claim_\d+$"))
+    application.add_handler(CQH(unclaim_task_handler, pattern=r"^unclaim_\d+$"))
+    application.add_handler(CQH(my_tasks, pattern="^my_tasks$"))
+    application.add_handler(CQH(review_claims, pattern="^review_claims$"))
+    application.add_handler(CQH(show_claim_proof, pattern=r"^claim_proof_\d+$"))
+    application.add_handler(CQH(review_claim, pattern=r"^claim_(ok|reject)_\d+$"))
 
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(InlineQueryHandler(resident_inline_query))
+    application.add_handler(CommandHandler("statement", statement_command))
+    application.add_handler(CommandHandler("payroll", payroll_command))
+    application.add_handler(CommandHandler("transactions", transactions_command))
+    application.add_handler(CQH(payroll_confirm, pattern="^payroll_(pay_.+|cancel)$"))
+    application.add_handler(CQH(show_statement, pattern="^statement$"))
+    application.add_handler(CQH(export_statement, pattern="^statement_csv_"))
     application.add_handler(CQH(show_balance, pattern="^balance$"))
-    application.add_handler(CQH(show_tasks, pattern="^tasks$"))
+    application.add_handler(CQH(show_tasks, pattern=r"^tasks(_page_\d+)?$"))
     application.add_handler(CQH(main_menu, pattern="^main_menu$"))
     application.add_handler(CQH(bank_operations_menu, pattern="^bank_operations$"))
     application.add_handler(CQH(admin_actions, pattern="^admin_actions$"))
@@ -1979,8 +5192,7 @@ def main() -> None:
     application.add_handler(CQH(register_restart, pattern="^register_restart$"))
     application.add_handler(CQH(view_transactions, pattern="^view_transactions$"))
     application.add_handler(CQH(manage_tasks, pattern="^manage_tasks$"))
-    application.add_handler(CQH(create_task_start, pattern="^create_task$"))
-    application.add_handler(CQH(complete_task, pattern="^complete_task$"))
+    application.add_handler(CQH(complete_task, pattern=r"^complete_task_\d+$"))
     application.add_handler(CQH(edit_task_start, pattern="^edit_task$"))
     application.add_handler(CQH(
         handle_application_decision,
@@ -1994,8 +5206,7 @@ def main() -> None:
     application.add_handler(CQH(lambda u, c: manage_users(u, c), pattern="^user_prev_page$"))
     application.add_handler(CQH(lambda u, c: manage_users(u, c), pattern="^user_next_page$"))
 
-    application.add_handler(CQH(lambda u, c: view_transactions(u, c), pattern="^trans_prev_page$"))
-    application.add_handler(CQH(lambda u, c: view_transactions(u, c), pattern="^trans_next_page$"))
+    application.add_handler(CQH(view_transactions, pattern=r"^trans\|[np]\|"))
 
     application.add_handler(MH(filters.COMMAND, unknown))
 
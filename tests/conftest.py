@@ -0,0 +1,37 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+@pytest.fixture
+def databases(tmp_path, monkeypatch):
+    """Запускает корутину на чистых временных базах с примененными миграциями"""
+    monkeypatch.setitem(main.CONFIG, "DATABASES", {
+        name: str(tmp_path / os.path.basename(path)) for name, path in main.CONFIG["DATABASES"].items()
+    })
+    # Ограничитель запросов Sheets привязывается к циклу событий, а каждый тест запускает свой
+    monkeypatch.setattr(main, "SHEETS_LIMITER", main.AsyncLimiter(main.CONFIG["SHEETS_REQUESTS_PER_MINUTE"], 60))
+    monkeypatch.setattr(main, "TASK_BOARD", None)
+    monkeypatch.setattr(main, "RESIDENT_INDEX", None)
+    main.RECENT_IDEMPOTENCY_KEYS.clear()
+    main.IDENTITY_CACHE.clear()
+    main.INLINE_SEARCH_CACHE.clear()
+    main.BLACKLIST.clear()
+
+    def run(check):
+        async def go():
+            await main.open_databases()
+            try:
+                await main.migrate_databases()
+                return await check()
+            finally:
+                await main.close_databases()
+        return asyncio.run(go())
+
+    return run
@@ -0,0 +1,92 @@
+from types import SimpleNamespace
+
+import main
+
+
+def message_update(text, replies, message_id=1):
+    async def reply_text(reply, **kwargs):
+        replies.append(reply)
+    message = SimpleNamespace(text=text, chat_id=1, message_id=message_id, reply_text=reply_text)
+    return SimpleNamespace(callback_query=None, effective_message=message, message=message, update_id=message_id,
+                           effective_user=SimpleNamespace(id=1, username="banker"))
+
+
+async def seed_account(user_id="c1", balance=100):
+    async with main.db_connection("bank") as db:
+        await db.execute("INSERT INTO accounts (id, balance) VALUES (?, ?)", (user_id, balance))
+        await db.commit()
+
+
+async def balance_of(user_id="c1"):
+    async with main.db_connection("bank") as db:
+        cursor = await db.execute("SELECT balance FROM accounts WHERE id = ?", (user_id,))
+        return (await cursor.fetchone())[0]
+
+
+def test_exchange_without_telegram_id_reports_success(databases, monkeypatch):
+    replies, notified = [], []
+
+    async def notify_user(context, telegram_uid, text):
+        notified.append(telegram_uid)
+
+    monkeypatch.setattr(main, "notify_user", notify_user)
+    context = SimpleNamespace(user_data={"exchange_user_id": "c1", "exchange_telegram_uid": None})
+
+    async def check():
+        await seed_account()
+        state = await main.exchange_amount(message_update("30", replies), context)
+        return state, await balance_of()
+
+    state, balance = databases(check)
+
+    assert state == main.ConversationHandler.END
+    assert balance == 70
+    assert replies[0].startswith("✅ Успешно обналичено 30 WVR")
+    assert notified == []
+
+
+def test_replayed_key_is_applied_once(databases):
+    async def check():
+        await seed_account()
+        first = await main.deposit_money("c1", 25, "премия", "deposit:1:1")
+        cached = await main.deposit_money("c1", 25, "премия", "deposit:1:1")
+        # Ключ вытеснен из кэша: повтор ловит проверка transactions.idempotency_key
+        main.RECENT_IDEMPOTENCY_KEYS.clear()
+        stored = await main.deposit_money("c1", 25, "премия", "deposit:1:1")
+        async with main.db_connection("bank") as db:
+            cursor = await db.execute("SELECT COUNT(*) FROM transactions WHERE idempotency_key = 'deposit:1:1'")
+            rows = (await cursor.fetchone())[0]
+        return first, cached, stored, rows, await balance_of()
+
+    first, cached, stored, rows, balance = databases(check)
+
+    assert first is True
+    assert cached == stored == main.ALREADY_APPLIED
+    assert rows == 1
+    assert balance == 125
+
+
+def test_replayed_deposit_does_not_notify_again(databases, monkeypatch):
+    replies, notified = [], []
+
+    async def notify_user(context, telegram_uid, text):
+        notified.append(telegram_uid)
+
+    monkeypatch.setattr(main, "notify_user", notify_user)
+
+    def context():
+        return SimpleNamespace(user_data={"deposit_user_id": "c1", "deposit_amount": 10,
+                                          "deposit_telegram_uid": "10"})
+
+    async def check():
+        await seed_account()
+        await main.deposit_complete(message_update("премия", replies, message_id=5), context())
+        main.RECENT_IDEMPOTENCY_KEYS.clear()
+        await main.deposit_complete(message_update("премия", replies, message_id=5), context())
+        return await balance_of()
+
+    balance = databases(check)
+
+    assert balance == 110
+    assert notified == ["10"]
+    assert replies[1] == "ℹ️ Эта операция уже выполнена"
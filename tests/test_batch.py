@@ -0,0 +1,102 @@
+import main
+
+INDEX = main.ResidentIndex([
+    ("c1", "alice", "10", "resident"),
+    ("c2", "bob", None, "resident"),
+    ("c3", "Twin", None, "resident"),
+    ("c4", "twin", None, "resident"),
+    ("c5", "nomoney", None, "resident"),
+])
+BALANCES = {"c1": 100, "c2": 20, "c3": 0, "c4": 0}
+
+
+def test_parse_reports_every_invalid_row():
+    data = (
+        "ID;сумма;причина\n"
+        "alice;50;премия\n"
+        "ghost;10;\n"
+        "bob;много;\n"
+        "bob;0;\n"
+        "twin;5;\n"
+        "nomoney;5;\n"
+        "bob;-15;штраф\n"
+        "bob;-10;второй штраф\n"
+        "c1\n"
+    ).encode("utf-8-sig")
+
+    rows, errors = main.parse_batch_csv(data, INDEX, BALANCES)
+
+    assert [(row["line"], row["id"], row["amount"]) for row in rows] == [(2, "c1", 50), (8, "c2", -15)]
+    assert rows[1]["reason"] == "штраф"
+    assert errors == [
+        "Строка 3: житель ghost не найден",
+        "Строка 4: сумма должна быть целым числом",
+        "Строка 5: нулевая сумма",
+        "Строка 6: ник twin неоднозначен, укажите ID",
+        "Строка 7: у жителя c5 нет счета",
+        # Списание проверяется по балансу после предыдущих строк файла: 20 - 15 < 10
+        "Строка 9: недостаточно средств у c2 (баланс 5, списание 10)",
+        "Строка 10: нужны как минимум ID или ник и сумма",
+    ]
+
+
+def test_parse_accepts_comma_separated_file():
+    rows, errors = main.parse_batch_csv(b"c1,5,bonus\nbob,-20\n", INDEX, BALANCES)
+
+    assert errors == []
+    assert [(row["id"], row["amount"], row["reason"]) for row in rows] == [
+        ("c1", 5, "bonus"), ("c2", -20, "Пакетная операция")
+    ]
+
+
+async def seed_accounts():
+    async with main.db_connection("bank") as db:
+        await db.executemany("INSERT INTO accounts (id, balance) VALUES (?, ?)", list(BALANCES.items()))
+        await db.commit()
+
+
+async def ledger_state():
+    async with main.db_connection("bank") as db:
+        cursor = await db.execute("SELECT id, balance FROM accounts ORDER BY id")
+        balances = dict(await cursor.fetchall())
+        cursor = await db.execute("SELECT COUNT(*) FROM transactions")
+        count = (await cursor.fetchone())[0]
+    return balances, count
+
+
+def test_apply_is_all_or_nothing_and_replay_safe(databases):
+    rows, errors = main.parse_batch_csv(b"alice;30\nbob;-20\nc3;7\n", INDEX, BALANCES)
+    assert errors == []
+
+    async def check():
+        await seed_accounts()
+        # Баланс bob уменьшился после проверки файла: вторая строка не проходит
+        async with main.db_connection("bank") as db:
+            await db.execute("UPDATE accounts SET balance = 10 WHERE id = 'c2'")
+            await db.commit()
+
+        failures = []
+        for _ in range(2):
+            try:
+                await main.apply_batch_operations(rows, "batch:1:1")
+            except ValueError as e:
+                failures.append(str(e))
+        after_failure = await ledger_state()
+
+        async with main.db_connection("bank") as db:
+            await db.execute("UPDATE accounts SET balance = 20 WHERE id = 'c2'")
+            await db.commit()
+        applied = await main.apply_batch_operations(rows, "batch:1:2")
+        after_apply = await ledger_state()
+        main.RECENT_IDEMPOTENCY_KEYS.clear()
+        replayed = await main.apply_batch_operations(rows, "batch:1:2")
+        return failures, after_failure, applied, after_apply, replayed, await ledger_state()
+
+    failures, after_failure, applied, after_apply, replayed, after_replay = databases(check)
+
+    assert len(failures) == 2
+    assert after_failure == ({"c1": 100, "c2": 10, "c3": 0, "c4": 0}, 0)
+    assert applied is True
+    assert after_apply == ({"c1": 130, "c2": 0, "c3": 7, "c4": 0}, 3)
+    assert replayed == main.ALREADY_APPLIED
+    assert after_replay == after_apply
@@ -0,0 +1,30 @@
+import json
+
+import main
+
+
+def test_legacy_blacklist_is_keyed_by_telegram_id_after_upgrade(databases, tmp_path, monkeypatch):
+    path = tmp_path / "blacklist.json"
+    path.write_text(json.dumps([
+        {"id": "c42", "nickname": "griefer", "reason": "гриф", "block_date": "2024-01-01"},
+        {"id": 555, "nickname": "spammer", "reason": "спам", "block_date": "2024-01-02"},
+        {"id": "c43", "nickname": "ghost", "reason": "", "block_date": "2024-01-03"},
+    ]))
+    monkeypatch.setitem(main.CONFIG, "BLACKLIST_FILE", str(path))
+
+    async def check():
+        async with main.db_connection("civilian") as db:
+            await db.executemany(
+                "INSERT INTO civilians (id, nickname, telegram_uid, role) VALUES (?, ?, ?, 'resident')",
+                [("c42", "griefer", "777"), ("c43", "ghost", None)]
+            )
+            await db.commit()
+        # Как в init_databases: миграции уже применены, затем загружается черный список
+        await main.load_blacklist()
+
+    databases(check)
+
+    assert sorted(main.BLACKLIST) == ["555", "777", "c43"]
+    assert main.is_blacklisted("777")
+    assert main.BLACKLIST["777"]["nickname"] == "griefer"
+    assert not path.exists()
@@ -0,0 +1,35 @@
+import asyncio
+
+import main
+from test_notifications import StubBot
+
+
+def test_broadcast_finishes_when_sends_fail(databases, monkeypatch):
+    monkeypatch.setitem(main.CONFIG, "BROADCAST_WINDOW", 2)
+
+    async def check():
+        dispatcher = main.NotificationDispatcher(
+            workers=2, global_rate=1000, chat_rate=1000, max_attempts=1, retry_delay=0.001
+        )
+        monkeypatch.setattr(main, "NOTIFIER", dispatcher)
+        async with main.db_connection("civilian") as db:
+            await db.executemany(
+                "INSERT INTO civilians (id, nickname, telegram_uid, role) VALUES (?, ?, ?, 'resident')",
+                [("a", "a", "1"), ("b", "b", "2"), ("c", "c", "3"), ("d", "d", ""), ("e", "e", None)]
+            )
+            await db.commit()
+
+        bot = StubBot({"1": [RuntimeError("сломанный бот")], "2": [main.telegram.error.ChatMigrated(5)]})
+        await dispatcher.start(bot)
+        try:
+            broadcast_id, recipients = await main.create_broadcast("новость", "resident", None)
+            await asyncio.wait_for(main.run_broadcast(broadcast_id), 5)
+            return recipients, await main.get_broadcast_stats(broadcast_id)
+        finally:
+            await dispatcher.stop()
+
+    recipients, stats = databases(check)
+
+    assert recipients == 3
+    assert stats["sent"] == 1
+    assert stats["failed"] == 2
@@ -0,0 +1,56 @@
+import main
+
+
+def sheet_row(civilian_id, nickname):
+    return {"id": civilian_id, "nickname": nickname, "discord": "", "telegram": "", "is_resident": "TRUE"}
+
+
+async def roles():
+    async with main.db_connection("civilian") as db:
+        cursor = await db.execute("SELECT id, role FROM civilians ORDER BY id")
+        return dict(await cursor.fetchall())
+
+
+def test_admin_demotion_survives_sync(databases):
+    async def check():
+        async with main.db_connection("civilian") as db:
+            await db.executemany(
+                "INSERT INTO civilians (id, nickname, telegram_uid, role) VALUES (?, ?, ?, 'resident')",
+                [("c1", "alice", "10"), ("c2", "bob", "11")]
+            )
+            await db.commit()
+        records = [sheet_row("c1", "alice"), sheet_row("c2", "bob")]
+
+        await main.change_user_role("c1", "guest")
+        first = await main.apply_civilians_snapshot(records)
+        second = await main.apply_civilians_snapshot(records)
+        return first, second, await roles()
+
+    first, second, after = databases(check)
+
+    assert after == {"c1": "guest", "c2": "resident"}
+    assert first["updated"] == 0 and second["updated"] == 0
+
+
+def test_sync_restores_only_residents_it_deactivated(databases):
+    async def check():
+        async with main.db_connection("civilian") as db:
+            await db.executemany(
+                "INSERT INTO civilians (id, nickname, telegram_uid, role) VALUES (?, ?, ?, 'resident')",
+                [("c1", "alice", "10"), ("c2", "bob", "11")]
+            )
+            await db.commit()
+
+        removed = await main.apply_civilians_snapshot([sheet_row("c2", "bob")])
+        deactivated = await roles()
+        returned = await main.apply_civilians_snapshot([sheet_row("c1", "alice"), sheet_row("c2", "bob")])
+        repeated = await main.apply_civilians_snapshot([sheet_row("c1", "alice"), sheet_row("c2", "bob")])
+        return removed, deactivated, returned, repeated, await roles()
+
+    removed, deactivated, returned, repeated, after = databases(check)
+
+    assert removed["deactivated"] == 1
+    assert deactivated == {"c1": "guest", "c2": "resident"}
+    assert returned["updated"] == 1
+    assert repeated["updated"] == 0
+    assert after == {"c1": "resident", "c2": "resident"}
@@ -0,0 +1,100 @@
+import re
+
+import main
+
+
+class FakeWorksheet:
+    """Лист в памяти с той частью интерфейса gspread, которую использует выгрузка"""
+
+    def __init__(self):
+        self.rows = []
+
+    def update(self, values, range_name):
+        start = int(re.match(r"[A-Z]+(\d+)", range_name).group(1)) - 1
+        self.rows.extend([] for _ in range(start + len(values) - len(self.rows)))
+        for offset, row in enumerate(values):
+            self.rows[start + offset] = list(row)
+
+    def batch_clear(self, ranges):
+        for cell_range in ranges:
+            start = int(re.match(r"[A-Z]+(\d+)", cell_range).group(1)) - 1
+            del self.rows[start:]
+
+    def col_values(self, column):
+        return [row[column - 1] for row in self.rows if len(row) >= column]
+
+    def append_rows(self, rows, value_input_option=None):
+        self.rows.extend(list(row) for row in rows)
+
+
+class FakeClient:
+    def __init__(self):
+        self.worksheets = {
+            main.CONFIG["BANK_ACCOUNTS_WORKSHEET"]: FakeWorksheet(),
+            main.CONFIG["BANK_TRANSACTIONS_WORKSHEET"]: FakeWorksheet(),
+        }
+
+    def open_by_url(self, url):
+        return self
+
+    def worksheet(self, title):
+        return self.worksheets[title]
+
+
+async def add_accounts(*accounts):
+    async with main.db_connection("bank") as db:
+        await db.executemany("INSERT INTO accounts (id, balance, salary) VALUES (?, ?, 0)", accounts)
+        await db.commit()
+
+
+async def add_transactions(count):
+    async with main.db_connection("bank") as db:
+        await db.executemany(
+            "INSERT INTO transactions (user_id, type, date, amount) VALUES ('a', 'deposit', ?, 1)",
+            [(f"2026-01-01T00:00:{i:02d}",) for i in range(count)]
+        )
+        await db.commit()
+
+
+def test_accounts_sheet_drops_stale_rows(databases):
+    client = FakeClient()
+    accounts_ws = client.worksheets[main.CONFIG["BANK_ACCOUNTS_WORKSHEET"]]
+
+    async def check():
+        await add_accounts(("a", 10), ("b", 20), ("c", 30))
+        await main.export_bank_ledger(client=client)
+        assert len(accounts_ws.rows) == 4
+
+        async with main.db_connection("bank") as db:
+            await db.execute("DELETE FROM accounts WHERE id != 'a'")
+            await db.commit()
+        await main.export_bank_ledger(client=client)
+        assert accounts_ws.rows == [main.ACCOUNTS_HEADER, ["a", 10, 0]]
+
+    databases(check)
+
+
+def test_failed_mark_does_not_duplicate_transactions(databases, monkeypatch):
+    client = FakeClient()
+    transactions_ws = client.worksheets[main.CONFIG["BANK_TRANSACTIONS_WORKSHEET"]]
+
+    async def check():
+        await add_transactions(3)
+        original = main.set_export_mark
+
+        async def broken(name, value):
+            raise RuntimeError("запись отметки не удалась")
+
+        monkeypatch.setattr(main, "set_export_mark", broken)
+        assert await main.export_bank_ledger(client=client) is None
+        assert len(transactions_ws.rows) == 4
+
+        monkeypatch.setattr(main, "set_export_mark", original)
+        await add_transactions(2)
+        stats = await main.export_bank_ledger(client=client)
+
+        assert stats["transactions"] == 2
+        assert [row[0] for row in transactions_ws.rows[1:]] == [1, 2, 3, 4, 5]
+        assert await main.get_export_mark("transactions") == 5
+
+    databases(check)
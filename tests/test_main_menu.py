@@ -0,0 +1,25 @@
+import pytest
+
+import main
+
+
+def menu_actions(markup):
+    return [button.callback_data for row in markup.inline_keyboard for button in row]
+
+
+@pytest.mark.parametrize("role", list(main.MAIN_MENUS))
+def test_menu_matches_status_for_every_role(role):
+    status, markup = main.get_main_menu(role)
+
+    assert status == f"Твой статус: {main.ROLES[role]}"
+    assert markup is main.MAIN_MENUS[role]
+    actions = menu_actions(markup)
+    assert ("transfer" in actions) == (role != "guest")
+    assert ("bank_operations" in actions) == (role in ("banker", "admin"))
+    assert ("admin_actions" in actions) == (role == "admin")
+
+
+@pytest.mark.parametrize("role", [None, "civilian", "unknown"])
+def test_unknown_role_falls_back_to_guest(role):
+    assert main.get_main_menu(role) == main.get_main_menu("guest")
+    assert menu_actions(main.get_main_menu(role)[1]) == ["balance"]
@@ -0,0 +1,83 @@
+import asyncio
+from datetime import timedelta
+
+import telegram.error
+
+import main
+
+
+class StubBot:
+    """Бот, который по сценарию на каждый чат бросает ошибки перед успешной отправкой"""
+
+    def __init__(self, script):
+        self.script = {chat_id: list(errors) for chat_id, errors in script.items()}
+        self.delivered = []
+        self.calls = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls += 1
+        errors = self.script.get(chat_id)
+        if errors:
+            raise errors.pop(0)
+        self.delivered.append((chat_id, text))
+
+
+def deliver(script, chat_ids, max_attempts=3):
+    async def run():
+        dispatcher = main.NotificationDispatcher(
+            workers=2, global_rate=1000, chat_rate=1000, max_attempts=max_attempts, retry_delay=0.001
+        )
+        bot = StubBot(script)
+        results = {}
+
+        async def on_result(chat_id, status):
+            results[chat_id] = status
+
+        await dispatcher.start(bot)
+        dispatcher.enqueue_many(chat_ids, "привет", on_result)
+        await dispatcher.stop(timeout=5)
+        return dispatcher.stats(), bot, results
+
+    return asyncio.run(run())
+
+
+def test_retry_after_pauses_and_retries():
+    stats, bot, results = deliver({1: [telegram.error.RetryAfter(timedelta(seconds=0.01))]}, [1, 2])
+
+    assert results == {1: "sent", 2: "sent"}
+    assert stats["sent"] == 2
+    assert stats["retried"] == 1
+    assert stats["failed"] == 0
+
+
+def test_forbidden_counts_as_blocked_without_retry():
+    stats, bot, results = deliver({1: [telegram.error.Forbidden("bot was blocked by the user")]}, [1])
+
+    assert results == {1: "blocked"}
+    assert stats["blocked"] == 1
+    assert bot.calls == 1
+
+
+def test_network_errors_are_retried_up_to_max_attempts():
+    errors = [telegram.error.NetworkError("timeout")] * 3
+    stats, bot, results = deliver({1: errors, 2: errors[:2]}, [1, 2], max_attempts=3)
+
+    assert results == {1: "failed", 2: "sent"}
+    assert stats["retried"] == 4
+    assert stats["failed"] == 1
+    assert bot.calls == 6
+
+
+def test_unexpected_telegram_error_is_counted_as_failed():
+    stats, bot, results = deliver({1: [telegram.error.ChatMigrated(100)], 2: [telegram.error.TelegramError("?")]}, [1, 2])
+
+    assert results == {1: "failed", 2: "failed"}
+    assert stats["failed"] == 2
+    assert bot.calls == 2
+
+
+def test_on_result_fires_when_delivery_raises():
+    stats, bot, results = deliver({1: [RuntimeError("сломанный бот")]}, [1, 2])
+
+    assert results == {1: "failed", 2: "sent"}
+    assert stats["failed"] == 1
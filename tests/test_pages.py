@@ -0,0 +1,70 @@
+import main
+
+LIMIT = main.MESSAGE_LIMIT
+HEADER = "📋 Список:\n\n"
+
+
+def assert_within_limit(pages):
+    assert pages
+    for page in pages:
+        assert main.message_length(page) <= LIMIT
+
+
+def test_entry_longer_than_limit_is_truncated_on_its_own_page():
+    lines = "\n".join(f"строка {n}" for n in range(1000))
+    entries = ["первая", lines, "последняя"]
+
+    pages = main.split_pages(HEADER, entries)
+
+    assert_within_limit(pages)
+    assert len(pages) == 3
+    assert pages[0] == HEADER + "первая"
+    assert pages[1].startswith(HEADER + "строка 0\n")
+    # Обрезка идет по границе строки
+    assert pages[1].endswith("…") and not pages[1].endswith("\n…")
+    assert pages[1][:-1].split("\n")[-1].startswith("строка ")
+    assert pages[2] == HEADER + "последняя"
+
+
+def test_single_line_entry_is_cut_by_character():
+    page = main.join_page(HEADER, ["x" * 10000])
+
+    assert main.message_length(page) == LIMIT
+    assert page.endswith("x…")
+
+
+def test_page_boundary_at_exactly_message_limit():
+    entry = "a" * 99
+    # Записи разделяются "\n": заголовок + n * 99 + (n - 1) = 4096 при подобранном заголовке
+    count = 40
+    header = "h" * (LIMIT - count * len(entry) - (count - 1))
+    entries = [entry] * count
+
+    exact = main.split_pages(header, entries)
+    over = main.split_pages(header + "h", entries)
+
+    assert len(exact) == 1 and main.message_length(exact[0]) == LIMIT
+    assert main.fit_entries(header, entries) == count
+    assert len(over) == 2
+    assert main.fit_entries(header + "h", entries) == count - 1
+    assert_within_limit(over)
+
+
+def test_emoji_count_as_two_utf16_units():
+    entries = ["🎉" * 100 + " ёжик"] * 60
+
+    pages = main.split_pages(HEADER, entries)
+
+    assert_within_limit(pages)
+    # По len() все поместилось бы в две страницы, а в единицах UTF-16 запись
+    # занимает 205 единиц и на страницу помещается 19 записей
+    assert len(HEADER) + sum(len(e) + 1 for e in entries) < 2 * LIMIT
+    assert [page.count("ёжик") for page in pages] == [19, 19, 19, 3]
+    assert sum(page.count("ёжик") for page in pages) == len(entries)
+
+
+def test_truncated_emoji_entry_stays_within_limit():
+    page = main.join_page(HEADER, ["🔥" * 5000])
+
+    assert main.message_length(page) <= LIMIT
+    assert page.endswith("🔥…")
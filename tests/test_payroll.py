@@ -0,0 +1,70 @@
+from datetime import datetime
+
+import main
+
+
+async def add_salaried_account(account_id, salary):
+    async with main.db_connection("bank") as db:
+        await db.execute("INSERT INTO accounts (id, balance, salary) VALUES (?, 0, ?)", (account_id, salary))
+        await db.commit()
+
+
+async def balance(account_id):
+    async with main.db_connection("bank") as db:
+        cursor = await db.execute("SELECT balance FROM accounts WHERE id = ?", (account_id,))
+        return (await cursor.fetchone())[0]
+
+
+def current_period():
+    return datetime.now().strftime(main.CONFIG["PAYROLL_PERIOD_FORMAT"])
+
+
+def test_migration_seeds_current_period(databases, monkeypatch):
+    monkeypatch.setitem(main.CONFIG, "PAYROLL_DAY", 1)
+
+    async def check():
+        await add_salaried_account("a", 100)
+        await main.payroll_job(None)
+        assert await main.run_payroll() is None
+        assert await balance("a") == 0
+        return await main.get_payroll_preview(current_period())
+
+    preview = databases(check)
+
+    assert preview["source"] == "seed"
+    assert preview["accounts"] == 1 and preview["total"] == 100
+
+
+def test_admin_payout_replaces_seed_once(databases):
+    async def check():
+        await add_salaried_account("a", 100)
+        report = await main.run_payroll(period=current_period(), source="admin")
+        again = await main.run_payroll(period=current_period(), source="admin")
+        return report, again, await balance("a")
+
+    report, again, paid = databases(check)
+
+    assert report["total"] == 100
+    assert again is None
+    assert paid == 100
+
+
+def test_job_waits_for_pay_day(databases, monkeypatch):
+    async def check():
+        await add_salaried_account("a", 100)
+        async with main.db_connection("bank") as db:
+            await db.execute("DELETE FROM payroll_runs")
+            await db.commit()
+
+        monkeypatch.setitem(main.CONFIG, "PAYROLL_DAY", 0)
+        await main.payroll_job(None)
+        monkeypatch.setitem(main.CONFIG, "PAYROLL_DAY", 32)
+        await main.payroll_job(None)
+        assert await balance("a") == 0
+
+        monkeypatch.setitem(main.CONFIG, "PAYROLL_DAY", 1)
+        await main.payroll_job(None)
+        await main.payroll_job(None)
+        return await balance("a")
+
+    assert databases(check) == 100
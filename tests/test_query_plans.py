@@ -0,0 +1,21 @@
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize(
+    "name, query, params", main.HOT_QUERIES,
+    ids=[f"{name}-{number}" for number, (name, _, _) in enumerate(main.HOT_QUERIES)]
+)
+def test_hot_query_uses_index(databases, name, query, params):
+    plan = databases(lambda: main.explain_query_plan(name, query, params))
+
+    assert not main.full_scan_steps(plan), plan
+    assert any("USING" in step and "INDEX" in step or "PRIMARY KEY" in step for step in plan), plan
+
+
+def test_full_scan_is_detected():
+    assert main.full_scan_steps(["SCAN transactions"]) == ["SCAN transactions"]
+    assert main.full_scan_steps(["SEARCH a USING INDEX i (id=?)", "USE TEMP B-TREE FOR ORDER BY"])
+    assert not main.full_scan_steps(["SCAN transactions USING INDEX idx_transactions_date_id"])
+    assert not main.full_scan_steps(["CO-ROUTINE (subquery-1)", "SCAN (subquery-1)"])
@@ -0,0 +1,56 @@
+import main
+
+
+async def deposit(account, amount, count=1):
+    async with main.db_connection("bank") as db:
+        await db.executemany(
+            "INSERT INTO transactions (user_id, type, date, to_user, amount) VALUES (?, 'deposit', '2026-01-01', ?, ?)",
+            [(account, account, amount)] * count
+        )
+        await db.execute("UPDATE accounts SET balance = balance + ? WHERE id = ?", (amount * count, account))
+        await db.commit()
+
+
+async def set_balance(account, balance):
+    async with main.db_connection("bank") as db:
+        await db.execute("UPDATE accounts SET balance = ? WHERE id = ?", (balance, account))
+        await db.commit()
+
+
+def test_first_check_verifies_full_history(databases):
+    async def check():
+        async with main.db_connection("bank") as db:
+            await db.executemany("INSERT INTO accounts (id, balance, salary) VALUES (?, 0, 0)", [("a",), ("b",)])
+            await db.commit()
+        await deposit("a", 5, count=3)
+        await deposit("b", 7)
+        await set_balance("b", 100)
+        return await main.reconcile_balances()
+
+    report = databases(check)
+
+    assert report["verified_full"] == 2
+    assert report["drift"] == [{"id": "b", "expected": 7, "actual": 100, "drift": 93, "first_check": True}]
+
+
+def test_drifting_account_does_not_pin_scan_window(databases):
+    async def check():
+        async with main.db_connection("bank") as db:
+            await db.executemany("INSERT INTO accounts (id, balance, salary) VALUES (?, 0, 0)", [("a",), ("b",)])
+            await db.commit()
+        await deposit("a", 1, count=50)
+        await deposit("b", 1)
+        await set_balance("b", 10)
+        first = await main.reconcile_balances()
+
+        await deposit("a", 1, count=2)
+        await deposit("b", 1)
+        second = await main.reconcile_balances()
+        return first, second
+
+    first, second = databases(check)
+
+    assert [item["id"] for item in first["drift"]] == ["b"]
+    assert second["verified_full"] == 0
+    assert second["rows_scanned"] == 3
+    assert second["drift"] == [{"id": "b", "expected": 2, "actual": 11, "drift": 9, "first_check": False}]
@@ -0,0 +1,45 @@
+import csv
+import io
+
+import main
+
+
+async def add_history(user_id, count, comment="ok"):
+    async with main.db_connection("bank") as db:
+        await db.execute("INSERT INTO accounts (id, balance, salary) VALUES (?, ?, 0)", (user_id, 1000 + count))
+        await db.executemany(
+            """INSERT INTO transactions (user_id, type, date, from_user, to_user, amount, comment)
+            VALUES (?, 'deposit', ?, NULL, ?, 1, ?)""",
+            [(user_id, f"2026-01-01T00:{i // 60:02d}:{i % 60:02d}", user_id, comment) for i in range(count)]
+        )
+        await db.commit()
+
+
+def test_preview_is_bounded_and_ends_at_account_balance(databases):
+    async def check():
+        await add_history("u", 50, comment="к" * 5000)
+        return await main.render_statement({"id": "u", "nickname": "u"})
+
+    message = databases(check)
+
+    assert main.message_length(message) <= main.MESSAGE_LIMIT
+    assert message.count("📅") <= main.CONFIG["STATEMENT_PREVIEW_ROWS"]
+    assert "к" * (main.CONFIG["STATEMENT_COMMENT_LIMIT"] + 1) not in message
+    assert "+1 WVR → 1050 WVR" in message
+    assert message.endswith("Баланс счета: 1050 WVR")
+
+
+def test_csv_contains_whole_history(databases, monkeypatch):
+    monkeypatch.setitem(main.CONFIG, "STATEMENT_CSV_BATCH", 7)
+
+    async def check():
+        await add_history("u", 30)
+        spool, rows = await main.write_statement_csv("u")
+        with spool:
+            return rows, list(csv.reader(io.TextIOWrapper(spool, encoding="utf-8-sig", newline="")))
+
+    rows, lines = databases(check)
+
+    assert rows == 30
+    assert len(lines) == 31
+    assert lines[-1][7] == "30"
@@ -0,0 +1,162 @@
+import asyncio
+from types import SimpleNamespace
+
+import main
+
+
+async def seed(count=1, residents=("alice",)):
+    async with main.db_connection("tasks") as db:
+        await db.execute(
+            "INSERT INTO tasks (id, name, task_type, cost, count, social_type) VALUES (1, 'Шахта', 'mining', 50, ?, 'active')",
+            (count,)
+        )
+        await db.commit()
+    async with main.db_connection("bank") as db:
+        await db.executemany("INSERT INTO accounts (id, balance) VALUES (?, 100)", [(r,) for r in residents])
+        await db.commit()
+
+
+async def submitted_claim(user_id="alice", telegram_uid="10"):
+    assert await main.claim_task(1, user_id, telegram_uid) == "claimed"
+    async with main.db_connection("tasks") as db:
+        cursor = await db.execute("SELECT MAX(id) FROM task_claims")
+        claim_id = (await cursor.fetchone())[0]
+    assert await main.submit_proof(claim_id, user_id, "text:готово")
+    return claim_id
+
+
+async def set_status(claim_id, status):
+    async with main.db_connection("tasks") as db:
+        await db.execute("UPDATE task_claims SET status = ? WHERE id = ?", (status, claim_id))
+        await db.commit()
+
+
+async def state(claim_id, user_id="alice"):
+    async with main.db_connection("bank") as db:
+        cursor = await db.execute("SELECT balance FROM accounts WHERE id = ?", (user_id,))
+        balance = (await cursor.fetchone())[0]
+        cursor = await db.execute(
+            "SELECT COUNT(*) FROM transactions WHERE idempotency_key = ?", (f"task:{claim_id}",)
+        )
+        rewards = (await cursor.fetchone())[0]
+    claim = await main.get_claim(claim_id)
+    return claim["status"], balance, rewards
+
+
+def test_concurrent_claims_respect_count(databases):
+    async def check():
+        await seed(count=2)
+        return await asyncio.gather(*(main.claim_task(1, f"user{i}", str(i)) for i in range(6)))
+
+    results = databases(check)
+
+    assert sorted(results) == ["claimed"] * 2 + ["full"] * 4
+
+
+def test_approval_credits_once_and_closes_task(databases):
+    async def check():
+        await seed()
+        claim_id = await submitted_claim()
+        first = await main.approve_claim(claim_id, "adm")
+        second = await main.approve_claim(claim_id, "adm")
+        tasks = await main.get_available_tasks()
+        return first, second, await state(claim_id), tasks
+
+    first, second, after, tasks = databases(check)
+
+    assert first == {"user_id": "alice", "cost": 50, "task_name": "Шахта"}
+    assert second is None
+    assert after == ("approved", 150, 1)
+    assert tasks == []
+
+
+def test_approval_with_existing_ledger_row_only_flips_claim(databases):
+    async def check():
+        await seed()
+        claim_id = await submitted_claim()
+        claim = await main.get_claim(claim_id)
+        # Награда зафиксирована в bank.db, а подтверждение в tasks.db потеряно
+        await main.ledger_write(lambda db: main.credit_task_reward(db, claim), f"task:{claim_id}")
+        main.RECENT_IDEMPOTENCY_KEYS.clear()
+        reward = await main.approve_claim(claim_id, "adm")
+        return reward, await state(claim_id)
+
+    reward, after = databases(check)
+
+    assert reward == {"user_id": "alice", "cost": 50, "task_name": "Шахта"}
+    assert after == ("approved", 150, 1)
+
+
+def test_approval_without_account_returns_claim_to_review(databases):
+    async def check():
+        await seed(residents=())
+        claim_id = await submitted_claim()
+        try:
+            await main.approve_claim(claim_id, "adm")
+        except LookupError:
+            pass
+        else:
+            raise AssertionError("approve_claim должен был упасть")
+        return await main.get_claim(claim_id)
+
+    claim = databases(check)
+
+    assert claim["status"] == "submitted"
+    assert claim["reviewed_by"] is None
+
+
+def test_repair_reconciles_claims_in_both_directions(databases):
+    async def check():
+        await seed(count=3, residents=("alice", "bob", "carol"))
+        approved = await submitted_claim("alice", "10")
+        credited = await submitted_claim("bob", "11")
+        approving = await submitted_claim("carol", "12")
+
+        await set_status(approved, "approved")
+        claim = await main.get_claim(credited)
+        await main.ledger_write(lambda db: main.credit_task_reward(db, claim), f"task:{credited}")
+        await set_status(approving, "approving")
+        main.RECENT_IDEMPOTENCY_KEYS.clear()
+
+        await main.repair_task_rewards()
+        await main.repair_task_rewards()
+        return [await state(approved, "alice"), await state(credited, "bob"), await state(approving, "carol")]
+
+    states = databases(check)
+
+    assert states == [("approved", 150, 1)] * 3
+
+
+def test_review_skips_notification_without_telegram_id(databases, monkeypatch):
+    notified = []
+    edits = []
+
+    async def notify_user(context, telegram_uid, text):
+        notified.append(telegram_uid)
+
+    async def answer(*args, **kwargs):
+        pass
+
+    async def edit_message_text(text, **kwargs):
+        edits.append(text)
+
+    monkeypatch.setattr(main, "notify_user", notify_user)
+
+    async def check():
+        await seed(count=2, residents=("alice", "bob"))
+        async with main.db_connection("civilian") as db:
+            await db.execute("INSERT INTO civilians (id, nickname, telegram_uid, role) VALUES ('adm', 'adm', '1', 'admin')")
+            await db.commit()
+        silent = await submitted_claim("alice", None)
+        loud = await submitted_claim("bob", "11")
+        for action, claim_id in (("ok", silent), ("reject", loud)):
+            query = SimpleNamespace(data=f"claim_{action}_{claim_id}", from_user=SimpleNamespace(id=1),
+                                    answer=answer, edit_message_text=edit_message_text)
+            await main.review_claim(SimpleNamespace(callback_query=query), SimpleNamespace())
+        return await state(silent)
+
+    after = databases(check)
+
+    assert after == ("approved", 150, 1)
+    assert notified == ["11"]
+    assert len(edits) == 2
@@ -0,0 +1,64 @@
+from types import SimpleNamespace
+
+import main
+
+
+def message_update(text, replies):
+    async def reply_text(reply, **kwargs):
+        replies.append(reply)
+    return SimpleNamespace(effective_user=SimpleNamespace(id=1),
+                           message=SimpleNamespace(text=text, reply_text=reply_text))
+
+
+def callback_update(data, replies):
+    async def answer(*args, **kwargs):
+        pass
+
+    async def edit_message_text(text, **kwargs):
+        replies.append(text)
+    return SimpleNamespace(effective_user=SimpleNamespace(id=1),
+                           callback_query=SimpleNamespace(data=data, answer=answer,
+                                                          edit_message_text=edit_message_text))
+
+
+def test_creation_flow_publishes_task_on_board(databases):
+    replies = []
+    context = SimpleNamespace(user_data={"batch_rows": [1]})
+
+    async def check():
+        async with main.db_connection("civilian") as db:
+            await db.execute("INSERT INTO civilians (id, nickname, telegram_uid, role) VALUES ('adm', 'adm', '1', 'admin')")
+            await db.commit()
+        await main.get_task_board()
+        version = main.TASKS_VERSION
+
+        assert await main.create_task_start(callback_update("create_task", replies), context) == main.TASK_NAME
+        assert await main.create_task_name(message_update("Шахта", replies), context) == main.TASK_TYPE
+        assert await main.create_task_type(callback_update("new_task_type_mining", replies), context) == main.TASK_COUNT
+        assert await main.create_task_count(message_update("-1", replies), context) == main.TASK_COUNT
+        assert await main.create_task_count(message_update("3", replies), context) == main.TASK_COST
+        assert await main.create_task_cost(message_update("50", replies), context) == main.TASK_SOCIAL_TYPE
+        assert await main.create_task_social_type(
+            callback_update("new_task_social_active", replies), context) == main.TASK_DEADLINE
+        assert await main.create_task_deadline(message_update("-", replies), context) == main.TASK_DESCRIPTION
+        state = await main.create_task_description(message_update("Накопать руды", replies), context)
+
+        assert state == main.ConversationHandler.END
+        assert main.TASKS_VERSION > version
+        return await main.get_task_board(), await main.get_available_tasks()
+
+    board, tasks = databases(check)
+
+    assert tasks == [{"id": 1, "name": "Шахта", "type": "mining", "cost": 50, "social_type": "active",
+                      "deadline": None, "description": "Накопать руды", "count": 3, "claimed": 0}]
+    assert "Шахта" in board["pages"][0]
+    assert context.user_data == {"batch_rows": [1]}
+
+
+def test_creation_requires_admin(databases):
+    replies = []
+
+    async def check():
+        return await main.create_task_start(callback_update("create_task", replies), SimpleNamespace(user_data={}))
+
+    assert databases(check) == main.ConversationHandler.END
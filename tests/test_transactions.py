@@ -0,0 +1,80 @@
+import main
+
+SAME_DATE = "2024-05-02T12:00:00"
+
+
+async def seed_ledger():
+    rows = [
+        ("c1", "deposit", "2024-05-01T09:00:00", 10),
+        ("c1", "transfer", SAME_DATE, 20),
+        ("c2", "transfer", SAME_DATE, 30),
+        ("c1", "withdraw", SAME_DATE, 40),
+        ("c2", "deposit", SAME_DATE, 50),
+        ("c1", "deposit", "2024-05-03T18:30:00", 60),
+        ("c2", "salary", "2024-05-04T00:00:00", 70),
+    ]
+    async with main.db_connection("bank") as db:
+        await db.executemany(
+            "INSERT INTO transactions (user_id, type, date, amount, comment) VALUES (?, ?, ?, ?, '')", rows
+        )
+        await db.commit()
+
+
+async def walk_forward(limit, **filters):
+    pages, cursor = [], None
+    while True:
+        page, has_more = await main.get_transactions(cursor, False, limit, **filters)
+        pages.append([row["id"] for row in page])
+        if not has_more:
+            return pages
+        cursor = (page[-1]["date"], page[-1]["id"])
+
+
+def test_keyset_pages_cover_ties_on_date_and_id(databases):
+    async def check():
+        await seed_ledger()
+        pages = await walk_forward(2)
+        # Назад от первой строки третьей страницы - ровно вторая страница
+        cursor = None
+        for _ in range(2):
+            page, _ = await main.get_transactions(cursor, False, 2)
+            cursor = (page[-1]["date"], page[-1]["id"])
+        third, _ = await main.get_transactions(cursor, False, 2)
+        back, back_more = await main.get_transactions((third[0]["date"], third[0]["id"]), True, 2)
+        first_back, first_more = await main.get_transactions((back[0]["date"], back[0]["id"]), True, 2)
+        return pages, [row["id"] for row in back], back_more, [row["id"] for row in first_back], first_more
+
+    pages, back, back_more, first_back, first_more = databases(check)
+
+    # Порядок (date DESC, id DESC): строки с одинаковой датой идут по убыванию id
+    assert pages == [[7, 6], [5, 4], [3, 2], [1]]
+    assert back == [5, 4] and back_more
+    assert first_back == [7, 6] and not first_more
+
+
+def test_filters_from_command_arguments(databases):
+    async def check():
+        await seed_ledger()
+        async with main.db_connection("civilian") as db:
+            await db.execute("INSERT INTO civilians (id, nickname, telegram_uid, role) VALUES ('c1', 'alice', '10', 'resident')")
+            await db.commit()
+        filters = await main.parse_transaction_filters(["user=alice", "from=2024-05-02", "to=2024-05-02"])
+        by_user = await walk_forward(2, **filters)
+        by_type = await walk_forward(10, **await main.parse_transaction_filters(["type=deposit"]))
+        errors = []
+        for args in (["type=bonus"], ["from=02.05.2024"], ["user=nobody"], ["page=2"]):
+            try:
+                await main.parse_transaction_filters(args)
+            except ValueError as e:
+                errors.append(str(e))
+        message, _ = await main.render_transactions_page(filters)
+        return filters, by_user, by_type, errors, message
+
+    filters, by_user, by_type, errors, message = databases(check)
+
+    assert filters == {"user_id": "c1", "date_from": "2024-05-02", "date_to": "2024-05-03"}
+    assert by_user == [[4, 2]]
+    assert by_type == [[6, 5, 1]]
+    assert len(errors) == 4
+    assert "Фильтр: житель c1, с 2024-05-02, до 2024-05-03" in message
+    assert message.count("📅") == 2
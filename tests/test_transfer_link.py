@@ -0,0 +1,68 @@
+import re
+from types import SimpleNamespace
+
+import main
+
+
+def test_link_payload_round_trip():
+    for resident_id in ["42", "AbC-7", "ид/1"]:
+        payload = main.transfer_link_payload(resident_id)
+        assert re.fullmatch(r"[A-Za-z0-9_-]{1,64}", payload)
+        assert main.parse_transfer_link_payload(payload) == resident_id
+    assert main.parse_transfer_link_payload("transfer_%%%") is None
+
+
+async def add_residents():
+    async with main.db_connection("civilian") as db:
+        await db.executemany(
+            "INSERT INTO civilians (id, nickname, telegram_uid, role) VALUES (?, ?, ?, 'resident')",
+            [("me", "me", "10"), ("AbC7", "zed", "11")]
+        )
+        await db.commit()
+    await main.rebuild_resident_index()
+
+
+def test_inline_result_links_to_private_chat(databases):
+    answers = []
+
+    async def answer(results, **kwargs):
+        answers.append(results)
+
+    async def check():
+        await add_residents()
+        update = SimpleNamespace(inline_query=SimpleNamespace(
+            from_user=SimpleNamespace(id=10), query=" AbC7 ", answer=answer
+        ))
+        context = SimpleNamespace(bot=SimpleNamespace(username="wvr_bot"))
+        await main.resident_inline_query(update, context)
+
+    databases(check)
+
+    [result] = answers[0]
+    assert result.id == "AbC7"
+    url = result.reply_markup.inline_keyboard[0][0].url
+    assert url == f"https://t.me/wvr_bot?start={main.transfer_link_payload('AbC7')}"
+    assert not result.input_message_content.message_text.startswith("/")
+
+
+def test_transfer_link_keeps_unrelated_user_data(databases):
+    replies = []
+
+    async def reply_text(text, **kwargs):
+        replies.append(text)
+
+    async def check():
+        await add_residents()
+        update = SimpleNamespace(effective_user=SimpleNamespace(id=10), message=SimpleNamespace(reply_text=reply_text))
+        context = SimpleNamespace(
+            args=[main.transfer_link_payload("AbC7")],
+            user_data={"batch_rows": [1, 2], "transfer_amount": 5, "transfer_comment": "old"}
+        )
+        state = await main.transfer_link_start(update, context)
+        return state, context.user_data
+
+    state, user_data = databases(check)
+
+    assert state == main.TRANSFER_AMOUNT
+    assert user_data == {"batch_rows": [1, 2], "transfer_recipient_id": "AbC7",
+                         "transfer_recipient_nick": "zed", "transfer_recipient_uid": "11"}
@@ -0,0 +1,58 @@
+import asyncio
+import random
+
+import main
+
+ACCOUNTS = 10
+INITIAL = 50
+
+
+async def seed_accounts():
+    ids = [f"r{i}" for i in range(ACCOUNTS)]
+    async with main.db_connection("civilian") as db:
+        await db.executemany(
+            "INSERT INTO civilians (id, nickname, telegram_uid, role) VALUES (?, ?, ?, 'resident')",
+            [(user_id, user_id, str(100 + i)) for i, user_id in enumerate(ids)]
+        )
+        await db.commit()
+    async with main.db_connection("bank") as db:
+        await db.executemany("INSERT INTO accounts (id, balance) VALUES (?, ?)", [(user_id, INITIAL) for user_id in ids])
+        await db.commit()
+    return ids
+
+
+async def balances():
+    async with main.db_connection("bank") as db:
+        cursor = await db.execute("SELECT id, balance FROM accounts ORDER BY id")
+        return dict(await cursor.fetchall())
+
+
+def test_concurrent_transfers_conserve_money(databases):
+    rng = random.Random(7)
+
+    async def check():
+        ids = await seed_accounts()
+        jobs = []
+        for _ in range(400):
+            sender, recipient = rng.sample(range(ACCOUNTS), 2)
+            jobs.append(main.transfer_money(str(100 + sender), ids[recipient], rng.randint(1, 40)))
+        # Перевод на несуществующий счет откатывает и списание
+        jobs.append(main.transfer_money("100", "nobody", 1))
+        results = await asyncio.gather(*jobs)
+
+        async with main.db_connection("bank") as db:
+            cursor = await db.execute("SELECT user_id, to_user, amount FROM transactions WHERE type = 'transfer'")
+            ledger = await cursor.fetchall()
+        return results, ledger, await balances(), main.BANK_WRITER.batches, main.BANK_WRITER.operations
+
+    results, ledger, after, batches, operations = databases(check)
+
+    assert results[-1] is False
+    assert sum(results) == len(ledger) > 0
+    assert min(after.values()) >= 0
+    assert sum(after.values()) == ACCOUNTS * INITIAL
+    for user_id, balance in after.items():
+        received = sum(amount for _, to_user, amount in ledger if to_user == user_id)
+        sent = sum(amount for from_user, _, amount in ledger if from_user == user_id)
+        assert balance == INITIAL + received - sent
+    assert batches < operations